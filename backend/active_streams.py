@@ -0,0 +1,115 @@
+"""
+Shared snapshot of active streams
+=================================
+
+/api/streams/active is served from one in-memory snapshot per worker instead
+of a query per client. The snapshot is rebuilt when create_stream/end_stream
+invalidate it, or once it is older than ACTIVE_STREAMS_TTL_SECONDS. Pages of
+the default size are serialized to JSON bytes (with their ETag) once per
+rebuild, so a request is a dict lookup.
+
+Pages use keyset cursors over (started_at, id), newest first. A cursor stays
+meaningful across rebuilds even if streams before it have ended.
+"""
+
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STREAMS_TTL_SECONDS = float(os.getenv("ACTIVE_STREAMS_TTL_SECONDS", "2"))
+ACTIVE_STREAMS_PAGE_SIZE = 50
+ACTIVE_STREAMS_MAX_PAGE_SIZE = 100
+ACTIVE_STREAMS_SNAPSHOT_LIMIT = int(os.getenv("ACTIVE_STREAMS_SNAPSHOT_LIMIT", "5000"))
+
+# Large internal fields never sent to clients
+EXCLUDED_FIELDS = {"_id": 0, "unique_viewers_hll": 0}
+
+
+def encode_cursor(key: Tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(f"{key[0]}|{key[1]}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    started_at, stream_id = raw.split("|", 1)
+    return started_at, stream_id
+
+
+def _stream_key(stream: dict) -> Tuple[str, str]:
+    return str(stream.get("started_at") or ""), str(stream.get("id") or "")
+
+
+class ActiveStreamsCache:
+    def __init__(self, db, ttl: float = ACTIVE_STREAMS_TTL_SECONDS, page_size: int = ACTIVE_STREAMS_PAGE_SIZE):
+        self.db = db
+        self.ttl = ttl
+        self.page_size = page_size
+        self._streams: List[dict] = []  # Newest first
+        self._asc_keys: List[Tuple[str, str]] = []  # Oldest first, for bisect
+        self._pages: Dict[Optional[str], Tuple[bytes, str]] = {}  # cursor -> (body, etag)
+        self._built_at = 0.0
+        self._stale = True
+        self._lock = asyncio.Lock()
+
+    def invalidate(self) -> None:
+        self._stale = True
+
+    def _is_fresh(self) -> bool:
+        return not self._stale and time.monotonic() - self._built_at < self.ttl
+
+    async def _refresh(self) -> None:
+        async with self._lock:
+            # Another request may have rebuilt it while we waited
+            if self._is_fresh():
+                return
+            self._stale = False
+            streams = await self.db.streams.find(
+                {"is_live": True},
+                EXCLUDED_FIELDS
+            ).sort([("started_at", -1), ("id", -1)]).to_list(ACTIVE_STREAMS_SNAPSHOT_LIMIT)
+
+            streams.sort(key=_stream_key, reverse=True)
+            self._streams = streams
+            self._asc_keys = [_stream_key(s) for s in reversed(streams)]
+            self._pages = {}
+            cursor = None
+            for start in range(0, max(len(streams), 1), self.page_size):
+                self._pages[cursor] = self._serialize(start, self.page_size)
+                end = start + self.page_size
+                if end >= len(streams):
+                    break
+                cursor = encode_cursor(_stream_key(streams[end - 1]))
+            self._built_at = time.monotonic()
+
+    def _start_index(self, cursor: Optional[str]) -> int:
+        if not cursor:
+            return 0
+        key = decode_cursor(cursor)
+        # Streams strictly older than the cursor key, newest first
+        older = bisect_left(self._asc_keys, key)
+        return len(self._streams) - older
+
+    def _serialize(self, start: int, limit: int) -> Tuple[bytes, str]:
+        page = self._streams[start:start + limit]
+        end = start + limit
+        next_cursor = encode_cursor(_stream_key(page[-1])) if page and end < len(self._streams) else None
+        body = json.dumps({"streams": page, "next_cursor": next_cursor}, default=str).encode()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        return body, etag
+
+    async def get_page(self, cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[bytes, str]:
+        """Return (json_body, etag) for the page after cursor."""
+        if not self._is_fresh():
+            await self._refresh()
+        limit = max(1, min(limit or self.page_size, ACTIVE_STREAMS_MAX_PAGE_SIZE))
+        if limit == self.page_size and cursor in self._pages:
+            return self._pages[cursor]
+        return self._serialize(self._start_index(cursor), limit)
@@ -0,0 +1,54 @@
+"""
+Cached Agora RTC token issuance
+===============================
+
+Tokens are valid for AGORA_TOKEN_TTL_SECONDS (24h), so rebuilding one for
+every request is wasted HMAC work. Tokens are cached per (channel, uid, role)
+and reissued once less than AGORA_TOKEN_REFRESH_MARGIN_SECONDS of validity
+remain, so a cached token always has at least that much life.
+"""
+
+from cachetools import LRUCache
+from agora_token_builder import RtcTokenBuilder
+from typing import Tuple
+import os
+import time
+
+AGORA_TOKEN_TTL_SECONDS = 3600 * 24
+AGORA_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("AGORA_TOKEN_REFRESH_MARGIN_SECONDS", "3600"))
+AGORA_TOKEN_CACHE_SIZE = int(os.getenv("AGORA_TOKEN_CACHE_SIZE", "100000"))
+
+# Role: 1 for host (publisher), 2 for audience (subscriber)
+ROLE_PUBLISHER = 1
+ROLE_SUBSCRIBER = 2
+
+
+def agora_role(role: str) -> int:
+    return ROLE_PUBLISHER if role == 'host' else ROLE_SUBSCRIBER
+
+
+class AgoraTokenCache:
+    def __init__(self, app_id: str, app_certificate: str, max_entries: int = AGORA_TOKEN_CACHE_SIZE):
+        self.app_id = app_id
+        self.app_certificate = app_certificate
+        # (channel, uid, role) -> (token, expires_at)
+        self._tokens = LRUCache(maxsize=max_entries)
+
+    def _get(self, channel_name: str, uid: int, role: int) -> Tuple[str, int]:
+        key = (channel_name, uid, role)
+        now = int(time.time())
+        cached = self._tokens.get(key)
+        if cached and cached[1] - now > AGORA_TOKEN_REFRESH_MARGIN_SECONDS:
+            return cached
+
+        expires_at = now + AGORA_TOKEN_TTL_SECONDS
+        token = RtcTokenBuilder.buildTokenWithUid(
+            self.app_id, self.app_certificate, channel_name, uid, role, expires_at
+        )
+        self._tokens[key] = (token, expires_at)
+        return token, expires_at
+
+    def token_for_uid(self, channel_name: str, uid: int, role: str) -> Tuple[str, int]:
+        """Return (token, expires_at) for a numeric uid."""
+        return self._get(channel_name, uid, agora_role(role))
+
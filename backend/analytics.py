@@ -14,6 +14,7 @@ class StreamAnalytics(BaseModel):
     current_viewers: int
     peak_viewers: int
     avg_viewers: int
+    unique_viewers: int
     total_messages: int
     messages_per_minute: float
     total_gifts: int
@@ -28,7 +29,7 @@ class StreamAnalytics(BaseModel):
 async def get_live_analytics(stream_id: str, req: Request):
     """Get real-time analytics for a stream (for host overlay)"""
     from auth import get_current_user
-    from server import db
+    from server import db, presence
     
     try:
         current_user = await get_current_user(req)
@@ -40,6 +41,11 @@ async def get_live_analytics(stream_id: str, req: Request):
         if not stream:
             raise HTTPException(status_code=404, detail="Stream not found")
         
+        # Prefer live presence counts over the last flushed values
+        live_counts = presence.stats(stream_id)
+        if live_counts:
+            stream.update(live_counts)
+        
         # Calculate analytics
         current_viewers = stream.get("viewer_count", 0)
         
@@ -85,6 +91,7 @@ async def get_live_analytics(stream_id: str, req: Request):
             "current_viewers": current_viewers,
             "peak_viewers": stream.get("peak_viewers", current_viewers),
             "avg_viewers": stream.get("avg_viewers", current_viewers),
+            "unique_viewers": stream.get("unique_viewers", 0),
             "total_messages": total_messages,
             "messages_per_minute": recent_messages,
             "total_gifts": total_gifts,
@@ -92,7 +99,7 @@ async def get_live_analytics(stream_id: str, req: Request):
             "sentiment_score": sentiment_score,
             "trending_topics": [],  # TODO: Extract from chat
             "engagement_rate": round(engagement_rate, 2),
-            "new_followers": 0  # TODO: Track follower growth
+            "new_followers": stream.get("new_followers", 0)
         }
         
     except HTTPException:
@@ -3,14 +3,28 @@ from fastapi.responses import RedirectResponse
 from pydantic import BaseModel, EmailStr
 from datetime import datetime, timezone, timedelta
 from typing import Optional
+from cachetools import TTLCache
 import httpx
 import secrets
 import logging
 import os
 from email_service import send_welcome_email, EmailDeliveryError
+import session_tokens
 
 logger = logging.getLogger(__name__)
 
+# Session cache: session_token -> (User, expires_at). TTLCache evicts LRU once full,
+# so the TTL bounds how long another worker's logout can go unnoticed here.
+SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "60"))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "50000"))
+
+SESSION_LIFETIME = timedelta(days=7)
+
+_session_cache = TTLCache(maxsize=SESSION_CACHE_MAX_ENTRIES, ttl=SESSION_CACHE_TTL_SECONDS)
+# user_id -> tokens cached for that user. Re-set on every insert with the same TTL,
+# so an index entry outlives all of its tokens.
+_user_session_tokens = TTLCache(maxsize=SESSION_CACHE_MAX_ENTRIES, ttl=SESSION_CACHE_TTL_SECONDS)
+
 router = APIRouter(prefix="/api/auth", tags=["authentication"])
 
 # Models
@@ -34,63 +48,150 @@ class UserSession(BaseModel):
     expires_at: datetime
     created_at: datetime
 
+# Emergent Auth HTTP client, shared for the application lifetime
+EMERGENT_AUTH_URL = "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data"
+AUTH_HTTP_MAX_CONNECTIONS = int(os.getenv("AUTH_HTTP_MAX_CONNECTIONS", "100"))
+AUTH_HTTP_MAX_KEEPALIVE = int(os.getenv("AUTH_HTTP_MAX_KEEPALIVE", "20"))
+AUTH_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AUTH_HTTP_KEEPALIVE_EXPIRY", "30"))
+AUTH_HTTP_TIMEOUT = float(os.getenv("AUTH_HTTP_TIMEOUT", "10"))
+
+# session_ids Emergent already rejected; replays fail fast without a network call
+INVALID_SESSION_ID_TTL_SECONDS = int(os.getenv("INVALID_SESSION_ID_TTL_SECONDS", "30"))
+_invalid_session_ids = TTLCache(maxsize=10000, ttl=INVALID_SESSION_ID_TTL_SECONDS)
+NEGATIVE_CACHE_STATUS_CODES = {401, 403, 404}
+
+_auth_client: Optional[httpx.AsyncClient] = None
+
+def get_auth_client() -> httpx.AsyncClient:
+    """Return the pooled keep-alive client, creating it on first use."""
+    global _auth_client
+    if _auth_client is None or _auth_client.is_closed:
+        _auth_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=AUTH_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=AUTH_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=AUTH_HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=AUTH_HTTP_TIMEOUT
+        )
+    return _auth_client
+
+async def close_auth_client() -> None:
+    """Close the pooled client (called on application shutdown)."""
+    global _auth_client
+    if _auth_client is not None:
+        await _auth_client.aclose()
+        _auth_client = None
+
 # Helper functions
 async def exchange_session_id(session_id: str) -> dict:
     """Exchange session_id for session data from Emergent Auth API."""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_id},
-                timeout=10.0
-            )
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            logger.error(f"Failed to exchange session_id: {e}")
-            raise HTTPException(status_code=401, detail="Invalid session")
-
-async def get_current_user(request: Request) -> Optional[User]:
-    """Get current user from session token (cookie or header)."""
-    from server import db
+    if session_id in _invalid_session_ids:
+        raise HTTPException(status_code=401, detail="Invalid session")
     
-    # Try to get token from cookie first
+    try:
+        response = await get_auth_client().get(
+            EMERGENT_AUTH_URL,
+            headers={"X-Session-ID": session_id}
+        )
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        # Only cache definitive rejections; 408/429 and 5xx are transient
+        if e.response.status_code in NEGATIVE_CACHE_STATUS_CODES:
+            _invalid_session_ids[session_id] = True
+        logger.error(f"Failed to exchange session_id: {e}")
+        raise HTTPException(status_code=401, detail="Invalid session")
+    except Exception as e:
+        logger.error(f"Failed to exchange session_id: {e}")
+        raise HTTPException(status_code=401, detail="Invalid session")
+
+def invalidate_session(session_token: str) -> None:
+    """Drop a single session token from the cache."""
+    _session_cache.pop(session_token, None)
+
+def cache_session(session_token: str, user: "User", expires_at: datetime) -> None:
+    """Cache a verified session and index it under its user."""
+    _session_cache[session_token] = (user, expires_at)
+    tokens = {token for token in _user_session_tokens.get(user.user_id, ()) if token in _session_cache}
+    tokens.add(session_token)
+    _user_session_tokens[user.user_id] = tokens
+
+def invalidate_user_sessions(user_id: str) -> None:
+    """Drop every cached session belonging to a user."""
+    for token in _user_session_tokens.pop(user_id, ()):
+        _session_cache.pop(token, None)
+
+def get_session_token(request: Request) -> Optional[str]:
+    """Read the session token from the cookie, falling back to the Authorization header."""
     session_token = request.cookies.get("session_token")
     
-    # Fallback to Authorization header
     if not session_token:
         auth_header = request.headers.get("Authorization", "")
         if auth_header.startswith("Bearer "):
             session_token = auth_header.split(" ")[1]
     
-    if not session_token:
-        return None
+    return session_token
+
+async def get_current_user(request: Request) -> Optional[User]:
+    """Get current user from session token (cookie or header)."""
+    from server import db
     
-    # Find session in database
-    session = await db.user_sessions.find_one(
-        {"session_token": session_token},
-        {"_id": 0}
-    )
+    session_token = get_session_token(request)
     
-    if not session:
+    if not session_token:
         return None
     
-    # Check if session is expired (normalize timezone-naive datetimes)
-    expires_at = session["expires_at"]
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    # Signed tokens are checked on every request so revocations apply immediately
+    claims = None
+    if session_tokens.signed_mode_enabled() and session_tokens.is_signed_token(session_token):
+        claims = session_tokens.verify_token(session_token)
+        if not claims:
+            invalidate_session(session_token)
+            return None
     
-    if expires_at <= datetime.now(timezone.utc):
+    # Serve from cache while the session itself is still valid
+    cached = _session_cache.get(session_token)
+    if cached:
+        user, expires_at = cached
+        if expires_at > datetime.now(timezone.utc):
+            return user
+        invalidate_session(session_token)
         return None
     
+    if claims:
+        user_id, expires_at, _ = claims
+    else:
+        # Find session in database
+        session = await db.user_sessions.find_one(
+            {"session_token": session_token},
+            {"_id": 0}
+        )
+        
+        if not session:
+            return None
+        
+        # Check if session is expired (normalize timezone-naive datetimes)
+        expires_at = session["expires_at"]
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        
+        if expires_at <= datetime.now(timezone.utc):
+            return None
+        
+        user_id = session["user_id"]
+    
     # Get user data
     user_doc = await db.users.find_one(
-        {"user_id": session["user_id"]},
+        {"user_id": user_id},
         {"_id": 0}
     )
     
     if user_doc:
-        return User(**user_doc)
+        user = User(**user_doc)
+        cache_session(session_token, user, expires_at)
+        return user
     return None
 
 # Routes
@@ -139,26 +240,39 @@ async def create_session(request: Request, response: Response, background_tasks:
     else:
         user_id = existing_user["user_id"]
     
-    # Create session in database
-    session_doc = {
-        "user_id": user_id,
-        "session_token": session_response.session_token,
-        "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
-        "created_at": datetime.now(timezone.utc)
-    }
+    expires_at = datetime.now(timezone.utc) + SESSION_LIFETIME
     
-    # Upsert session (replace if exists)
-    await db.user_sessions.update_one(
-        {"user_id": user_id},
-        {"$set": session_doc},
-        upsert=True
-    )
+    if session_tokens.signed_mode_enabled():
+        # Stateless mode: the token itself is the session record. Like the
+        # database upsert below, a new login replaces the user's earlier tokens.
+        await session_tokens.revoke_user_tokens(user_id, expires_at, db)
+        session_token = session_tokens.issue_token(user_id, expires_at)
+    else:
+        session_token = session_response.session_token
+        
+        # Create session in database
+        session_doc = {
+            "user_id": user_id,
+            "session_token": session_token,
+            "expires_at": expires_at,
+            "created_at": datetime.now(timezone.utc)
+        }
+        
+        # Upsert session (replace if exists)
+        await db.user_sessions.update_one(
+            {"user_id": user_id},
+            {"$set": session_doc},
+            upsert=True
+        )
+    
+    # The upsert replaced any previous token for this user
+    invalidate_user_sessions(user_id)
     
     # Set httpOnly cookie
     response.set_cookie(
         key="session_token",
-        value=session_response.session_token,
-        max_age=7 * 24 * 60 * 60,  # 7 days
+        value=session_token,
+        max_age=int(SESSION_LIFETIME.total_seconds()),
         httponly=True,
         secure=True,  # In production with HTTPS
         samesite="none",
@@ -170,7 +284,7 @@ async def create_session(request: Request, response: Response, background_tasks:
         "email": session_response.email,
         "name": session_response.name,
         "picture": session_response.picture,
-        "session_token": session_response.session_token,
+        "session_token": session_token,
         "is_new_user": is_new_user
     }
 
@@ -184,14 +298,25 @@ async def get_me(current_user: User = Depends(get_current_user)):
 
 @router.post("/logout")
 async def logout(request: Request, response: Response, current_user: User = Depends(get_current_user)):
-    """Logout and clear session."""
+    """Logout and clear session.
+    
+    Ends all of the user's sessions in both token modes. Other workers reject
+    revoked signed tokens after their next revocation refresh (REVOCATION_REFRESH_SECONDS).
+    """
     from server import db
     
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    # Revoke every signed token issued so far (stateless mode) so all workers reject them
+    if session_tokens.signed_mode_enabled():
+        await session_tokens.revoke_user_tokens(
+            current_user.user_id, datetime.now(timezone.utc) + SESSION_LIFETIME, db
+        )
+    
     # Delete session from database
     await db.user_sessions.delete_many({"user_id": current_user.user_id})
+    invalidate_user_sessions(current_user.user_id)
     
     # Clear cookie
     response.delete_cookie("session_token", path="/")
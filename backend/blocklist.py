@@ -0,0 +1,103 @@
+"""
+Per-creator blocked-word matching
+=================================
+
+Each creator's `moderation_settings.blocked_words` is compiled once into an
+Aho-Corasick automaton, so a chat message is scanned for every blocked word
+in a single pass over its text. Matching is done on the same NFKC-casefolded
+form the moderation cache uses and only counts whole words/phrases ("ass"
+does not match "class").
+
+Compiled matchers are cached per creator together with the settings'
+updated_at. update_moderation_settings rebuilds the entry directly; other
+workers notice the newer updated_at and rebuild on their next lookup.
+"""
+
+from cachetools import LRUCache
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+
+from moderation_cache import normalize_text
+
+BLOCKLIST_CACHE_SIZE = int(os.getenv("BLOCKLIST_CACHE_SIZE", "10000"))
+
+
+class BlocklistMatcher:
+    """Aho-Corasick automaton over a fixed set of words."""
+
+    def __init__(self, words: Iterable[str]):
+        self.words: List[str] = sorted({normalize_text(w) for w in words if w and normalize_text(w)})
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[int, ...]] = [()]  # word indexes ending at each state
+
+        for index, word in enumerate(self.words):
+            state = 0
+            for char in word:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                state = next_state
+            self._output[state] += (index,)
+
+        # Breadth-first failure links; outputs inherit their failure state's outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def __bool__(self) -> bool:
+        return bool(self.words)
+
+    def find(self, text: str) -> Optional[str]:
+        """Return the first blocked word found in text as a whole word, or None."""
+        if not self.words:
+            return None
+        text = normalize_text(text)
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for index in self._output[state]:
+                word = self.words[index]
+                start = end - len(word) + 1
+                if (start == 0 or not text[start - 1].isalnum()) and \
+                        (end + 1 == len(text) or not text[end + 1].isalnum()):
+                    return word
+        return None
+
+
+_EMPTY = BlocklistMatcher([])
+
+# creator_id -> (settings updated_at, matcher)
+_matchers: LRUCache = LRUCache(maxsize=BLOCKLIST_CACHE_SIZE)
+
+
+def rebuild(creator_id: str, words: Iterable[str], updated_at=None) -> BlocklistMatcher:
+    """Compile and cache a creator's blocklist (called when settings change)."""
+    matcher = BlocklistMatcher(words) if words else _EMPTY
+    _matchers[creator_id] = (updated_at, matcher)
+    return matcher
+
+
+def matcher_for(creator_id: str, settings: Optional[dict]) -> BlocklistMatcher:
+    """Cached matcher for the given settings document, rebuilt if it is stale."""
+    if not settings:
+        return _EMPTY
+    updated_at = settings.get("updated_at")
+    cached = _matchers.get(creator_id)
+    if cached and cached[0] == updated_at:
+        return cached[1]
+    return rebuild(creator_id, settings.get("blocked_words") or [], updated_at)
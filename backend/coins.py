@@ -48,6 +48,7 @@ async def get_coin_bundles():
 async def purchase_coins(purchase: PurchaseCoins, req: Request):
     from auth import get_current_user
     from server import db
+    import wallets
     
     try:
         current_user = await get_current_user(req)
@@ -62,19 +63,13 @@ async def purchase_coins(purchase: PurchaseCoins, req: Request):
         
         logger.info(f"💳 MOCK PURCHASE: {bundle['name']} ({total_coins} coins)")
         
-        await db.wallets.update_one(
-            {"user_id": purchase.user_id},
-            {"$inc": {"balance": total_coins}},
-            upsert=True
-        )
-        
-        wallet = await db.wallets.find_one({"user_id": purchase.user_id})
+        new_balance = await wallets.credit(db, purchase.user_id, total_coins)
         
         return {
             "success": True,
             "coins_added": total_coins,
             "bonus_coins": bundle["bonus_coins"],
-            "new_balance": wallet["balance"],
+            "new_balance": new_balance,
             "mock_mode": True
         }
     except Exception as e:
@@ -0,0 +1,153 @@
+"""
+Materialized trending-creators view
+===================================
+
+A background job recomputes creator metrics from `streams` and `gifts` every
+CREATOR_RANKINGS_INTERVAL_SECONDS and upserts one row per creator into
+`creator_rankings`; /api/discover/trending-creators only reads that
+collection through its rank_score index.
+
+Metrics per creator:
+- stream_frequency: streams per week over the last 30 days
+- total_views: unique viewers summed over all streams (peak when unknown)
+- avg_viewers: mean of per-stream average viewers
+- growth_rate: views in the last 7 days vs the 7 days before
+- gift_volume_30d: coins received in gifts over the last 30 days (shown, not weighted)
+
+rank_score weights each metric after normalizing it by the highest value in
+the run. Follower counts are not part of it: the follow graph is not stored
+in MongoDB, and follows attributed to streams are not a follower count.
+
+Every API worker runs the loop, but a run first claims a lease in
+`job_leases` (an upsert on a fixed _id that only succeeds once the previous
+lease has expired), so the job runs once per interval across all workers.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+
+CREATOR_RANKINGS_INTERVAL_SECONDS = int(os.getenv("CREATOR_RANKINGS_INTERVAL_SECONDS", "600"))
+CREATOR_RANKINGS_POLL_SECONDS = 60  # How often each worker checks whether the lease is free
+
+LEASE_ID = "creator_rankings"
+
+RANKING_WEIGHTS = {
+    "avg_viewers": 0.35,
+    "total_views": 0.3,
+    "stream_frequency": 0.2,
+    "growth_rate": 0.15,
+}
+
+_task: Optional[asyncio.Task] = None
+
+
+async def compute_creator_rankings(db) -> int:
+    """Rebuild creator_rankings. Returns the number of creators ranked."""
+    now = datetime.now(timezone.utc)
+    # streams store naive UTC ISO strings, which compare correctly as strings
+    cutoff_30d = (now - timedelta(days=30)).replace(tzinfo=None).isoformat()
+    cutoff_7d = (now - timedelta(days=7)).replace(tzinfo=None).isoformat()
+    cutoff_14d = (now - timedelta(days=14)).replace(tzinfo=None).isoformat()
+
+    views = {"$ifNull": ["$unique_viewers", {"$ifNull": ["$peak_viewers", 0]}]}
+    creators = await db.streams.aggregate([
+        {"$match": {"host_id": {"$ne": None}}},
+        {"$group": {
+            "_id": "$host_id",
+            "total_streams": {"$sum": 1},
+            "streams_30d": {"$sum": {"$cond": [{"$gte": ["$started_at", cutoff_30d]}, 1, 0]}},
+            "total_views": {"$sum": views},
+            "avg_viewers": {"$avg": {"$ifNull": ["$avg_viewers", 0]}},
+            "views_7d": {"$sum": {"$cond": [{"$gte": ["$started_at", cutoff_7d]}, views, 0]}},
+            "views_prev_7d": {"$sum": {"$cond": [
+                {"$and": [{"$gte": ["$started_at", cutoff_14d]}, {"$lt": ["$started_at", cutoff_7d]}]},
+                views, 0
+            ]}},
+        }}
+    ], allowDiskUse=True).to_list(None)
+
+    gift_volume = {
+        row["_id"]: row["total"]
+        for row in await db.gifts.aggregate([
+            {"$match": {"created_at": {"$gte": cutoff_30d}}},
+            {"$group": {"_id": "$recipient_id", "total": {"$sum": "$gift_price"}}}
+        ], allowDiskUse=True).to_list(None)
+    }
+
+    rows = []
+    for creator in creators:
+        prior = creator["views_prev_7d"]
+        rows.append({
+            "creator_id": creator["_id"],
+            "stream_frequency": round(creator["streams_30d"] / 30 * 7, 2),
+            "total_streams": creator["total_streams"],
+            "total_views": creator["total_views"],
+            "avg_viewers": round(creator["avg_viewers"] or 0, 1),
+            "growth_rate": round((creator["views_7d"] - prior) / prior, 3) if prior else float(creator["views_7d"] > 0),
+            "gift_volume_30d": gift_volume.get(creator["_id"], 0),
+        })
+
+    peaks = {name: max((max(row[name], 0) for row in rows), default=0) or 1 for name in RANKING_WEIGHTS}
+    for row in rows:
+        score = sum(weight * max(row[name], 0) / peaks[name] for name, weight in RANKING_WEIGHTS.items())
+        row["rank_score"] = round(score * 100, 2)
+        row["computed_at"] = now
+
+    if rows:
+        await db.creator_rankings.bulk_write(
+            [ReplaceOne({"creator_id": row["creator_id"]}, row, upsert=True) for row in rows],
+            ordered=False
+        )
+    # Creators whose streams were all removed drop out of the view
+    await db.creator_rankings.delete_many({"computed_at": {"$lt": now}})
+
+    logger.info(f"Creator rankings recomputed for {len(rows)} creators")
+    return len(rows)
+
+
+async def claim_run(db, interval_seconds: int = CREATOR_RANKINGS_INTERVAL_SECONDS) -> bool:
+    """Take the lease for the next run if the previous one has expired."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.job_leases.update_one(
+            {"_id": LEASE_ID, "expires_at": {"$lte": now}},
+            {"$set": {
+                "expires_at": now + timedelta(seconds=interval_seconds),
+                "owner": f"{socket.gethostname()}:{os.getpid()}"
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False  # Lease held by a run started less than an interval ago
+    return True
+
+
+async def _run(db) -> None:
+    while True:
+        try:
+            if await claim_run(db):
+                await compute_creator_rankings(db)
+        except Exception as e:
+            logger.error(f"Creator rankings job error: {e}")
+        await asyncio.sleep(CREATOR_RANKINGS_POLL_SECONDS)
+
+
+async def start(db) -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run(db))
+
+
+async def stop() -> None:
+    global _task
+    if _task:
+        _task.cancel()
+        _task = None
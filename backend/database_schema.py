@@ -41,6 +41,8 @@ COLLECTIONS_SCHEMA = {
             "total_xp": 0,
             "battle_wins": 0,
             "battle_total": 0,
+            "rating": 1500.0,  # Battle skill rating (team Elo)
+            "rating_games": 0,
             "loyalty_points": 0,
             # Analytics tracking
             "streams_watched": 0,
@@ -69,6 +71,32 @@ COLLECTIONS_SCHEMA = {
         }
     },
     
+    "revoked_sessions": {
+        "description": "Revoked signed session tokens (SESSION_TOKEN_MODE=signed)",
+        "indexes": [
+            {"keys": [("token_id", 1)], "unique": True},
+            {"keys": [("expires_at", 1)], "expireAfterSeconds": 0}
+        ],
+        "sample_document": {
+            "token_id": "9f86d081884c7d65",
+            "expires_at": datetime.now(timezone.utc)
+        }
+    },
+
+    "session_revocations": {
+        "description": "Per-user signed token cutoffs set on login/logout (SESSION_TOKEN_MODE=signed)",
+        "indexes": [
+            {"keys": [("user_id", 1)], "unique": True},
+            {"keys": [("revoked_before", 1)]},
+            {"keys": [("expires_at", 1)], "expireAfterSeconds": 0}
+        ],
+        "sample_document": {
+            "user_id": "user_abc123",
+            "revoked_before": datetime.now(timezone.utc),  # Tokens issued earlier are rejected
+            "expires_at": datetime.now(timezone.utc)  # Newest revoked token's expiry
+        }
+    },
+    
     "temp_2fa_setup": {
         "description": "Temporary 2FA setup data (expires in 15 minutes)",
         "indexes": [
@@ -99,6 +127,7 @@ COLLECTIONS_SCHEMA = {
             "region": "global",
             "is_leader": True,
             "team_members": ["user_def456"],
+            "rating": 1500.0,  # Copied from users.rating at join time
             "status": "waiting",  # waiting, matched, expired
             "match_id": None,
             "joined_at": datetime.now(timezone.utc),
@@ -120,6 +149,7 @@ COLLECTIONS_SCHEMA = {
             "status": "forming",  # forming, in_progress, completed
             "team_a_score": 0,
             "team_b_score": 0,
+            "applied_score_batches": [],  # Gift ledger score increment ids already applied
             "duration_seconds": 180,
             "region": "global",
             "winner": None,  # team_a, team_b, tie
@@ -139,6 +169,7 @@ COLLECTIONS_SCHEMA = {
         "sample_document": {
             "match_id": "battle_abc123",
             "user_id": "user_abc123",
+            "agora_uid": 184467301,  # Nonzero numeric uid the participant joins the battle channel as
             "team": "team_a",  # team_a, team_b
             "status": "pending",  # pending, ready, active, completed
             "ready": False,
@@ -229,9 +260,27 @@ COLLECTIONS_SCHEMA = {
         }
     },
     
+    "transactions": {
+        "description": "Wallet transaction history",
+        "indexes": [
+            {"keys": [("id", 1)], "unique": True},
+            # Keyset pagination of a user's history, newest first
+            {"keys": [("user_id", 1), ("created_at", -1), ("id", -1)]}
+        ],
+        "sample_document": {
+            "id": "0b6f3c1e-8f0a-4d4e-9a53-2f1c5a7e9d10",
+            "user_id": "user_abc123",
+            "amount": -10,
+            "type": "gift_sent",  # purchase, gift_sent, gift_received, withdrawal
+            "description": "Sent Star gift",
+            "created_at": datetime.now(timezone.utc)
+        }
+    },
+    
     "gifts": {
         "description": "Gift transactions",
         "indexes": [
+            {"keys": [("id", 1)], "unique": True},
             {"keys": [("stream_id", 1)]},
             {"keys": [("sender_id", 1)]},
             {"keys": [("receiver_id", 1)]},
@@ -248,6 +297,24 @@ COLLECTIONS_SCHEMA = {
         }
     },
     
+    "gift_ledger_dead_letters": {
+        "description": "Paid gifts and battle score increments the write-behind ledger could not record "
+                       "(replayed on startup); score letters have type battle_score, match_id, increments and events",
+        "indexes": [
+            {"keys": [("id", 1)], "unique": True}
+        ],
+        "sample_document": {
+            "id": "uuid",
+            "gift": {"id": "gift_uuid", "stream_id": "stream_abc123", "sender_id": "user_abc123"},
+            "creator_amount": 7,
+            "recorded_at": datetime.now(timezone.utc),
+            "sent_txn_id": "uuid",
+            "received_txn_id": "uuid",
+            "error": "connection refused",
+            "failed_at": datetime.now(timezone.utc)
+        }
+    },
+    
     # ========== TOURNAMENTS ==========
     "tournaments": {
         "description": "Tournament metadata",
@@ -298,6 +365,7 @@ COLLECTIONS_SCHEMA = {
             "allowed_topics": ["politics", "sports"],
             "blocked_words": ["badword1", "badword2"],
             "auto_timeout_enabled": True,
+            "moderation_mode": "pre",  # pre (block until verdict) or post (publish, retract later)
             "updated_at": datetime.now(timezone.utc)
         }
     },
@@ -332,10 +400,73 @@ COLLECTIONS_SCHEMA = {
             "ai_score": 0.2,
             "reason": "Friendly banter",
             "strictness_level": "moderate",
+            "moderation_mode": "pre",
+            "message_id": "4f1c2a9e-8d3b-4c6e-9a7f-2b5d8e1c3a60",  # post-moderated messages only
+            "created_at": datetime.now(timezone.utc)
+        }
+    },
+    
+    "chat_retractions": {
+        "description": "Chat messages retracted after post-moderation",
+        "indexes": [
+            {"keys": [("stream_id", 1), ("created_at", 1)]}
+        ],
+        "sample_document": {
+            "stream_id": "stream_abc123",
+            "message_id": "4f1c2a9e-8d3b-4c6e-9a7f-2b5d8e1c3a60",
+            "user_id": "user_abc123",
+            "action": "timeout",
+            "reason": "Clearly offensive",
             "created_at": datetime.now(timezone.utc)
         }
     },
     
+    "stream_events": {
+        "description": "Sequenced per-stream event log, one document per time bucket",
+        "indexes": [
+            {"keys": [("stream_id", 1), ("bucket", 1)]},
+            {"keys": [("stream_id", 1), ("last_seq", 1)]},
+            {"keys": [("expires_at", 1)], "expireAfterSeconds": 0}
+        ],
+        "sample_document": {
+            "stream_id": "stream_abc123",
+            "bucket": datetime.now(timezone.utc),
+            "count": 2,
+            "first_seq": 41,
+            "last_seq": 42,
+            "expires_at": datetime.now(timezone.utc),
+            "events": [
+                {"seq": 41, "type": "gift", "data": {"gift_price": 100}, "ts": datetime.now(timezone.utc)},
+                {"seq": 42, "type": "reaction", "data": {"reaction_type": "fire", "intensity": 3},
+                 "ts": datetime.now(timezone.utc)}
+            ]
+        }
+    },
+    
+    "stream_event_counters": {
+        "description": "Last assigned event sequence number per stream",
+        "indexes": [
+            {"keys": [("stream_id", 1)], "unique": True}
+        ],
+        "sample_document": {
+            "stream_id": "stream_abc123",
+            "seq": 42
+        }
+    },
+    
+    "moderation_cache": {
+        "description": "Shared moderation verdict cache (MODERATION_CACHE_MONGO=true)",
+        "indexes": [
+            {"keys": [("key", 1)], "unique": True},
+            {"keys": [("expires_at", 1)], "expireAfterSeconds": 0}
+        ],
+        "sample_document": {
+            "key": "chat:moderate:9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
+            "result": {"action": "allow", "score": 0.1, "reason": "Friendly banter"},
+            "expires_at": datetime.now(timezone.utc)
+        }
+    },
+    
     # ========== ANALYTICS ==========
     "streams": {
         "description": "Stream metadata (extended from existing)",
@@ -343,6 +474,7 @@ COLLECTIONS_SCHEMA = {
             {"keys": [("id", 1)], "unique": True},
             {"keys": [("host_id", 1)]},
             {"keys": [("status", 1)]},
+            {"keys": [("is_live", 1), ("started_at", -1), ("id", -1)]},
             {"keys": [("created_at", -1)]}
         ],
         "sample_document": {
@@ -352,11 +484,78 @@ COLLECTIONS_SCHEMA = {
             "status": "live",  # live, ended
             "viewer_count": 0,
             "peak_viewers": 0,
-            "avg_viewers": 0,
+            "avg_viewers": 0,  # viewer_sample_total / viewer_sample_count
+            "viewer_sample_total": 0,  # Sum of presence viewer-count samples (all workers)
+            "viewer_sample_count": 0,
+            "unique_viewers": 0,
+            "new_followers": 0,
+            "new_creator": False,  # Host's first stream (trending new-creator boost)
             "created_at": datetime.now(timezone.utc)
         }
     },
     
+    "stream_follows": {
+        "description": "Follows attributed to a stream (one per viewer and stream)",
+        "indexes": [
+            {"keys": [("stream_id", 1), ("follower_id", 1)], "unique": True}
+        ],
+        "sample_document": {
+            "stream_id": "stream_abc123",
+            "follower_id": "user_abc123",
+            "created_at": datetime.now(timezone.utc)
+        }
+    },
+    
+    "stream_views": {
+        "description": "First view of a stream per signed-in user (dedupes streams_watched)",
+        "indexes": [
+            {"keys": [("user_id", 1), ("stream_id", 1)], "unique": True}
+        ],
+        "sample_document": {
+            "user_id": "user_abc123",
+            "stream_id": "stream_abc123",
+            "first_seen_at": datetime.now(timezone.utc)
+        }
+    },
+    
+    "creator_rankings": {
+        "description": "Materialized trending-creator metrics (rebuilt by a background job)",
+        "indexes": [
+            {"keys": [("creator_id", 1)], "unique": True},
+            {"keys": [("rank_score", -1)]}
+        ],
+        "sample_document": {
+            "creator_id": "user_abc123",
+            "stream_frequency": 3.5,  # Streams per week (last 30 days)
+            "total_streams": 42,
+            "total_views": 15000,
+            "avg_viewers": 85.5,
+            "growth_rate": 0.25,  # Views last 7 days vs previous 7 days
+            "gift_volume_30d": 5400,
+            "rank_score": 72.4,
+            "computed_at": datetime.now(timezone.utc)
+        }
+    },
+    
+    "job_leases": {
+        "description": "Leases that let one API worker run a shared background job",
+        "indexes": [],
+        "sample_document": {
+            "_id": "creator_rankings",
+            "expires_at": datetime.now(timezone.utc),
+            "owner": "api-1:4242"
+        }
+    },
+    
+    "schema_migrations": {
+        "description": "Data migrations already applied (see STARTUP_MIGRATIONS)",
+        "indexes": [],
+        "sample_document": {
+            "_id": "transaction_timestamps",
+            "completed_at": datetime.now(timezone.utc)
+        }
+    },
+    
     "stream_messages": {
         "description": "Chat messages in streams",
         "indexes": [
@@ -464,6 +663,41 @@ COLLECTIONS_SCHEMA = {
 }
 
 
+async def migrate_transaction_timestamps(db):
+    """
+    Convert legacy ISO-string transaction timestamps to native dates.
+    String and date values sort separately in MongoDB, so keyset pagination
+    on created_at needs every row to be a date.
+    """
+    result = await db.transactions.update_many(
+        {"created_at": {"$type": "string"}},
+        [{"$set": {"created_at": {"$dateFromString": {"dateString": "$created_at", "timezone": "UTC"}}}}]
+    )
+    if result.modified_count:
+        logger.info(f"   ✓ Converted {result.modified_count} transaction timestamps to dates")
+
+
+# Data migrations the API depends on; applied on server startup, once per database
+STARTUP_MIGRATIONS = [
+    ("transaction_timestamps", migrate_transaction_timestamps),
+]
+
+
+async def run_startup_migrations(db):
+    """Apply pending STARTUP_MIGRATIONS, recording each in schema_migrations once done."""
+    for name, migration in STARTUP_MIGRATIONS:
+        if await db.schema_migrations.find_one({"_id": name}, {"_id": 1}):
+            continue
+        # Migrations are idempotent, so workers starting together may both run one
+        await migration(db)
+        await db.schema_migrations.update_one(
+            {"_id": name},
+            {"$set": {"completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        logger.info(f"Applied migration {name}")
+
+
 async def initialize_database():
     """
     Initialize MongoDB database with all required collections and indexes.
@@ -499,6 +733,8 @@ async def initialize_database():
                     # Index might already exist
                     logger.debug(f"      Index already exists or error: {e}")
         
+        await run_startup_migrations(db)
+        
         logger.info("✅ Database schema initialization complete!")
         logger.info(f"   Total collections: {len(COLLECTIONS_SCHEMA)}")
         
@@ -0,0 +1,233 @@
+"""
+Per-stream real-time event hub
+==============================
+
+Publishers (gifts, reactions, battle scores, viewer counts, chat retractions)
+call publish(); WebSocket and SSE connections subscribe per stream.
+
+- Coalescing: events are buffered per stream and fanned out once every
+  EVENT_HUB_TICK_MS as a single frame. Keyed events (reaction meter, viewer
+  count, battle score per team, leaderboard delta per gifter, gifts per sender
+  and gift type) replace or merge with the pending event of the same key, so a
+  burst of 500 reactions reaches viewers as one meter update per tick.
+- At most EVENT_HUB_MAX_EVENTS_PER_TICK distinct events are kept per stream
+  and tick. Events beyond that are dropped, and the stream's subscribers get
+  a {"type": "resync"} frame after that tick's events so they refetch state.
+- Each frame is serialized once per stream, not once per connection.
+- Events from the stream event log carry their sequence number, and a frame
+  reports the highest one it contains as last_seq, which clients use to
+  resume from the log after reconnecting. If a sequenced event was dropped
+  by the cap, the frame and the resync frame carry gap_from (the lowest
+  dropped seq) and last_seq never passes it, so a client resuming from
+  last_seq re-reads the dropped events from the log.
+- Slow consumers: every connection has a buffer of EVENT_HUB_BUFFER_FRAMES
+  frames. When it overflows, the backlog is discarded and replaced by a
+  {"type": "resync"} frame telling the client to refetch state, so one slow
+  client never holds memory or delays anyone else.
+
+Events for streams without subscribers are dropped at publish time.
+
+Deployment: the hub lives in process memory and is not shared between
+workers. An event published in one worker reaches only the subscribers
+connected to that same worker, so the API must run as a single worker
+process (uvicorn without --workers, WEB_CONCURRENCY=1). Scaling out needs
+the hub backed by a shared pub/sub (e.g. Redis) first. start() logs a
+warning when WEB_CONCURRENCY asks for more than one worker.
+"""
+
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Set
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+EVENT_HUB_TICK_MS = int(os.getenv("EVENT_HUB_TICK_MS", "250"))
+EVENT_HUB_BUFFER_FRAMES = int(os.getenv("EVENT_HUB_BUFFER_FRAMES", "64"))
+EVENT_HUB_MAX_EVENTS_PER_TICK = int(os.getenv("EVENT_HUB_MAX_EVENTS_PER_TICK", "200"))
+
+
+def sum_merge(*fields: str) -> Callable[[dict, dict], dict]:
+    """Merge function adding the given numeric fields of two pending events."""
+    def merge(old: dict, new: dict) -> dict:
+        return {**new, **{name: old.get(name, 0) + new.get(name, 0) for name in fields}}
+    return merge
+
+
+class Subscription:
+    def __init__(self, stream_id: str, max_frames: int = EVENT_HUB_BUFFER_FRAMES):
+        self.stream_id = stream_id
+        self.max_frames = max_frames
+        self.closed = False
+        self.overflows = 0
+        self._frames: deque = deque()
+        self._ready = asyncio.Event()
+
+    def push(self, frame: str) -> bool:
+        """Queue a frame; returns False if the buffer overflowed and was reset."""
+        overflowed = len(self._frames) >= self.max_frames
+        if overflowed:
+            self._frames.clear()
+            self._frames.append(json.dumps({"stream_id": self.stream_id, "type": "resync"}))
+            self.overflows += 1
+        self._frames.append(frame)
+        self._ready.set()
+        return not overflowed
+
+    async def next_frames(self, timeout: float) -> List[str]:
+        """Wait up to timeout for frames; returns [] on timeout or once closed."""
+        if not self._frames and not self.closed:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return []
+        frames = list(self._frames)
+        self._frames.clear()
+        return frames
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+
+class StreamEventHub:
+    def __init__(self, tick_ms: int = EVENT_HUB_TICK_MS, buffer_frames: int = EVENT_HUB_BUFFER_FRAMES,
+                 max_events_per_tick: int = EVENT_HUB_MAX_EVENTS_PER_TICK):
+        self.tick = tick_ms / 1000
+        self.buffer_frames = buffer_frames
+        self.max_events_per_tick = max_events_per_tick
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._pending: Dict[str, Dict[Any, dict]] = {}  # stream_id -> key -> event (insertion ordered)
+        self._keys = itertools.count()  # keys for events that never coalesce
+        self._overflowed: Set[str] = set()  # streams that dropped events this tick
+        self._gaps: Dict[str, int] = {}  # stream_id -> lowest seq dropped this tick
+        self._task: Optional[asyncio.Task] = None
+        self._published = 0
+        self._coalesced = 0
+        self._dropped = 0
+        self._frames_sent = 0
+        self._overflows = 0
+
+    # ----- subscriptions -----
+
+    def subscribe(self, stream_id: str) -> Subscription:
+        subscription = Subscription(stream_id, self.buffer_frames)
+        self._subscribers.setdefault(stream_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.close()
+        subscribers = self._subscribers.get(subscription.stream_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.stream_id]
+                self._pending.pop(subscription.stream_id, None)
+
+    def subscriber_count(self, stream_id: str) -> int:
+        return len(self._subscribers.get(stream_id, ()))
+
+    # ----- publishing -----
+
+    def publish(self, stream_id: str, event_type: str, data: dict, key: Optional[str] = None,
+                merge: Optional[Callable[[dict, dict], dict]] = None, seq: Optional[int] = None) -> None:
+        """Queue an event for the next tick.
+
+        Events with a key replace the pending event with the same key, or are
+        combined with it by merge(old_data, new_data).
+        """
+        if stream_id not in self._subscribers:
+            return
+        self._published += 1
+        pending = self._pending.setdefault(stream_id, {})
+
+        if key is None:
+            key = next(self._keys)
+        elif key in pending:
+            self._coalesced += 1
+            previous = pending.pop(key)
+            if merge:
+                data = merge(previous["data"], data)
+        if len(pending) >= self.max_events_per_tick:
+            self._dropped += 1
+            self._overflowed.add(stream_id)
+            if seq is not None:
+                self._gaps[stream_id] = min(seq, self._gaps.get(stream_id, seq))
+            return
+        event = {"type": event_type, "data": data}
+        if seq is not None:
+            event["seq"] = seq
+        pending[key] = event
+
+    def _fan_out(self) -> None:
+        pending, self._pending = self._pending, {}
+        overflowed, self._overflowed = self._overflowed, set()
+        gaps, self._gaps = self._gaps, {}
+        now = time.time()
+        for stream_id, events in pending.items():
+            subscribers = self._subscribers.get(stream_id)
+            if not subscribers or not events:
+                continue
+            frame = {"stream_id": stream_id, "type": "events", "ts": now, "events": list(events.values())}
+            gap_from = gaps.get(stream_id)
+            seqs = [event["seq"] for event in events.values()
+                    if "seq" in event and (gap_from is None or event["seq"] < gap_from)]
+            if seqs:
+                frame["last_seq"] = max(seqs)
+            if gap_from is not None:
+                frame["gap_from"] = gap_from
+            frames = [json.dumps(frame, default=str)]
+            if stream_id in overflowed:
+                resync = {"stream_id": stream_id, "type": "resync", "reason": "events_dropped"}
+                if gap_from is not None:
+                    resync["gap_from"] = gap_from
+                frames.append(json.dumps(resync))
+            for subscription in list(subscribers):
+                for frame in frames:
+                    if not subscription.push(frame):
+                        self._overflows += 1
+                    self._frames_sent += 1
+
+    # ----- metrics -----
+
+    def stats(self) -> dict:
+        return {
+            "streams": len(self._subscribers),
+            "connections": sum(len(s) for s in self._subscribers.values()),
+            "events_published": self._published,
+            "events_coalesced": self._coalesced,
+            "events_dropped": self._dropped,
+            "frames_sent": self._frames_sent,
+            "buffer_overflows": self._overflows,
+            "tick_ms": int(self.tick * 1000)
+        }
+
+    # ----- lifecycle -----
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                self._fan_out()
+            except Exception as e:
+                logger.error(f"Event hub fan-out error: {e}")
+
+    async def start(self) -> None:
+        if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+            logger.warning("Event hub is per-process: with WEB_CONCURRENCY > 1, subscribers on other "
+                           "workers miss events. Run the API as a single worker.")
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for subscribers in list(self._subscribers.values()):
+            for subscription in list(subscribers):
+                self.unsubscribe(subscription)
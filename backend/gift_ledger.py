@@ -0,0 +1,394 @@
+"""
+Write-behind gift ledger for RoastLive
+======================================
+
+send_gift moves the coins synchronously (wallets.transfer) and hands the rest
+of the bookkeeping to this ledger: gift records, wallet transactions and battle
+score increments. Entries are buffered per stream and flushed as bulk_write
+batches every GIFT_LEDGER_FLUSH_MS, or as soon as one stream has
+GIFT_LEDGER_MAX_BATCH gifts waiting. Battle scores are summed per flush, so a
+gift storm costs a handful of writes. Applied score increments are also
+appended to the stream event log when one is attached.
+
+The sender's coins are gone by the time a gift reaches the ledger, so gifts
+are never dropped:
+- a flush interrupted by shutdown puts its batch back before the final flush
+- after GIFT_LEDGER_MAX_RETRIES failed writes a gift is moved to the
+  `gift_ledger_dead_letters` collection (and kept buffered if even that write
+  fails); dead letters are replayed into the buffer on the next start
+- battle score increments are retried and dead-lettered the same way. Each
+  per-match increment carries an id that the update adds to the match's
+  applied_score_batches, so an increment that already landed is skipped when
+  it is retried or replayed
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from event_hub import sum_merge
+import asyncio
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+GIFT_LEDGER_FLUSH_MS = int(os.getenv("GIFT_LEDGER_FLUSH_MS", "50"))
+GIFT_LEDGER_MAX_BATCH = int(os.getenv("GIFT_LEDGER_MAX_BATCH", "500"))
+GIFT_LEDGER_MAX_RETRIES = 3
+
+CREATOR_SHARE = 0.7  # Creator receives 70% of the gift price
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class GiftLedger:
+    """Buffers gift side effects per stream and flushes them in bulk."""
+
+    def __init__(self, db, flush_interval_ms: int = GIFT_LEDGER_FLUSH_MS, max_batch: int = GIFT_LEDGER_MAX_BATCH,
+                 event_log=None):
+        self.db = db
+        self.event_log = event_log  # Optional StreamEventLog for battle score events
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self._pending: Dict[str, List[dict]] = defaultdict(list)
+        self._pending_scores: List[dict] = []  # Battle score increments not yet applied
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, gift_record: dict, creator_amount: int) -> None:
+        """Queue a gift whose coins have already been transferred."""
+        entry = {
+            "gift": gift_record,
+            "creator_amount": creator_amount,
+            "recorded_at": datetime.now(timezone.utc),
+            "attempts": 0
+        }
+        stream_queue = self._pending[gift_record["stream_id"]]
+        stream_queue.append(entry)
+        if len(stream_queue) >= self.max_batch:
+            self._wakeup.set()
+
+    def pending_count(self) -> int:
+        return sum(len(entries) for entries in self._pending.values())
+
+    def _requeue(self, entries: List[dict]) -> None:
+        for entry in entries:
+            self._pending[entry["gift"]["stream_id"]].append(entry)
+
+    async def start(self) -> None:
+        await self._replay_dead_letters()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flush loop and write out everything still buffered."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Gift ledger flush error: {e}")
+
+    async def flush(self) -> int:
+        """Write all buffered gifts. Returns the number of gifts flushed."""
+        async with self._flush_lock:
+            if not self._pending:
+                if self._pending_scores:
+                    await self._shielded(self._apply_battle_scores())
+                return 0
+            batch = [entry for entries in self._pending.values() for entry in entries]
+            self._pending = defaultdict(list)
+
+            try:
+                await self._write_ledger(batch)
+            except asyncio.CancelledError:
+                # Interrupted by shutdown: the final flush writes the batch
+                self._requeue(batch)
+                raise
+            except Exception as e:
+                retry, exhausted = [], []
+                for entry in batch:
+                    (retry if entry["attempts"] < GIFT_LEDGER_MAX_RETRIES else exhausted).append(entry)
+                for entry in retry:
+                    entry["attempts"] += 1
+                self._requeue(retry)
+                await self._dead_letter(exhausted, e)
+                logger.error(
+                    f"Gift ledger write failed for {len(batch)} gifts "
+                    f"({len(retry)} requeued, {len(exhausted)} dead-lettered): {e}"
+                )
+                return 0
+
+            await self._shielded(self._after_write(batch))
+            return len(batch)
+
+    @staticmethod
+    async def _shielded(work) -> None:
+        """Run post-write bookkeeping to completion even if shutdown cancels the flush."""
+        task = asyncio.ensure_future(work)
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            await task
+            raise
+
+    async def _after_write(self, batch: List[dict]) -> None:
+        if await self._clear_dead_letters(batch):
+            self._queue_battle_scores(batch)
+        else:
+            self._queue_battle_scores([entry for entry in batch if "dead_letter_id" not in entry])
+        await self._apply_battle_scores()
+
+    # ----- dead letters -----
+
+    async def _dead_letter(self, entries: List[dict], error: Exception) -> None:
+        """Persist gifts that exhausted their retries; keep them buffered if that fails too."""
+        entries = [entry for entry in entries if "dead_letter_id" not in entry]
+        if not entries:
+            return
+        now = datetime.now(timezone.utc)
+        for entry in entries:
+            entry["dead_letter_id"] = str(uuid.uuid4())
+        try:
+            await self.db.gift_ledger_dead_letters.insert_many([
+                {
+                    "id": entry["dead_letter_id"],
+                    "gift": entry["gift"],
+                    "creator_amount": entry["creator_amount"],
+                    "recorded_at": entry["recorded_at"],
+                    "sent_txn_id": entry.get("sent_txn_id"),
+                    "received_txn_id": entry.get("received_txn_id"),
+                    "error": str(error),
+                    "failed_at": now
+                }
+                for entry in entries
+            ])
+        except Exception as e:
+            logger.error(f"Gift ledger dead-letter write failed, keeping {len(entries)} gifts buffered: {e}")
+            for entry in entries:
+                del entry["dead_letter_id"]
+                entry["attempts"] = 0
+            self._requeue(entries)
+
+    async def _dead_letter_scores(self, scores: List[dict], error: Exception) -> None:
+        """Persist score increments that exhausted their retries; keep them buffered if that fails too."""
+        scores = [score for score in scores if "dead_letter_id" not in score]
+        if not scores:
+            return
+        try:
+            await self.db.gift_ledger_dead_letters.insert_many([
+                {
+                    "id": score["id"],
+                    "type": "battle_score",
+                    "match_id": score["match_id"],
+                    "increments": score["increments"],
+                    "events": score["events"],
+                    "error": str(error),
+                    "failed_at": datetime.now(timezone.utc)
+                }
+                for score in scores
+            ])
+        except Exception as e:
+            logger.error(f"Battle score dead-letter write failed, keeping {len(scores)} increments buffered: {e}")
+            for score in scores:
+                score["attempts"] = 0
+            self._pending_scores.extend(scores)
+            return
+        for score in scores:
+            score["dead_letter_id"] = score["id"]
+
+    async def _replay_dead_letters(self) -> None:
+        """Buffer dead-lettered gifts and score increments again; they are deleted once written."""
+        try:
+            letters = await self.db.gift_ledger_dead_letters.find({}, {"_id": 0}).to_list(None)
+        except Exception as e:
+            logger.error(f"Gift ledger dead-letter replay failed: {e}")
+            return
+        for letter in letters:
+            if letter.get("type") == "battle_score":
+                self._pending_scores.append({
+                    "id": letter["id"],
+                    "match_id": letter["match_id"],
+                    "increments": letter["increments"],
+                    "events": letter["events"],
+                    "attempts": 0,
+                    "dead_letter_id": letter["id"]
+                })
+                continue
+            entry = {
+                "gift": letter["gift"],
+                "creator_amount": letter["creator_amount"],
+                "recorded_at": letter["recorded_at"],
+                "attempts": 0,
+                "dead_letter_id": letter["id"]
+            }
+            # Reuse transaction ids so rows that landed earlier are skipped
+            for key in ("sent_txn_id", "received_txn_id"):
+                if letter.get(key):
+                    entry[key] = letter[key]
+            self._requeue([entry])
+        if letters:
+            logger.warning(f"Gift ledger replaying {len(letters)} dead letters")
+
+    async def _clear_dead_letters(self, batch: List[dict]) -> bool:
+        """Delete the dead letters of written gifts or scores. Returns False if they are still stored."""
+        replayed = [entry["dead_letter_id"] for entry in batch if "dead_letter_id" in entry]
+        if not replayed:
+            return True
+        try:
+            await self.db.gift_ledger_dead_letters.delete_many({"id": {"$in": replayed}})
+            return True
+        except Exception as e:
+            # Leftover letters are replayed again (rows are unique-indexed), so their
+            # battle scores are applied by the replay that manages to delete them
+            logger.error(f"Gift ledger dead-letter cleanup failed: {e}")
+            return False
+
+    async def _write_ledger(self, batch: List[dict]) -> None:
+        """Insert gift records and wallet transactions.
+
+        Gift and transaction ids are unique-indexed, so a retried batch skips
+        rows that already landed.
+        """
+        await self._tag_battle_gifts([entry for entry in batch if "battle_checked" not in entry])
+
+        gift_ops = []
+        transaction_ops = []
+
+        for entry in batch:
+            gift = entry["gift"]
+            gift_ops.append(InsertOne(dict(gift)))
+            transaction_ops.append(InsertOne({
+                "id": entry.setdefault("sent_txn_id", str(uuid.uuid4())),
+                "user_id": gift["sender_id"],
+                "amount": -gift["gift_price"],
+                "type": "gift_sent",
+                "description": f"Sent {gift['gift_name']} gift",
+                "created_at": entry["recorded_at"],
+            }))
+            transaction_ops.append(InsertOne({
+                "id": entry.setdefault("received_txn_id", str(uuid.uuid4())),
+                "user_id": gift["recipient_id"],
+                "amount": entry["creator_amount"],
+                "type": "gift_received",
+                "description": f"Received {gift['gift_name']} gift",
+                "created_at": entry["recorded_at"],
+            }))
+
+        await _bulk_insert_idempotent(self.db.gifts, gift_ops)
+        await _bulk_insert_idempotent(self.db.transactions, transaction_ops)
+
+    async def _tag_battle_gifts(self, entries: List[dict]) -> None:
+        """Attach battle match/team to gifts whose recipient is in an active battle."""
+        if not entries:
+            return
+        recipient_ids = list({entry["gift"]["recipient_id"] for entry in entries})
+        participants = await self.db.battle_participants.find(
+            {"user_id": {"$in": recipient_ids}, "status": {"$in": ["ready", "active"]}},
+            {"_id": 0, "user_id": 1, "match_id": 1, "team": 1}
+        ).to_list(None)
+        in_battle = {p["user_id"]: p for p in participants}
+
+        for entry in entries:
+            entry["battle_checked"] = True
+            participant = in_battle.get(entry["gift"]["recipient_id"])
+            if participant:
+                entry["gift"]["battle_match_id"] = participant["match_id"]
+                entry["gift"]["battle_team"] = participant["team"]
+
+    def _queue_battle_scores(self, batch: List[dict]) -> None:
+        """Sum the batch's gift value into one pending score increment per match."""
+        scores: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        deltas: Dict[str, Dict[tuple, int]] = defaultdict(lambda: defaultdict(int))
+        for entry in batch:
+            gift = entry["gift"]
+            if gift.get("battle_match_id"):
+                scores[gift["battle_match_id"]][f"{gift['battle_team']}_score"] += gift["gift_price"]
+                deltas[gift["battle_match_id"]][(gift["stream_id"], gift["battle_team"])] += gift["gift_price"]
+
+        for match_id, increments in scores.items():
+            self._pending_scores.append({
+                "id": str(uuid.uuid4()),
+                "match_id": match_id,
+                "increments": dict(increments),
+                "events": [
+                    {"stream_id": stream_id, "team": team, "delta": delta}
+                    for (stream_id, team), delta in deltas[match_id].items()
+                ],
+                "attempts": 0
+            })
+
+    async def _apply_battle_scores(self) -> None:
+        """Apply pending score increments in one bulk write.
+
+        The filter skips increments whose id the match already recorded, so
+        retrying the whole batch after a partial failure is safe.
+        """
+        if not self._pending_scores:
+            return
+        scores, self._pending_scores = self._pending_scores, []
+        try:
+            await self.db.battle_matches.bulk_write([
+                UpdateOne(
+                    {"match_id": score["match_id"], "applied_score_batches": {"$ne": score["id"]}},
+                    {"$inc": score["increments"], "$addToSet": {"applied_score_batches": score["id"]}}
+                )
+                for score in scores
+            ], ordered=False)
+        except Exception as e:
+            retry, exhausted = [], []
+            for score in scores:
+                (retry if score["attempts"] < GIFT_LEDGER_MAX_RETRIES else exhausted).append(score)
+            for score in retry:
+                score["attempts"] += 1
+            self._pending_scores.extend(retry)
+            await self._dead_letter_scores(exhausted, e)
+            logger.error(
+                f"Battle score flush failed for {len(scores)} matches "
+                f"({len(retry)} requeued, {len(exhausted)} dead-lettered): {e}"
+            )
+            return
+        logger.info(f"Battle scores updated for {len(scores)} matches")
+
+        if not await self._clear_dead_letters(scores):
+            # The replay that manages to delete the letter logs these events
+            scores = [score for score in scores if "dead_letter_id" not in score]
+        if self.event_log is not None:
+            for score in scores:
+                for event in score["events"]:
+                    self.event_log.append(
+                        event["stream_id"], "battle_score",
+                        {"match_id": score["match_id"], "team": event["team"], "delta": event["delta"]},
+                        key=f"battle:{score['match_id']}:{event['team']}",
+                        merge=sum_merge("delta")
+                    )
+
+async def _bulk_insert_idempotent(collection, ops: List[InsertOne]) -> None:
+    """bulk_write inserts, treating duplicate-key errors as already written."""
+    if not ops:
+        return
+    try:
+        await collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+            raise
+
@@ -0,0 +1,74 @@
+"""
+HyperLogLog cardinality sketch
+==============================
+
+Used to count unique viewers per stream without keeping viewer ids. With the
+default precision of 12 the sketch is 4096 one-byte registers (4 KB) and the
+standard error is about 1.6%. Small cardinalities fall back to linear
+counting, so estimates for small streams are close to exact.
+"""
+
+from typing import Optional
+import hashlib
+import math
+
+DEFAULT_PRECISION = 12
+
+
+class HyperLogLog:
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers: Optional[bytes] = None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is not None and len(registers) != self.size:
+            raise ValueError(f"expected {self.size} registers, got {len(registers)}")
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        """Rebuild a sketch serialized with to_bytes()."""
+        return cls(precision=data[0], registers=data[1:])
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + bytes(self.registers)
+
+    def add(self, value: str) -> bool:
+        """Add a value. Returns True if a register changed.
+
+        A value that was already added can never change a register, so True
+        always means "not seen before". False usually means "seen before", but
+        on large sketches a new value may also leave every register unchanged.
+        """
+        hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Fold another sketch of the same precision into this one."""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches with different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self) -> int:
+        """Estimated number of distinct values added."""
+        m = self.size
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
@@ -0,0 +1,580 @@
+"""
+In-memory battle matchmaker
+===========================
+
+Waiting players are held in per-(team_size, region) buckets, so forming a
+match never scans matchmaking_queue and leaving the queue is an O(1) removal.
+
+matchmaking_queue stays the durable record: the buckets are rebuilt from its
+waiting entries on startup and every change is written through (insert on
+join, delete on leave, status=matched via create_match). The queue state is
+process-local, so matchmaking routes must be served by a single worker.
+
+Parties
+-------
+A leader and their guests (team_members) queue as one Party and are always
+placed on the same team. Each bucket keeps, per party size (1..5), a FIFO and
+a rating-sorted list of parties (party rating = mean member rating):
+
+- the oldest party anchors team A and centres a rating window that widens
+  with its wait (MATCHMAKER_RATING_WINDOW_* settings). Once the anchor has
+  waited MATCHMAKER_RATING_RELAX_SECONDS the window is unbounded, so a party
+  rated far from everyone else still gets the closest opponents available
+  instead of expiring
+- each team's remaining capacity is filled by the first integer partition of
+  it (fewest, largest parts first) that can be satisfied inside the window,
+  taking the closest-rated party of each needed size via bisection
+
+Chosen parties leave their buckets while the match is created. create_match
+first claims their waiting queue entries, so a player who leaves during that
+await aborts the match and the other parties go back to their places.
+
+Candidate lookup is O(log n) per seat, so work per match does not grow with
+the number of waiting parties. Up to one anchor per party size is tried so a
+hard-to-place party does not block the rest of the bucket.
+
+Background tick
+---------------
+Besides the attempt made on every join, a background tick sweeps all buckets
+every MATCHMAKER_TICK_MS:
+- parties are expired exactly at expires_at (marked status=expired) instead
+  of lingering until Mongo's TTL monitor runs
+- regional buckets are topped up from the global bucket once their oldest
+  party has waited MATCHMAKER_GLOBAL_FALLBACK_SECONDS
+- formed matches and per-player wait times feed throughput and wait-time
+  percentile metrics
+
+Queue status
+------------
+Clients poll their queue status every second or two, so it is answered from
+memory: each bucket also keeps its players sorted by (joined_at, leader_id),
+and a player's position is a bisection into that list. The ETA comes from a
+per-bucket histogram of the waits of players matched in the last
+MATCHMAKER_ETA_WINDOW_SECONDS: the median of the recorded waits at least as
+long as the player's current wait, minus that wait.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from matchmaking import parse_team_size
+from ratings import DEFAULT_RATING
+
+logger = logging.getLogger(__name__)
+
+MATCHMAKER_TICK_MS = int(os.getenv("MATCHMAKER_TICK_MS", "250"))
+MATCHMAKER_GLOBAL_FALLBACK_SECONDS = int(os.getenv("MATCHMAKER_GLOBAL_FALLBACK_SECONDS", "10"))
+MATCHMAKER_RATING_WINDOW_BASE = float(os.getenv("MATCHMAKER_RATING_WINDOW_BASE", "100"))
+MATCHMAKER_RATING_WINDOW_GROWTH = float(os.getenv("MATCHMAKER_RATING_WINDOW_GROWTH", "10"))  # per second waited
+MATCHMAKER_RATING_WINDOW_MAX = float(os.getenv("MATCHMAKER_RATING_WINDOW_MAX", "600"))
+MATCHMAKER_RATING_RELAX_SECONDS = int(os.getenv("MATCHMAKER_RATING_RELAX_SECONDS", "60"))  # Queue entries expire at 120s
+MATCHMAKER_ETA_WINDOW_SECONDS = int(os.getenv("MATCHMAKER_ETA_WINDOW_SECONDS", "600"))
+WAIT_SAMPLE_SIZE = 1000
+WAIT_HISTOGRAM_EDGES = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180)  # seconds; last bin is open-ended
+MAX_TEAM_SIZE = 5
+
+BucketKey = Tuple[str, str]  # (team_size, region)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Mongo returns naive UTC datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _partitions(n: int, largest: int) -> List[Tuple[int, ...]]:
+    """Integer partitions of n with parts <= largest, in non-increasing order."""
+    if n == 0:
+        return [()]
+    return [(part,) + rest for part in range(min(n, largest), 0, -1) for rest in _partitions(n - part, part)]
+
+
+# capacity -> partitions, fewest parts first (large parties are the hardest to place)
+PARTITIONS = {n: sorted(_partitions(n, n), key=len) for n in range(MAX_TEAM_SIZE + 1)}
+
+
+@dataclass
+class Party:
+    leader_id: str
+    entries: List[dict]  # leader first, then guests
+    joined_at: datetime
+    expires_at: datetime
+    region: str = field(default="global")
+    rating: float = field(default=DEFAULT_RATING)
+
+    @property
+    def size(self) -> int:
+        return len(self.entries)
+
+    def rerate(self) -> None:
+        self.rating = sum(entry.get("rating", DEFAULT_RATING) for entry in self.entries) / len(self.entries)
+
+
+class AlreadyQueuedError(Exception):
+    pass
+
+
+class WaitHistogram:
+    """Rolling histogram of recent match wait times."""
+
+    def __init__(self, window_seconds: int = MATCHMAKER_ETA_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self.counts = [0] * (len(WAIT_HISTOGRAM_EDGES) + 1)
+        self._samples: deque = deque()  # (monotonic time, bin)
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - self.window_seconds
+        while self._samples and self._samples[0][0] < cutoff:
+            self.counts[self._samples.popleft()[1]] -= 1
+
+    def add(self, waited_seconds: float) -> None:
+        self._prune()
+        index = bisect_right(WAIT_HISTOGRAM_EDGES, waited_seconds)
+        self._samples.append((time.monotonic(), index))
+        self.counts[index] += 1
+
+    def remaining(self, waited_seconds: float) -> Optional[int]:
+        """Median remaining wait (upper bin edge) for someone who has waited this long, or None."""
+        self._prune()
+        start = bisect_right(WAIT_HISTOGRAM_EDGES, waited_seconds)
+        total = sum(self.counts[start:])
+        if total == 0:
+            return None
+        seen = 0
+        for index in range(start, len(self.counts)):
+            seen += self.counts[index]
+            if seen * 2 >= total:
+                break
+        if index == len(WAIT_HISTOGRAM_EDGES):
+            return None  # Median falls in the open-ended bin
+        return max(1, int(WAIT_HISTOGRAM_EDGES[index] - waited_seconds))
+
+
+class PartyBucket:
+    """Waiting parties of one (team_size, region).
+
+    Per party size a FIFO and a rating-sorted list, plus all players in join order.
+    """
+
+    def __init__(self):
+        self.queues: Dict[int, "OrderedDict[str, Party]"] = defaultdict(OrderedDict)
+        self.by_rating: Dict[int, List[Tuple[float, str]]] = defaultdict(list)  # (rating, leader_id)
+        self.order: List[Tuple[datetime, str, str]] = []  # (joined_at, leader_id, user_id)
+        self.waits = WaitHistogram()
+        self.players = 0
+
+    def __len__(self) -> int:
+        return self.players
+
+    def add(self, party: Party) -> None:
+        queue = self.queues[party.size]
+        newest = next(reversed(queue.values()), None)
+        queue[party.leader_id] = party
+        if newest is not None and party.joined_at < newest.joined_at:
+            # Restored or shrunk parties go back to their FIFO position (rare, O(n))
+            ordered = sorted(queue.values(), key=lambda p: p.joined_at)
+            queue.clear()
+            queue.update((p.leader_id, p) for p in ordered)
+        insort(self.by_rating[party.size], (party.rating, party.leader_id))
+        for entry in party.entries:
+            insort(self.order, (party.joined_at, party.leader_id, entry["user_id"]))
+        self.players += party.size
+
+    def discard(self, party: Party) -> bool:
+        queue = self.queues.get(party.size)
+        if queue is None or queue.pop(party.leader_id, None) is None:
+            return False
+        ratings = self.by_rating[party.size]
+        index = bisect_left(ratings, (party.rating, party.leader_id))
+        if index < len(ratings) and ratings[index][1] == party.leader_id:
+            del ratings[index]
+        start = bisect_left(self.order, (party.joined_at, party.leader_id, ""))
+        end = start
+        while end < len(self.order) and self.order[end][1] == party.leader_id:
+            end += 1
+        del self.order[start:end]
+        self.players -= party.size
+        return True
+
+    def oldest(self, size: int, taken: Set[str], now: datetime) -> Optional[Party]:
+        """Oldest live party of the given size not already taken (skips at most len(taken))."""
+        for party in self.queues.get(size, {}).values():
+            if party.leader_id not in taken and party.expires_at > now:
+                return party
+        return None
+
+    def closest(self, size: int, rating: float, window: float, taken: Set[str],
+                now: datetime) -> Optional[Tuple[float, Party]]:
+        """(distance, party) for the closest-rated live party of a size within window, or None."""
+        ratings = self.by_rating.get(size)
+        if not ratings:
+            return None
+        queue = self.queues[size]
+        below = bisect_left(ratings, (rating, "")) - 1
+        above = below + 1
+        while below >= 0 or above < len(ratings):
+            use_below = above >= len(ratings) or (below >= 0 and rating - ratings[below][0] <= ratings[above][0] - rating)
+            candidate_rating, leader_id = ratings[below] if use_below else ratings[above]
+            distance = abs(candidate_rating - rating)
+            if distance > window:
+                return None
+            party = queue[leader_id]
+            if leader_id not in taken and party.expires_at > now:
+                return distance, party
+            if use_below:
+                below -= 1
+            else:
+                above += 1
+        return None
+
+    def position(self, party: Party) -> int:
+        """1-based position of the party's first player among everyone waiting in the bucket."""
+        return bisect_left(self.order, (party.joined_at, party.leader_id, "")) + 1
+
+    def heads(self, now: datetime) -> List[Party]:
+        """Oldest live party of each size, oldest first."""
+        heads = [self.oldest(size, set(), now) for size in list(self.queues)]
+        return sorted((party for party in heads if party), key=lambda p: p.joined_at)
+
+    def oldest_joined_at(self) -> Optional[datetime]:
+        heads = [next(iter(queue.values())).joined_at for queue in self.queues.values() if queue]
+        return min(heads) if heads else None
+
+
+class Matchmaker:
+    def __init__(self, db, create_match: Callable[[List[dict], str, object], Awaitable[str]],
+                 tick_ms: int = MATCHMAKER_TICK_MS, global_fallback_seconds: int = MATCHMAKER_GLOBAL_FALLBACK_SECONDS):
+        """create_match(players, team_size, db) persists a match and returns its id.
+
+        players lists team A's members followed by team B's. It returns None
+        without creating anything if a player is no longer waiting in the queue.
+        """
+        self.db = db
+        self.create_match = create_match
+        self.tick_seconds = tick_ms / 1000
+        self.global_fallback_seconds = global_fallback_seconds
+        self._buckets: Dict[BucketKey, PartyBucket] = defaultdict(PartyBucket)
+        self._entries: Dict[str, dict] = {}  # user_id -> queue entry
+        self._party_of: Dict[str, Party] = {}  # user_id -> party (leader and guests)
+        self._expiry_heap: List[Tuple[datetime, int, str]] = []  # (expires_at, seq, leader_id)
+        self._expiry_seq = itertools.count()
+        self._match_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # Metrics
+        self._matches_total = 0
+        self._expired_total = 0
+        self._match_times: deque = deque()  # monotonic times of matches in the last minute
+        self._waits: deque = deque(maxlen=WAIT_SAMPLE_SIZE)  # seconds waited by recently matched players
+
+    # ----- queue state -----
+
+    def is_queued(self, user_id: str) -> bool:
+        return user_id in self._entries
+
+    def get_entry(self, user_id: str) -> Optional[dict]:
+        return self._entries.get(user_id)
+
+    def bucket_size(self, team_size: str, region: str) -> int:
+        bucket = self._buckets.get((team_size, region))
+        return len(bucket) if bucket else 0
+
+    def queue_position(self, user_id: str) -> Optional[int]:
+        """Position in the user's bucket, counting players who joined before their party."""
+        party = self._party_of.get(user_id)
+        return self._bucket_of(party).position(party) if party else None
+
+    def estimated_wait(self, user_id: str, now: Optional[datetime] = None) -> Optional[int]:
+        """Estimated seconds until the user is matched, or None without recent data."""
+        party = self._party_of.get(user_id)
+        if party is None:
+            return None
+        waited = ((now or datetime.now(timezone.utc)) - party.joined_at).total_seconds()
+        return self._bucket_of(party).waits.remaining(waited)
+
+    def _bucket_of(self, party: Party) -> PartyBucket:
+        return self._buckets[(party.entries[0]["team_size"], party.region)]
+
+    def _index(self, party: Party) -> None:
+        for entry in party.entries:
+            self._entries[entry["user_id"]] = entry
+            self._party_of[entry["user_id"]] = party
+        self._bucket_of(party).add(party)
+        heapq.heappush(self._expiry_heap, (party.expires_at, next(self._expiry_seq), party.leader_id))
+
+    def _unindex(self, party: Party) -> None:
+        self._bucket_of(party).discard(party)
+        for entry in party.entries:
+            self._entries.pop(entry["user_id"], None)
+            self._party_of.pop(entry["user_id"], None)
+
+    @staticmethod
+    def _party(entries: List[dict]) -> Party:
+        leader = entries[0]
+        party = Party(
+            leader_id=leader["user_id"],
+            entries=entries,
+            joined_at=leader["joined_at"],
+            expires_at=min(entry["expires_at"] for entry in entries),
+            region=leader["region"]
+        )
+        party.rerate()
+        return party
+
+    async def load(self) -> int:
+        """Rebuild buckets from matchmaking_queue. Returns the number of waiting entries."""
+        self._buckets.clear()
+        self._entries.clear()
+        self._party_of.clear()
+        self._expiry_heap.clear()
+        entries = await self.db.matchmaking_queue.find(
+            {"status": "waiting", "expires_at": {"$gt": datetime.now(timezone.utc)}},
+            {"_id": 0}
+        ).sort("joined_at", 1).to_list(None)
+
+        guests: Dict[str, List[dict]] = defaultdict(list)
+        leaders = []
+        for entry in entries:
+            entry["joined_at"] = _as_utc(entry["joined_at"])
+            entry["expires_at"] = _as_utc(entry["expires_at"])
+            if entry.get("leader_id"):
+                guests[entry["leader_id"]].append(entry)
+            else:
+                leaders.append(entry)
+        for leader in leaders:
+            self._index(self._party([leader] + guests.pop(leader["user_id"], [])))
+        # Guests whose leader is gone queue on their own
+        for orphans in guests.values():
+            for entry in orphans:
+                self._index(self._party([entry]))
+
+        logger.info(f"Matchmaker loaded {len(entries)} waiting queue entries")
+        return len(entries)
+
+    async def enqueue(self, entries: List[dict]) -> None:
+        """Persist and queue a leader and their guests as one party.
+
+        Raises AlreadyQueuedError if any of them is already queued. The check and
+        the insert run under the match lock, so concurrent joins cannot both pass.
+        """
+        async with self._match_lock:
+            user_ids = set()
+            for entry in entries:
+                if entry["user_id"] in self._entries or entry["user_id"] in user_ids:
+                    raise AlreadyQueuedError(f"{entry['user_id']} is already queued")
+                user_ids.add(entry["user_id"])
+            await self.db.matchmaking_queue.insert_many([dict(entry) for entry in entries])
+            self._index(self._party(entries))
+
+    async def remove(self, user_id: str) -> int:
+        """Remove a user (a leader takes their guests along). Returns the number of entries removed."""
+        result = await self.db.matchmaking_queue.delete_many({
+            "$or": [
+                {"user_id": user_id, "status": "waiting"},
+                {"leader_id": user_id, "status": "waiting"}
+            ]
+        })
+        party = self._party_of.get(user_id)
+        if party is None:
+            return result.deleted_count
+
+        self._unindex(party)
+        if party.leader_id != user_id:
+            # A guest left: the rest of the party keeps its place in line
+            await self.db.matchmaking_queue.update_one(
+                {"user_id": party.leader_id, "status": "waiting"},
+                {"$pull": {"team_members": user_id}}
+            )
+            party.entries = [entry for entry in party.entries if entry["user_id"] != user_id]
+            party.entries[0]["team_members"] = [entry["user_id"] for entry in party.entries[1:]]
+            party.rerate()
+            self._index(party)
+        return result.deleted_count
+
+    # ----- matching -----
+
+    def _can_widen(self, key: BucketKey, now: datetime) -> bool:
+        """Regional buckets may use global parties once their oldest party has waited long enough."""
+        bucket = self._buckets.get(key)
+        oldest = bucket.oldest_joined_at() if bucket else None
+        if key[1] == "global" or oldest is None:
+            return False
+        return (now - oldest).total_seconds() >= self.global_fallback_seconds
+
+    @staticmethod
+    def rating_window(waited_seconds: float) -> float:
+        if waited_seconds >= MATCHMAKER_RATING_RELAX_SECONDS:
+            return float("inf")
+        return min(MATCHMAKER_RATING_WINDOW_MAX,
+                   MATCHMAKER_RATING_WINDOW_BASE + MATCHMAKER_RATING_WINDOW_GROWTH * waited_seconds)
+
+    @staticmethod
+    def _closest(sources: Iterable[PartyBucket], size: int, rating: float, window: float, taken: Set[str],
+                 now: datetime) -> Optional[Party]:
+        candidates = [found for found in (b.closest(size, rating, window, taken, now) for b in sources) if found]
+        return min(candidates, key=lambda found: found[0])[1] if candidates else None
+
+    def _fill(self, sources: List[PartyBucket], capacity: int, rating: float, window: float, taken: Set[str],
+              now: datetime) -> Optional[List[Party]]:
+        """Parties filling exactly capacity seats within the rating window, or None.
+
+        Chosen parties are added to taken.
+        """
+        for parts in PARTITIONS[capacity]:
+            chosen = []
+            for size in parts:
+                party = self._closest(sources, size, rating, window, taken | {p.leader_id for p in chosen}, now)
+                if party is None:
+                    break
+                chosen.append(party)
+            else:
+                taken.update(p.leader_id for p in chosen)
+                return chosen
+        return None
+
+    def _pack(self, sources: List[PartyBucket], team_per_side: int, now: datetime) -> Optional[List[List[Party]]]:
+        """Two teams of team_per_side players, anchored on the oldest placeable party."""
+        for anchor in sources[0].heads(now):
+            if anchor.size > team_per_side:
+                continue
+            window = self.rating_window((now - anchor.joined_at).total_seconds())
+            taken = {anchor.leader_id}
+            team_a = self._fill(sources, team_per_side - anchor.size, anchor.rating, window, taken, now)
+            if team_a is None:
+                continue
+            team_b = self._fill(sources, team_per_side, anchor.rating, window, taken, now)
+            if team_b is None:
+                continue
+            return [[anchor] + team_a, team_b]
+        return None
+
+    async def try_match(self, team_size: str, region: str) -> Optional[str]:
+        """Form a match anchored in the bucket (topping up from global). Returns the match id."""
+        async with self._match_lock:
+            team_per_side = parse_team_size(team_size)
+            now = datetime.now(timezone.utc)
+            sources = [self._buckets[(team_size, region)]]
+            if self._can_widen((team_size, region), now):
+                sources.append(self._buckets[(team_size, "global")])
+            if sum(len(bucket) for bucket in sources) < team_per_side * 2:
+                return None
+
+            teams = self._pack(sources, team_per_side, now)
+            if teams is None:
+                return None
+
+            parties = [party for team in teams for party in team]
+            for party in parties:
+                self._bucket_of(party).discard(party)
+            players = [entry for team in teams for party in team for entry in party.entries]
+
+            try:
+                match_id = await self.create_match(players, team_size, self.db)
+            except Exception:
+                self._restore(parties)
+                raise
+            if match_id is None:  # A player left while the match was created
+                self._restore(parties)
+                return None
+
+            for party in parties:
+                bucket = self._bucket_of(party)
+                bucket.discard(party)  # In case a guest left and it was re-queued meanwhile
+                for entry in party.entries:
+                    self._entries.pop(entry["user_id"], None)
+                    self._party_of.pop(entry["user_id"], None)
+                    waited = (now - entry["joined_at"]).total_seconds()
+                    self._waits.append(waited)
+                    bucket.waits.add(waited)
+            self._matches_total += 1
+            self._match_times.append(time.monotonic())
+            return match_id
+
+    def _restore(self, parties: List[Party]) -> None:
+        """Put parties of an abandoned match back in their buckets, unless they left meanwhile."""
+        for party in parties:
+            if self._party_of.get(party.leader_id) is party:
+                bucket = self._bucket_of(party)
+                bucket.discard(party)  # A guest's leave may already have re-queued the party
+                bucket.add(party)
+
+    # ----- background sweep -----
+
+    async def expire(self) -> int:
+        """Drop parties whose expires_at has passed. Returns the number of entries expired."""
+        now = datetime.now(timezone.utc)
+        expired = []
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, _, leader_id = heapq.heappop(self._expiry_heap)
+            party = self._party_of.get(leader_id)
+            # Skip stale heap items (party left, matched or re-queued)
+            if party and party.leader_id == leader_id and party.expires_at == expires_at:
+                self._unindex(party)
+                expired.extend(entry["user_id"] for entry in party.entries)
+
+        if expired:
+            self._expired_total += len(expired)
+            await self.db.matchmaking_queue.update_many(
+                {"user_id": {"$in": expired}, "status": "waiting"},
+                {"$set": {"status": "expired"}}
+            )
+            logger.info(f"Matchmaker expired {len(expired)} queue entries")
+        return len(expired)
+
+    async def tick(self) -> int:
+        """Expire parties and form every match currently possible. Returns matches formed."""
+        async with self._match_lock:
+            await self.expire()
+        formed = 0
+        for team_size, region in [key for key, bucket in self._buckets.items() if bucket]:
+            while await self.try_match(team_size, region):
+                formed += 1
+        return formed
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Matchmaker tick error: {e}")
+
+    # ----- metrics -----
+
+    def stats(self) -> dict:
+        cutoff = time.monotonic() - 60
+        while self._match_times and self._match_times[0] < cutoff:
+            self._match_times.popleft()
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> Optional[float]:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 1) if waits else None
+
+        return {
+            "waiting": len(self._entries),
+            "buckets": {f"{team_size}:{region}": len(bucket)
+                        for (team_size, region), bucket in self._buckets.items() if bucket},
+            "matches_total": self._matches_total,
+            "matches_last_minute": len(self._match_times),
+            "expired_total": self._expired_total,
+            "wait_seconds": {"p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99)}
+        }
+
+    # ----- lifecycle -----
+
+    async def start(self) -> None:
+        await self.load()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
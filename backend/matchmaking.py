@@ -5,6 +5,8 @@ from typing import Optional, List, Literal
 import logging
 import secrets
 
+from ratings import DEFAULT_RATING, battle_rating_updates
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/matchmaking", tags=["matchmaking"])
@@ -21,6 +23,7 @@ class QueueStatus(BaseModel):
     position: Optional[int] = None
     wait_time_seconds: Optional[int] = None
     estimated_wait: Optional[str] = None
+    estimated_wait_seconds: Optional[int] = None
 
 class MatchFoundResponse(BaseModel):
     match_id: str
@@ -45,14 +48,25 @@ def parse_team_size(team_size: str) -> int:
     """Convert team size string (e.g. '3v3') to integer (3)"""
     return int(team_size.split('v')[0])
 
+def battle_agora_uids(count: int) -> List[int]:
+    """Distinct nonzero Agora uids for a match's participants (uid 0 would let a token join as anyone)"""
+    uids = set()
+    while len(uids) < count:
+        uids.add(secrets.randbelow(2**31 - 1) + 1)
+    return list(uids)
+
+def format_wait(seconds: int) -> str:
+    """Human readable wait estimate (e.g. '< 30s', '~2 min')"""
+    if seconds < 60:
+        return f"< {max(5, -(-seconds // 5) * 5)}s"
+    return f"~{round(seconds / 60)} min"
+
 async def check_user_availability(user_id: str, db) -> bool:
     """Check if user is available for matchmaking (not in stream/battle)"""
+    from server import matchmaker
+    
     # Check if user is already in a queue
-    in_queue = await db.matchmaking_queue.find_one({
-        "user_id": user_id,
-        "status": "waiting"
-    })
-    if in_queue:
+    if matchmaker.is_queued(user_id):
         return False
     
     # Check if user is in an active battle
@@ -65,37 +79,26 @@ async def check_user_availability(user_id: str, db) -> bool:
     
     return True
 
-async def find_match(team_size: str, region: str, db):
-    """Find a suitable match for the given criteria"""
-    players_needed = parse_team_size(team_size) * 2  # Total players needed (both teams)
-    
-    # Get waiting players for this team size and region (FIFO - longest wait first)
-    waiting_players = await db.matchmaking_queue.find({
-        "team_size": team_size,
-        "region": region,
-        "status": "waiting"
-    }).sort("joined_at", 1).limit(players_needed).to_list(players_needed)
-    
-    # If not enough players, try global region as fallback
-    if len(waiting_players) < players_needed and region != "global":
-        global_players = await db.matchmaking_queue.find({
-            "team_size": team_size,
-            "region": "global",
-            "status": "waiting"
-        }).sort("joined_at", 1).limit(players_needed - len(waiting_players)).to_list(players_needed)
-        waiting_players.extend(global_players)
-    
-    # Check if we have enough players
-    if len(waiting_players) >= players_needed:
-        return waiting_players[:players_needed]
-    
-    return None
-
-async def create_battle_match(players: List[dict], team_size: str, db):
-    """Create a new battle match with the given players"""
+async def create_battle_match(players: List[dict], team_size: str, db) -> Optional[str]:
+    """Create a new battle match with the given players.
+    Returns None (creating nothing) if any of them is no longer waiting in the queue."""
     match_id = f"battle_{secrets.token_hex(8)}"
     team_per_side = parse_team_size(team_size)
     
+    # Claim the queue entries first, so a player who left meanwhile aborts the match
+    player_ids = [p["user_id"] for p in players]
+    claimed = await db.matchmaking_queue.update_many(
+        {"user_id": {"$in": player_ids}, "status": "waiting"},
+        {"$set": {"status": "matched", "match_id": match_id, "matched_at": datetime.now(timezone.utc)}}
+    )
+    if claimed.modified_count < len(player_ids):
+        await db.matchmaking_queue.update_many(
+            {"match_id": match_id, "status": "matched"},
+            {"$set": {"status": "waiting"}, "$unset": {"match_id": "", "matched_at": ""}}
+        )
+        logger.info(f"Battle match {match_id} aborted: a player left the queue")
+        return None
+    
     # Split players into two teams
     team_a = players[:team_per_side]
     team_b = players[team_per_side:]
@@ -116,13 +119,15 @@ async def create_battle_match(players: List[dict], team_size: str, db):
     
     await db.battle_matches.insert_one(match_doc)
     
-    # Create participant records
+    # Create participant records, each with the numeric uid it joins the channel as
     participants = []
+    agora_uids = iter(battle_agora_uids(len(players)))
     
     for player in team_a:
         participants.append({
             "match_id": match_id,
             "user_id": player["user_id"],
+            "agora_uid": next(agora_uids),
             "team": "team_a",
             "status": "pending",
             "ready": False,
@@ -133,6 +138,7 @@ async def create_battle_match(players: List[dict], team_size: str, db):
         participants.append({
             "match_id": match_id,
             "user_id": player["user_id"],
+            "agora_uid": next(agora_uids),
             "team": "team_b",
             "status": "pending",
             "ready": False,
@@ -142,13 +148,6 @@ async def create_battle_match(players: List[dict], team_size: str, db):
     if participants:
         await db.battle_participants.insert_many(participants)
     
-    # Update queue entries to matched
-    player_ids = [p["user_id"] for p in players]
-    await db.matchmaking_queue.update_many(
-        {"user_id": {"$in": player_ids}, "status": "waiting"},
-        {"$set": {"status": "matched", "match_id": match_id, "matched_at": datetime.now(timezone.utc)}}
-    )
-    
     logger.info(f"Created battle match {match_id} with {len(team_a)} vs {len(team_b)}")
     
     return match_id
@@ -158,7 +157,8 @@ async def create_battle_match(players: List[dict], team_size: str, db):
 async def join_queue(request: JoinQueueRequest, req: Request):
     """Join the matchmaking queue"""
     from auth import get_current_user
-    from server import db
+    from matchmaker import AlreadyQueuedError
+    from server import db, matchmaker
     
     try:
         # Get current user
@@ -166,7 +166,7 @@ async def join_queue(request: JoinQueueRequest, req: Request):
         if not current_user:
             raise HTTPException(status_code=401, detail="Not authenticated")
         
-        # Check if user is available
+        # Check if user is available (enqueue re-checks the queue atomically)
         if not await check_user_availability(current_user.user_id, db):
             raise HTTPException(status_code=400, detail="Already in queue or battle")
         
@@ -188,40 +188,50 @@ async def join_queue(request: JoinQueueRequest, req: Request):
                     detail=f"Guest {guest_id} is not available"
                 )
         
-        # Add host to queue
+        # Skill ratings drive who the party is matched against
+        party_ids = [current_user.user_id] + request.guest_ids
+        ratings = {
+            user["user_id"]: user.get("rating", DEFAULT_RATING)
+            async for user in db.users.find({"user_id": {"$in": party_ids}}, {"_id": 0, "user_id": 1, "rating": 1})
+        }
+        
+        # Host and guests are queued (and persisted) together
         queue_entry = {
             "user_id": current_user.user_id,
             "team_size": request.team_size,
             "region": request.region,
             "is_leader": True,
             "team_members": request.guest_ids,
+            "rating": ratings.get(current_user.user_id, DEFAULT_RATING),
             "status": "waiting",
             "joined_at": datetime.now(timezone.utc),
             "expires_at": datetime.now(timezone.utc) + timedelta(seconds=120)  # 2 min timeout
         }
         
-        await db.matchmaking_queue.insert_one(queue_entry)
-        
-        # Add guests to queue
+        queue_entries = [queue_entry]
         for guest_id in request.guest_ids:
-            guest_entry = {
+            queue_entries.append({
                 "user_id": guest_id,
                 "team_size": request.team_size,
                 "region": request.region,
                 "is_leader": False,
                 "leader_id": current_user.user_id,
+                "rating": ratings.get(guest_id, DEFAULT_RATING),
                 "status": "waiting",
                 "joined_at": datetime.now(timezone.utc),
                 "expires_at": datetime.now(timezone.utc) + timedelta(seconds=120)
-            }
-            await db.matchmaking_queue.insert_one(guest_entry)
+            })
+        
+        try:
+            await matchmaker.enqueue(queue_entries)
+        except AlreadyQueuedError:
+            raise HTTPException(status_code=400, detail="Already in queue or battle")
         
         logger.info(f"User {current_user.user_id} joined {request.team_size} queue with {len(request.guest_ids)} guests")
         
         # Try to find match immediately
-        match_players = await find_match(request.team_size, request.region, db)
-        if match_players:
-            match_id = await create_battle_match(match_players, request.team_size, db)
+        match_id = await matchmaker.try_match(request.team_size, request.region)
+        if match_id:
             # In real implementation, would send realtime notifications here
             logger.info(f"Match found immediately: {match_id}")
         
@@ -242,22 +252,17 @@ async def join_queue(request: JoinQueueRequest, req: Request):
 async def leave_queue(req: Request):
     """Leave the matchmaking queue"""
     from auth import get_current_user
-    from server import db
+    from server import matchmaker
     
     try:
         current_user = await get_current_user(req)
         if not current_user:
             raise HTTPException(status_code=401, detail="Not authenticated")
         
-        # Remove from queue
-        result = await db.matchmaking_queue.delete_many({
-            "$or": [
-                {"user_id": current_user.user_id, "status": "waiting"},
-                {"leader_id": current_user.user_id, "status": "waiting"}
-            ]
-        })
+        # Remove from queue (leader's guests leave with them)
+        removed = await matchmaker.remove(current_user.user_id)
         
-        logger.info(f"User {current_user.user_id} left queue, removed {result.deleted_count} entries")
+        logger.info(f"User {current_user.user_id} left queue, removed {removed} entries")
         
         return {
             "success": True,
@@ -274,41 +279,28 @@ async def leave_queue(req: Request):
 async def get_queue_status(req: Request):
     """Get current queue status for user"""
     from auth import get_current_user
-    from server import db
+    from server import matchmaker
     
     try:
         current_user = await get_current_user(req)
         if not current_user:
             raise HTTPException(status_code=401, detail="Not authenticated")
         
-        # Check if in queue
-        queue_entry = await db.matchmaking_queue.find_one({
-            "user_id": current_user.user_id,
-            "status": "waiting"
-        })
-        
+        # Served from the matchmaker's memory; clients poll this while queued
+        queue_entry = matchmaker.get_entry(current_user.user_id)
         if not queue_entry:
             return QueueStatus(in_queue=False)
         
-        # Calculate position and wait time
-        wait_time = (datetime.now(timezone.utc) - queue_entry["joined_at"]).seconds
-        
-        # Count position (how many waiting before this user)
-        position = await db.matchmaking_queue.count_documents({
-            "team_size": queue_entry["team_size"],
-            "region": queue_entry["region"],
-            "status": "waiting",
-            "joined_at": {"$lt": queue_entry["joined_at"]}
-        })
-        
-        estimated_wait = "< 30s" if position < 2 else "< 60s" if position < 5 else "1-2 min"
+        now = datetime.now(timezone.utc)
+        remaining = matchmaker.estimated_wait(current_user.user_id, now)
         
         return QueueStatus(
             in_queue=True,
             team_size=queue_entry["team_size"],
-            position=position + 1,
-            wait_time_seconds=wait_time,
-            estimated_wait=estimated_wait
+            position=matchmaker.queue_position(current_user.user_id),
+            wait_time_seconds=int((now - queue_entry["joined_at"]).total_seconds()),
+            estimated_wait=format_wait(remaining) if remaining is not None else None,
+            estimated_wait_seconds=remaining
         )
         
     except HTTPException:
@@ -317,6 +309,13 @@ async def get_queue_status(req: Request):
         logger.error(f"Queue status error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/stats")
+async def get_matchmaking_stats():
+    """Queue sizes, match throughput and wait-time percentiles"""
+    from server import matchmaker
+    
+    return matchmaker.stats()
+
 @router.get("/match/{match_id}")
 async def get_match_details(match_id: str, req: Request):
     """Get details of a specific battle match"""
@@ -455,13 +454,22 @@ async def update_score(match_id: str, team: str, points: int, req: Request):
 async def end_battle(match_id: str, req: Request):
     """End a battle and determine winner"""
     from auth import get_current_user
-    from server import db
+    from server import db, gift_ledger
     
     try:
         current_user = await get_current_user(req)
         if not current_user:
             raise HTTPException(status_code=401, detail="Not authenticated")
         
+        participant = await db.battle_participants.find_one(
+            {"match_id": match_id, "user_id": current_user.user_id}, {"_id": 1}
+        )
+        if not participant:
+            raise HTTPException(status_code=403, detail="Not a participant in this battle")
+        
+        # Land buffered gifts first so the final scores include them
+        await gift_ledger.flush()
+        
         # Get match
         match = await db.battle_matches.find_one({"match_id": match_id})
         if not match:
@@ -478,9 +486,9 @@ async def end_battle(match_id: str, req: Request):
         else:
             winner = "tie"
         
-        # Update match
-        await db.battle_matches.update_one(
-            {"match_id": match_id},
+        # Update match (only once, so ratings and XP are not applied twice)
+        updated = await db.battle_matches.update_one(
+            {"match_id": match_id, "status": {"$ne": "completed"}},
             {
                 "$set": {
                     "status": "completed",
@@ -489,6 +497,8 @@ async def end_battle(match_id: str, req: Request):
                 }
             }
         )
+        if updated.modified_count == 0:
+            raise HTTPException(status_code=400, detail="Battle already ended")
         
         # Update participants
         await db.battle_participants.update_many(
@@ -499,6 +509,19 @@ async def end_battle(match_id: str, req: Request):
         # Get participants for XP update
         participants = await db.battle_participants.find({"match_id": match_id}).to_list(100)
         
+        # Elo update against the opposing team's mean rating
+        players = {
+            user["user_id"]: user
+            async for user in db.users.find(
+                {"user_id": {"$in": [p["user_id"] for p in participants]}},
+                {"_id": 0, "user_id": 1, "rating": 1, "rating_games": 1}
+            )
+        }
+        teams = {"team_a": {}, "team_b": {}}
+        for participant in participants:
+            teams[participant["team"]][participant["user_id"]] = players.get(participant["user_id"], {})
+        new_ratings = battle_rating_updates(teams, winner)
+        
         # Award XP to participants
         xp_awards = {
             "win": 100,
@@ -522,17 +545,17 @@ async def end_battle(match_id: str, req: Request):
                 result = "loss"
             
             # Award XP to user (assumes users collection exists with XP tracking)
-            await db.users.update_one(
-                {"user_id": user_id},
-                {
-                    "$inc": {
-                        "total_xp": xp_amount,
-                        "battle_wins": 1 if result == "win" else 0,
-                        "battle_total": 1
-                    }
-                },
-                upsert=True
-            )
+            update = {
+                "$inc": {
+                    "total_xp": xp_amount,
+                    "battle_wins": 1 if result == "win" else 0,
+                    "battle_total": 1
+                }
+            }
+            if user_id in new_ratings:
+                update["$set"] = {"rating": new_ratings[user_id]}
+                update["$inc"]["rating_games"] = 1
+            await db.users.update_one({"user_id": user_id}, update, upsert=True)
             
             logger.info(f"Awarded {xp_amount} XP to {user_id} for battle {result}")
         
@@ -546,6 +569,7 @@ async def end_battle(match_id: str, req: Request):
                 "team_b": team_b_score
             },
             "xp_awarded": True,
+            "ratings": new_ratings,
             "message": "Battle completed!",
             "match_duration": (datetime.now(timezone.utc) - match["started_at"]).seconds if match.get("started_at") else 0
         }
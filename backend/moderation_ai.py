@@ -2,7 +2,10 @@ from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from datetime import datetime, timezone
 from typing import Literal, Optional
+import asyncio
 import logging
+import uuid
+import blocklist
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import os
 
@@ -17,6 +20,7 @@ class ModerationSettings(BaseModel):
     allowed_topics: list = []  # Topics the creator is okay with
     blocked_words: list = []  # Custom blocked words
     auto_timeout_enabled: bool = True
+    moderation_mode: Literal["pre", "post"] = "pre"  # post: publish first, retract on timeout/ban
     
 class SafeWordTrigger(BaseModel):
     stream_id: str
@@ -41,19 +45,18 @@ def get_strictness_thresholds(level: str) -> dict:
     }
     return thresholds.get(level, thresholds["moderate"])
 
-async def moderate_content_ai(content: str, strictness: str = "moderate") -> dict:
-    """AI-powered content moderation with adjustable strictness"""
-    try:
-        EMERGENT_LLM_KEY = os.getenv("EMERGENT_LLM_KEY")
-        
-        if not EMERGENT_LLM_KEY:
-            logger.warning("No LLM key - using permissive moderation")
-            return {"action": "allow", "score": 0.0, "reason": "No AI available"}
-        
-        # Use LLM for intelligent moderation
-        llm = LlmChat(api_key=EMERGENT_LLM_KEY, model="gpt-4o-mini")
-        
-        prompt = f"""Analyze this message for a comedy roast stream with {strictness} moderation.
+_INCONCLUSIVE = {"action": "allow", "score": 0.0, "reason": "AI analysis inconclusive"}
+
+def saturation_decision(strictness: str) -> dict:
+    """Decision used when the moderation queue cannot answer within its deadline.
+    Strict creators' messages are flagged for a post-moderation re-check (retracted on timeout/ban)."""
+    return {"action": "allow", "score": 0.0, "reason": "Moderation busy", "recheck": strictness == "strict"}
+
+def classify_content(content: str, strictness: str) -> dict:
+    """Blocking LLM classification; runs on the moderation worker pool"""
+    llm = LlmChat(api_key=os.getenv("EMERGENT_LLM_KEY"), model="gpt-4o-mini")
+    
+    prompt = f"""Analyze this message for a comedy roast stream with {strictness} moderation.
 Message: "{content}"
 
 Rate toxicity 0-1 and determine if it should be:
@@ -63,31 +66,113 @@ Rate toxicity 0-1 and determine if it should be:
 - ban (hate speech/harassment)
 
 Respond in format: action|score|reason"""
+    
+    response = llm.send_message_sync(UserMessage(content=prompt))
+    parts = response.strip().split('|')
+    
+    if len(parts) >= 3:
+        return {"action": parts[0].strip(), "score": float(parts[1].strip()), "reason": parts[2].strip()}
+    return _INCONCLUSIVE
+
+async def moderate_content_ai(content: str, strictness: str = "moderate", priority: float = 0.0) -> dict:
+    """AI-powered content moderation with adjustable strictness"""
+    from server import moderation_cache, moderation_pool
+    
+    try:
+        EMERGENT_LLM_KEY = os.getenv("EMERGENT_LLM_KEY")
+        
+        if not EMERGENT_LLM_KEY:
+            logger.warning("No LLM key - using permissive moderation")
+            return {"action": "allow", "score": 0.0, "reason": "No AI available"}
         
-        response = llm.send_message_sync(UserMessage(content=prompt))
-        parts = response.strip().split('|')
+        cached = await moderation_cache.get(content, "chat", strictness)
+        if cached:
+            return cached
         
-        if len(parts) >= 3:
-            action = parts[0].strip()
-            score = float(parts[1].strip())
-            reason = parts[2].strip()
-        else:
-            action = "allow"
-            score = 0.0
-            reason = "AI analysis inconclusive"
+        # Queued on the worker pool; None means it could not be served in time
+        result = await moderation_pool.submit(content, strictness, priority)
+        if result is None:
+            return saturation_decision(strictness)
         
-        return {"action": action, "score": score, "reason": reason}
+        # Inconclusive answers are not cached so the next occurrence is re-checked
+        if result is not _INCONCLUSIVE:
+            await moderation_cache.set(content, "chat", strictness, result)
+        return dict(result)
         
     except Exception as e:
         logger.error(f"AI moderation error: {e}")
         return {"action": "allow", "score": 0.0, "reason": "Error in AI"}
 
+# Post-moderation tasks still running (kept so they are not garbage collected)
+_post_moderation_tasks = set()
+
+def schedule_post_moderation(content: str, stream_id: str, user_id: str, message_id: str,
+                             strictness: str, priority: float) -> None:
+    """Moderate a published message in the background"""
+    task = asyncio.create_task(
+        post_moderate_message(content, stream_id, user_id, message_id, strictness, priority)
+    )
+    _post_moderation_tasks.add(task)
+    task.add_done_callback(_post_moderation_tasks.discard)
+
+async def log_moderation_action(db, stream_id: str, user_id: str, content: str, result: dict,
+                                strictness: str, message_id: Optional[str] = None, mode: str = "pre"):
+    """Record a moderation decision in moderation_actions"""
+    action_doc = {
+        "stream_id": stream_id,
+        "user_id": user_id,
+        "content": content,
+        "action": result["action"],
+        "ai_score": result["score"],
+        "reason": result["reason"],
+        "strictness_level": strictness,
+        "moderation_mode": mode,
+        "created_at": datetime.now(timezone.utc)
+    }
+    if message_id:
+        action_doc["message_id"] = message_id
+    
+    await db.moderation_actions.insert_one(action_doc)
+    
+    if result["action"] in ["timeout", "ban"]:
+        logger.warning(f"Content moderated: {result['action']} - {user_id} - {result['reason']}")
+
+async def post_moderate_message(content: str, stream_id: str, user_id: str, message_id: str,
+                                strictness: str, priority: float):
+    """Moderate an already published message and retract it on timeout/ban"""
+    from server import db, moderation_pool, event_hub, trending
+    
+    try:
+        result = await moderate_content_ai(content, strictness, priority)
+        moderation_pool.record_outcome(user_id, result["action"])
+        await log_moderation_action(db, stream_id, user_id, content, result, strictness, message_id, mode="post")
+        if result["action"] in ["allow", "warn"]:
+            trending.record_comment(stream_id)
+        
+        if result["action"] in ["timeout", "ban"]:
+            await db.chat_retractions.insert_one({
+                "stream_id": stream_id,
+                "message_id": message_id,
+                "user_id": user_id,
+                "action": result["action"],
+                "reason": result["reason"],
+                "created_at": datetime.now(timezone.utc)
+            })
+            event_hub.publish(stream_id, "chat_retraction", {
+                "message_id": message_id,
+                "user_id": user_id,
+                "action": result["action"]
+            })
+            logger.info(f"Retracted message {message_id} in stream {stream_id}")
+    except Exception as e:
+        logger.error(f"Post-moderation error for message {message_id}: {e}")
+
 # Routes
 @router.post("/settings/update")
 async def update_moderation_settings(settings: ModerationSettings, req: Request):
     """Update moderation settings for a creator"""
     from auth import get_current_user
-    from server import db
+    from server import db, moderation_settings_cache
     
     try:
         current_user = await get_current_user(req)
@@ -100,6 +185,7 @@ async def update_moderation_settings(settings: ModerationSettings, req: Request)
             "allowed_topics": settings.allowed_topics,
             "blocked_words": settings.blocked_words,
             "auto_timeout_enabled": settings.auto_timeout_enabled,
+            "moderation_mode": settings.moderation_mode,
             "updated_at": datetime.now(timezone.utc)
         }
         
@@ -108,6 +194,8 @@ async def update_moderation_settings(settings: ModerationSettings, req: Request)
             {"$set": settings_doc},
             upsert=True
         )
+        moderation_settings_cache.update_settings(settings.creator_id, settings_doc)
+        blocklist.rebuild(settings.creator_id, settings.blocked_words, settings_doc["updated_at"])
         
         logger.info(f"Moderation settings updated for creator {settings.creator_id}: {settings.strictness_level}")
         
@@ -137,7 +225,8 @@ async def get_moderation_settings(creator_id: str, req: Request):
                 "strictness_level": "moderate",
                 "allowed_topics": [],
                 "blocked_words": [],
-                "auto_timeout_enabled": True
+                "auto_timeout_enabled": True,
+                "moderation_mode": "pre"
             }
         
         return settings
@@ -184,46 +273,56 @@ async def trigger_safeword(trigger: SafeWordTrigger, req: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/moderate/chat")
-async def moderate_chat_message(content: str, stream_id: str, user_id: str):
-    """Moderate a chat message with AI"""
-    from server import db
+async def moderate_chat_message(content: str, stream_id: str, user_id: str, message_id: Optional[str] = None):
+    """Moderate a chat message with AI (or publish first in post-moderation mode)"""
+    from server import db, trending, presence, moderation_pool, moderation_settings_cache
     
     try:
-        # Get creator's moderation settings
-        stream = await db.streams.find_one({"id": stream_id})
-        if not stream:
+        # Get creator's moderation settings (cached per stream and creator)
+        creator_id, settings = await moderation_settings_cache.for_stream(stream_id)
+        if not creator_id:
             raise HTTPException(status_code=404, detail="Stream not found")
         
-        creator_id = stream["host_id"]
-        settings = await db.moderation_settings.find_one({"creator_id": creator_id})
-        
         strictness = settings["strictness_level"] if settings else "moderate"
+        mode = settings.get("moderation_mode", "pre") if settings else "pre"
         
-        # AI moderation
-        result = await moderate_content_ai(content, strictness)
-        
-        # Log moderation action
-        action_doc = {
-            "stream_id": stream_id,
-            "user_id": user_id,
-            "content": content,
-            "action": result["action"],
-            "ai_score": result["score"],
-            "reason": result["reason"],
-            "strictness_level": strictness,
-            "created_at": datetime.now(timezone.utc)
-        }
+        # Creator's blocked words are enforced locally; only the rest goes to the AI
+        blocked_word = blocklist.matcher_for(creator_id, settings).find(content)
+        if blocked_word:
+            result = {"action": "timeout", "score": 1.0, "reason": f"Blocked word: {blocked_word}"}
+        else:
+            priority = moderation_pool.priority(presence.current_viewers(stream_id), user_id, "chat")
+            
+            if mode != "post":
+                result = await moderate_content_ai(content, strictness, priority)
+            
+            if mode == "post" or result.get("recheck"):
+                # Publish now; the verdict arrives later and may retract the message.
+                # Strict creators whose message got no verdict in time take this path too.
+                message_id = message_id or str(uuid.uuid4())
+                schedule_post_moderation(content, stream_id, user_id, message_id, strictness, priority)
+                return {
+                    "action": "allow",
+                    "score": 0.0,
+                    "reason": "Published, moderation pending",
+                    "allowed": True,
+                    "pending": True,
+                    "message_id": message_id
+                }
+        moderation_pool.record_outcome(user_id, result["action"])
         
-        await db.moderation_actions.insert_one(action_doc)
+        await log_moderation_action(db, stream_id, user_id, content, result, strictness, message_id)
         
-        if result["action"] in ["timeout", "ban"]:
-            logger.warning(f"Content moderated: {result['action']} - {user_id} - {result['reason']}")
+        allowed = result["action"] in ["allow", "warn"]
+        if allowed:
+            # Only messages that pass moderation count towards trending
+            trending.record_comment(stream_id)
         
         return {
             "action": result["action"],
             "score": result["score"],
             "reason": result["reason"],
-            "allowed": result["action"] in ["allow", "warn"]
+            "allowed": allowed
         }
         
     except HTTPException:
@@ -231,3 +330,34 @@ async def moderate_chat_message(content: str, stream_id: str, user_id: str):
     except Exception as e:
         logger.error(f"Chat moderation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/retractions/{stream_id}")
+async def get_chat_retractions(stream_id: str, since: Optional[datetime] = None):
+    """Messages retracted by post-moderation, oldest first"""
+    from server import db
+    
+    try:
+        query = {"stream_id": stream_id}
+        if since:
+            query["created_at"] = {"$gt": since}
+        
+        retractions = await db.chat_retractions.find(query, {"_id": 0}).sort("created_at", 1).to_list(200)
+        return {"retractions": retractions}
+        
+    except Exception as e:
+        logger.error(f"Get retractions error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/cache/stats")
+async def get_moderation_cache_stats():
+    """Moderation result cache hit-rate metrics"""
+    from server import moderation_cache
+    
+    return moderation_cache.stats()
+
+@router.get("/queue/stats")
+async def get_moderation_queue_stats():
+    """Moderation worker pool queue-depth and drop metrics"""
+    from server import moderation_pool
+    
+    return moderation_pool.stats()
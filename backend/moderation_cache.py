@@ -0,0 +1,99 @@
+"""
+Content-addressed moderation result cache
+=========================================
+
+Usernames, bios and chat spam repeat constantly, so moderation results are
+cached by SHA-256 of the normalized text (NFKC, casefolded, whitespace
+collapsed) plus content type and strictness. The first tier is an in-memory
+TTL/LRU cache; when a database is passed in, `moderation_cache` documents act
+as a shared second tier (expired by a TTL index). Only real model verdicts
+are stored - fallbacks for missing keys, timeouts or errors are never cached.
+"""
+
+from cachetools import TTLCache
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+MODERATION_CACHE_SIZE = int(os.getenv("MODERATION_CACHE_SIZE", "100000"))
+MODERATION_CACHE_TTL_SECONDS = int(os.getenv("MODERATION_CACHE_TTL_SECONDS", "3600"))
+MODERATION_CACHE_MONGO_TTL_SECONDS = int(os.getenv("MODERATION_CACHE_MONGO_TTL_SECONDS", "86400"))
+MODERATION_CACHE_MONGO = os.getenv("MODERATION_CACHE_MONGO", "false").lower() == "true"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text).casefold()).strip()
+
+
+def cache_key(text: str, content_type: str, strictness: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode()).hexdigest()
+    return f"{content_type}:{strictness}:{digest}"
+
+
+class ModerationCache:
+    def __init__(self, db=None, max_entries: int = MODERATION_CACHE_SIZE, ttl: int = MODERATION_CACHE_TTL_SECONDS):
+        self.db = db  # Second tier is enabled when a database is given
+        self._memory = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._hits = 0
+        self._mongo_hits = 0
+        self._misses = 0
+
+    async def get(self, text: str, content_type: str, strictness: str) -> Optional[dict]:
+        key = cache_key(text, content_type, strictness)
+        result = self._memory.get(key)
+        if result is not None:
+            self._hits += 1
+            return result
+
+        if self.db is not None:
+            try:
+                doc = await self.db.moderation_cache.find_one(
+                    {"key": key, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                    {"_id": 0, "result": 1}
+                )
+            except Exception as e:
+                logger.error(f"Moderation cache lookup error: {e}")
+                doc = None
+            if doc:
+                self._mongo_hits += 1
+                self._memory[key] = doc["result"]
+                return doc["result"]
+
+        self._misses += 1
+        return None
+
+    async def set(self, text: str, content_type: str, strictness: str, result: dict) -> None:
+        key = cache_key(text, content_type, strictness)
+        self._memory[key] = result
+        if self.db is not None:
+            try:
+                await self.db.moderation_cache.update_one(
+                    {"key": key},
+                    {"$set": {
+                        "key": key,
+                        "result": result,
+                        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=MODERATION_CACHE_MONGO_TTL_SECONDS)
+                    }},
+                    upsert=True
+                )
+            except Exception as e:
+                logger.error(f"Moderation cache store error: {e}")
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._mongo_hits + self._misses
+        return {
+            "entries": len(self._memory),
+            "memory_hits": self._hits,
+            "mongo_hits": self._mongo_hits,
+            "misses": self._misses,
+            "hit_rate": round((self._hits + self._mongo_hits) / lookups, 4) if lookups else 0.0,
+            "mongo_tier_enabled": self.db is not None
+        }
@@ -0,0 +1,101 @@
+"""
+Async, batched OpenAI moderation client
+=======================================
+
+moderate() never blocks the event loop. Concurrent requests arriving within
+MODERATION_BATCH_WINDOW_MS are coalesced into one multi-input moderations call
+(up to MODERATION_MAX_BATCH inputs), at most MODERATION_MAX_CONCURRENCY calls
+are in flight, and a call that takes longer than MODERATION_TIMEOUT_SECONDS
+resolves its requests with None so callers can fall back instead of waiting
+on a slow upstream.
+"""
+
+from typing import List, Optional, Set, Tuple
+import asyncio
+import logging
+import os
+import openai
+
+logger = logging.getLogger(__name__)
+
+MODERATION_MODEL = "omni-moderation-latest"
+MODERATION_BATCH_WINDOW_MS = int(os.getenv("MODERATION_BATCH_WINDOW_MS", "10"))
+MODERATION_MAX_BATCH = int(os.getenv("MODERATION_MAX_BATCH", "32"))
+MODERATION_MAX_CONCURRENCY = int(os.getenv("MODERATION_MAX_CONCURRENCY", "4"))
+MODERATION_TIMEOUT_SECONDS = float(os.getenv("MODERATION_TIMEOUT_SECONDS", "3"))
+
+
+class BatchedModerationClient:
+    def __init__(self, api_key: Optional[str], window_ms: int = MODERATION_BATCH_WINDOW_MS,
+                 max_batch: int = MODERATION_MAX_BATCH, max_concurrency: int = MODERATION_MAX_CONCURRENCY,
+                 timeout: float = MODERATION_TIMEOUT_SECONDS):
+        self.api_key = api_key
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._client: Optional[openai.AsyncOpenAI] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+    def _get_client(self) -> openai.AsyncOpenAI:
+        if self._client is None:
+            self._client = openai.AsyncOpenAI(api_key=self.api_key, max_retries=0)
+        return self._client
+
+    async def moderate(self, text: str) -> Optional[dict]:
+        """Return {"flagged", "categories", "category_scores"}, or None on timeout/error."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if batch:
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+        if self._pending:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.window, self._flush)
+
+    async def _call(self, texts: List[str]):
+        async with self._semaphore:
+            return await self._get_client().moderations.create(model=MODERATION_MODEL, input=texts)
+
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        results: List[Optional[dict]] = []
+        try:
+            # The timeout includes time spent waiting for a concurrency slot
+            response = await asyncio.wait_for(self._call([text for text, _ in batch]), timeout=self.timeout)
+            results = [
+                {
+                    "flagged": result.flagged,
+                    "categories": result.categories.model_dump(by_alias=True),
+                    "category_scores": result.category_scores.model_dump(by_alias=True),
+                }
+                for result in response.results
+            ]
+        except asyncio.TimeoutError:
+            logger.warning(f"Moderation call timed out after {self.timeout}s ({len(batch)} inputs)")
+        except Exception as e:
+            logger.error(f"Moderation call failed ({len(batch)} inputs): {e}")
+
+        for i, (_, future) in enumerate(batch):
+            if not future.done():
+                future.set_result(results[i] if i < len(results) else None)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
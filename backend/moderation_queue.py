@@ -0,0 +1,163 @@
+"""
+Moderation worker pool
+======================
+
+The LLM client used for chat moderation is blocking (send_message_sync), so
+classifications run on a bounded thread pool of MODERATION_WORKERS threads fed
+from an asyncio priority queue:
+
+- priority: chat before profile text, bigger audiences first, senders with
+  recent timeouts/bans first (lower value is served sooner)
+- backpressure: once MODERATION_QUEUE_MAX_DEPTH jobs are waiting, new jobs are
+  not queued at all
+- deadlines: a caller waits at most MODERATION_DEADLINE_MS; jobs still queued
+  past their deadline are skipped by the workers
+
+In both overload cases submit() returns None and the caller applies its
+fallback decision, so chat latency is bounded by the deadline rather than by
+the LLM's tail latency.
+"""
+
+from cachetools import LRUCache
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+MODERATION_WORKERS = int(os.getenv("MODERATION_WORKERS", "8"))
+MODERATION_QUEUE_MAX_DEPTH = int(os.getenv("MODERATION_QUEUE_MAX_DEPTH", "1000"))
+MODERATION_DEADLINE_MS = int(os.getenv("MODERATION_DEADLINE_MS", "1500"))
+
+CONTENT_TYPE_PRIORITY = {"chat": 0.0, "username": 1.0, "bio": 2.0}
+MAX_STRIKE_BOOST = 3
+
+
+@dataclass(order=True)
+class ModerationJob:
+    priority: float
+    seq: int
+    deadline: float = field(compare=False)
+    content: str = field(compare=False)
+    strictness: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class ModerationWorkerPool:
+    def __init__(self, classify: Callable[[str, str], dict], workers: int = MODERATION_WORKERS,
+                 max_depth: int = MODERATION_QUEUE_MAX_DEPTH, deadline_ms: int = MODERATION_DEADLINE_MS):
+        """classify(content, strictness) is the blocking call run on the thread pool."""
+        self.classify = classify
+        self.workers = workers
+        self.max_depth = max_depth
+        self.deadline = deadline_ms / 1000
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._strikes = LRUCache(maxsize=100000)  # user_id -> recent timeout/ban count
+        self._in_flight = 0
+        self._max_depth_seen = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._expired = 0
+        self._deadline_missed = 0
+
+    # ----- priority inputs -----
+
+    def record_outcome(self, user_id: str, action: str) -> None:
+        if action in ("timeout", "ban"):
+            self._strikes[user_id] = self._strikes.get(user_id, 0) + 1
+
+    def priority(self, viewer_count: int, user_id: Optional[str], content_type: str = "chat") -> float:
+        strikes = min(self._strikes.get(user_id, 0), MAX_STRIKE_BOOST) if user_id else 0
+        return CONTENT_TYPE_PRIORITY.get(content_type, 1.0) - math.log10(1 + max(viewer_count, 0)) - strikes
+
+    # ----- submission -----
+
+    async def submit(self, content: str, strictness: str, priority: float = 0.0) -> Optional[dict]:
+        """Classify content, or return None if the queue is saturated or the deadline passes."""
+        if self._queue is None:
+            await self.start()
+        if self._queue.qsize() >= self.max_depth:
+            self._rejected += 1
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        job = ModerationJob(priority, next(self._seq), time.monotonic() + self.deadline, content, strictness, future)
+        self._queue.put_nowait(job)
+        self._max_depth_seen = max(self._max_depth_seen, self._queue.qsize())
+
+        try:
+            # Shielded so a missed deadline leaves a running classification alone
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            self._deadline_missed += 1
+            future.cancel()
+            return None
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.future.done() or time.monotonic() > job.deadline:
+                    self._expired += 1
+                    continue
+                self._in_flight += 1
+                try:
+                    result = await loop.run_in_executor(self._executor, self.classify, job.content, job.strictness)
+                    self._completed += 1
+                    if not job.future.done():
+                        job.future.set_result(result)
+                except Exception as e:
+                    self._failed += 1
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                finally:
+                    self._in_flight -= 1
+            finally:
+                self._queue.task_done()
+
+    # ----- metrics -----
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue_depth": self._max_depth_seen,
+            "queue_limit": self.max_depth,
+            "in_flight": self._in_flight,
+            "workers": self.workers,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected_queue_full": self._rejected,
+            "deadline_missed": self._deadline_missed,
+            "expired_in_queue": self._expired,
+            "deadline_ms": int(self.deadline * 1000)
+        }
+
+    # ----- lifecycle -----
+
+    async def start(self) -> None:
+        if self._queue is not None:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="moderation")
+        # One coroutine per thread, so the executor never queues work of its own
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._queue = None
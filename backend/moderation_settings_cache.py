@@ -0,0 +1,65 @@
+"""
+Chat-path moderation settings cache
+===================================
+
+Chat moderation needs the stream's host and that creator's
+moderation_settings for every message. Both are cached in process:
+
+- stream_id -> creator_id, dropped when the stream ends
+- creator_id -> settings document (None when the creator has no settings),
+  replaced by update_moderation_settings
+
+Entries also expire after MODERATION_SETTINGS_TTL_SECONDS so changes made
+through another worker are picked up without cross-process invalidation.
+"""
+
+from cachetools import TTLCache
+from typing import Optional, Tuple
+import os
+
+MODERATION_SETTINGS_CACHE_SIZE = int(os.getenv("MODERATION_SETTINGS_CACHE_SIZE", "50000"))
+MODERATION_SETTINGS_TTL_SECONDS = int(os.getenv("MODERATION_SETTINGS_TTL_SECONDS", "60"))
+
+_MISSING = object()
+
+
+class ModerationSettingsCache:
+    def __init__(self, db, max_entries: int = MODERATION_SETTINGS_CACHE_SIZE,
+                 ttl: int = MODERATION_SETTINGS_TTL_SECONDS):
+        self.db = db
+        self._stream_creators = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._settings = TTLCache(maxsize=max_entries, ttl=ttl)
+
+    async def creator_for_stream(self, stream_id: str) -> Optional[str]:
+        """Host of the stream, or None if the stream does not exist."""
+        creator_id = self._stream_creators.get(stream_id)
+        if creator_id is None:
+            stream = await self.db.streams.find_one({"id": stream_id}, {"_id": 0, "host_id": 1})
+            if not stream:
+                return None
+            creator_id = stream["host_id"]
+            self._stream_creators[stream_id] = creator_id
+        return creator_id
+
+    async def settings_for_creator(self, creator_id: str) -> Optional[dict]:
+        settings = self._settings.get(creator_id, _MISSING)
+        if settings is _MISSING:
+            settings = await self.db.moderation_settings.find_one({"creator_id": creator_id}, {"_id": 0})
+            self._settings[creator_id] = settings
+        return settings
+
+    async def for_stream(self, stream_id: str) -> Tuple[Optional[str], Optional[dict]]:
+        """(creator_id, settings) for a stream; creator_id is None if the stream does not exist."""
+        creator_id = await self.creator_for_stream(stream_id)
+        if creator_id is None:
+            return None, None
+        return creator_id, await self.settings_for_creator(creator_id)
+
+    def update_settings(self, creator_id: str, settings: dict) -> None:
+        self._settings[creator_id] = settings
+
+    def invalidate_stream(self, stream_id: str) -> None:
+        self._stream_creators.pop(stream_id, None)
+
+    def invalidate_creator(self, creator_id: str) -> None:
+        self._settings.pop(creator_id, None)
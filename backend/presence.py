@@ -0,0 +1,317 @@
+"""
+In-process viewer presence for live streams
+===========================================
+
+Viewers send heartbeats instead of writing viewer counts directly. The
+aggregator keeps the last heartbeat per viewer per stream and, every
+PRESENCE_FLUSH_SECONDS, expires silent viewers, samples the current count and
+writes viewer_count, peak_viewers and avg_viewers for every tracked stream in
+a single bulk_write. The samples are accumulated on the stream document
+(viewer_sample_total / viewer_sample_count) and avg_viewers is derived from
+them there, so it survives restarts and combines samples from every worker.
+
+Only live streams are tracked: heartbeats for unknown or ended stream ids are
+ignored (non-live ids are remembered for NOT_LIVE_CACHE_SECONDS), flushes only
+write to documents that are still is_live, and streams without viewers are
+dropped after PRESENCE_IDLE_SECONDS.
+
+Unique viewers are counted with a HyperLogLog sketch per stream. The estimate
+is written as unique_viewers on every flush, and the sketch registers are
+stored as unique_viewers_hll when the stream ends (or the worker stops) and
+merged back in if the stream is picked up again.
+
+Authenticated viewers also get streams_watched bumped once per distinct
+stream: each (user_id, stream_id) pair is upserted into `stream_views` on
+flush and only newly inserted pairs count, so rejoins never count twice.
+
+Counts are per API worker; deployments with several workers should route a
+stream's heartbeats to one worker (peak_viewers is written with $max, so it
+never moves backwards).
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from cachetools import TTLCache
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from hyperloglog import HyperLogLog
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_TIMEOUT_SECONDS = int(os.getenv("PRESENCE_TIMEOUT_SECONDS", "30"))
+PRESENCE_FLUSH_SECONDS = int(os.getenv("PRESENCE_FLUSH_SECONDS", "5"))
+PRESENCE_IDLE_SECONDS = int(os.getenv("PRESENCE_IDLE_SECONDS", "300"))
+NOT_LIVE_CACHE_SECONDS = 60
+DUPLICATE_KEY_ERROR = 11000
+
+
+@dataclass
+class StreamPresence:
+    viewers: Dict[str, float] = field(default_factory=dict)  # viewer_id -> last heartbeat
+    counted: Set[str] = field(default_factory=set)  # user_ids already queued for streams_watched
+    unique: HyperLogLog = field(default_factory=HyperLogLog)
+    sketch_loaded: bool = False  # Stored registers merged in yet
+    reported_count: Optional[int] = None  # Legacy client-reported count
+    peak: int = 0
+    sample_total: int = 0
+    sample_count: int = 0
+    unsent_total: int = 0  # Samples not yet added to the stream document
+    unsent_count: int = 0
+    last_active: float = field(default_factory=time.monotonic)
+
+    @property
+    def current(self) -> int:
+        if self.viewers or self.reported_count is None:
+            return len(self.viewers)
+        return self.reported_count
+
+    @property
+    def average(self) -> int:
+        return round(self.sample_total / self.sample_count) if self.sample_count else self.current
+
+    def sample(self) -> None:
+        current = self.current
+        self.peak = max(self.peak, current)
+        self.sample_total += current
+        self.sample_count += 1
+        self.unsent_total += current
+        self.unsent_count += 1
+
+    def idle(self, now: float, idle_seconds: int) -> bool:
+        return not self.viewers and now - self.last_active > idle_seconds
+
+    def counts_update(self, viewer_count: int, extra: Optional[dict] = None) -> list:
+        """Pipeline update adding unsent samples and deriving avg_viewers from the stored totals."""
+        return [
+            {"$set": {
+                "viewer_count": viewer_count,
+                "unique_viewers": self.unique.count(),
+                "peak_viewers": {"$max": [{"$ifNull": ["$peak_viewers", 0]}, self.peak]},
+                "viewer_sample_total": {"$add": [{"$ifNull": ["$viewer_sample_total", 0]}, self.unsent_total]},
+                "viewer_sample_count": {"$add": [{"$ifNull": ["$viewer_sample_count", 0]}, self.unsent_count]},
+                **(extra or {})
+            }},
+            {"$set": {"avg_viewers": {"$cond": [
+                {"$gt": ["$viewer_sample_count", 0]},
+                {"$round": [{"$divide": ["$viewer_sample_total", "$viewer_sample_count"]}, 0]},
+                viewer_count
+            ]}}}
+        ]
+
+    def mark_sent(self, total: int, count: int) -> None:
+        self.unsent_total -= total
+        self.unsent_count -= count
+
+
+class PresenceAggregator:
+    """Tracks live viewers per stream and periodically persists the counts."""
+
+    def __init__(self, db, timeout: int = PRESENCE_TIMEOUT_SECONDS, flush_interval: int = PRESENCE_FLUSH_SECONDS,
+                 idle_seconds: int = PRESENCE_IDLE_SECONDS):
+        self.db = db
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.idle_seconds = idle_seconds
+        self._streams: Dict[str, StreamPresence] = {}
+        self._not_live = TTLCache(maxsize=10000, ttl=NOT_LIVE_CACHE_SECONDS)  # stream ids known not to be live
+        self._watched: List[Tuple[str, str]] = []  # (user_id, stream_id) views to record
+        self._task: Optional[asyncio.Task] = None
+
+    async def _track(self, stream_id: str) -> Optional[StreamPresence]:
+        """Presence of a live stream, starting to track it if needed; None if it is not live."""
+        presence = self._streams.get(stream_id)
+        if presence is not None:
+            return presence
+        if stream_id in self._not_live:
+            return None
+        if not await self.db.streams.find_one({"id": stream_id, "is_live": True}, {"_id": 1}):
+            self._not_live[stream_id] = True
+            return None
+        return self._streams.setdefault(stream_id, StreamPresence())
+
+    async def heartbeat(self, stream_id: str, viewer_id: str, user_id: Optional[str] = None) -> bool:
+        """Record a viewer heartbeat. Returns True when the viewer just joined a live stream.
+
+        user_id is the authenticated user, if any; only they get streams_watched credit.
+        """
+        presence = await self._track(stream_id)
+        if presence is None:
+            return False
+        now = time.monotonic()
+        joined = viewer_id not in presence.viewers
+        presence.viewers[viewer_id] = now
+        presence.last_active = now
+        if joined:
+            presence.peak = max(presence.peak, presence.current)
+            presence.unique.add(viewer_id)
+        if user_id and user_id not in presence.counted:
+            presence.counted.add(user_id)
+            self._watched.append((user_id, stream_id))
+        return joined
+
+    def leave(self, stream_id: str, viewer_id: str) -> None:
+        presence = self._streams.get(stream_id)
+        if presence and presence.viewers.pop(viewer_id, None) is not None:
+            presence.last_active = time.monotonic()
+
+    async def report_count(self, stream_id: str, count: int) -> None:
+        """Accept a client-reported viewer count (used until clients send heartbeats)."""
+        presence = await self._track(stream_id)
+        if presence is None:
+            return
+        presence.last_active = time.monotonic()
+        if presence.reported_count != count:
+            presence.reported_count = count
+            presence.peak = max(presence.peak, presence.current)
+
+    def current_viewers(self, stream_id: str) -> int:
+        presence = self._streams.get(stream_id)
+        return presence.current if presence else 0
+
+    def stats(self, stream_id: str) -> Optional[dict]:
+        presence = self._streams.get(stream_id)
+        if not presence:
+            return None
+        return {
+            "viewer_count": presence.current,
+            "peak_viewers": presence.peak,
+            "avg_viewers": presence.average,
+            "unique_viewers": presence.unique.count()
+        }
+
+    def _expire(self, presence: StreamPresence, now: float) -> None:
+        cutoff = now - self.timeout
+        expired = [viewer_id for viewer_id, seen in presence.viewers.items() if seen < cutoff]
+        for viewer_id in expired:
+            del presence.viewers[viewer_id]
+
+    async def _load_sketches(self) -> None:
+        """Merge stored registers into sketches of streams seen for the first time."""
+        pending = {stream_id: p for stream_id, p in self._streams.items() if not p.sketch_loaded}
+        if not pending:
+            return
+        docs = await self.db.streams.find(
+            {"id": {"$in": list(pending)}, "unique_viewers_hll": {"$exists": True}},
+            {"_id": 0, "id": 1, "unique_viewers_hll": 1}
+        ).to_list(None)
+        for doc in docs:
+            pending[doc["id"]].unique.merge(HyperLogLog.from_bytes(doc["unique_viewers_hll"]))
+        for presence in pending.values():
+            presence.sketch_loaded = True
+
+    async def _flush_watched(self) -> None:
+        """Record new (user, stream) views and bump streams_watched for first views only."""
+        if not self._watched:
+            return
+        watched, self._watched = self._watched, []
+        now = datetime.now(timezone.utc)
+        try:
+            result = await self.db.stream_views.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "stream_id": stream_id},
+                    {"$setOnInsert": {"first_seen_at": now}},
+                    upsert=True
+                )
+                for user_id, stream_id in watched
+            ], ordered=False)
+            inserted = result.upserted_ids.keys()
+        except BulkWriteError as e:
+            if any(err.get("code") != DUPLICATE_KEY_ERROR for err in e.details.get("writeErrors", [])):
+                self._watched.extend(watched)
+                raise
+            # Duplicate keys mean another worker recorded the view first
+            inserted = [upsert["index"] for upsert in e.details.get("upserted", [])]
+        except Exception:
+            self._watched.extend(watched)  # Upserts are idempotent, so retry on the next flush
+            raise
+
+        counts: Dict[str, int] = {}
+        for index in inserted:
+            user_id = watched[index][0]
+            counts[user_id] = counts.get(user_id, 0) + 1
+        if counts:
+            await self.db.users.bulk_write([
+                UpdateOne({"user_id": user_id}, {"$inc": {"streams_watched": n}})
+                for user_id, n in counts.items()
+            ], ordered=False)
+
+    async def end_stream(self, stream_id: str) -> Optional[dict]:
+        """Stop tracking a stream and persist its final counts."""
+        self._not_live[stream_id] = True  # Late heartbeats must not re-create it
+        if stream_id in self._streams:
+            await self._load_sketches()
+        presence = self._streams.pop(stream_id, None)
+        if not presence:
+            return None
+        presence.viewers.clear()
+        presence.reported_count = None
+        stream = await self.db.streams.find_one_and_update(
+            {"id": stream_id},
+            presence.counts_update(0, {"unique_viewers_hll": presence.unique.to_bytes()}),
+            projection={"_id": 0, "peak_viewers": 1, "avg_viewers": 1, "unique_viewers": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if not stream:
+            return None
+        return {"viewer_count": 0, **stream}
+
+    async def flush(self) -> int:
+        """Sample every stream and write its counts. Returns streams written."""
+        await self._load_sketches()
+
+        now = time.monotonic()
+        ops = []
+        written = []  # (stream_id, presence, unsent total, unsent count, evicted)
+        for stream_id, presence in self._streams.items():
+            self._expire(presence, now)
+            presence.sample()
+            evict = presence.idle(now, self.idle_seconds)
+            extra = {"unique_viewers_hll": presence.unique.to_bytes()} if evict else None
+            ops.append(UpdateOne(
+                # Only live streams: a stream ended on another worker keeps its final counts
+                {"id": stream_id, "is_live": True},
+                presence.counts_update(presence.current, extra)
+            ))
+            written.append((stream_id, presence, presence.unsent_total, presence.unsent_count, evict))
+
+        if ops:
+            await self.db.streams.bulk_write(ops, ordered=False)
+        for stream_id, presence, total, count, evict in written:
+            presence.mark_sent(total, count)
+            if evict and self._streams.get(stream_id) is presence and presence.idle(now, self.idle_seconds):
+                del self._streams[stream_id]
+        await self._flush_watched()
+        return len(ops)
+
+    async def persist_sketches(self) -> None:
+        """Store every tracked stream's registers so another worker can resume them."""
+        ops = [
+            UpdateOne({"id": stream_id}, {"$set": {"unique_viewers_hll": p.unique.to_bytes()}})
+            for stream_id, p in self._streams.items() if p.sketch_loaded
+        ]
+        if ops:
+            await self.db.streams.bulk_write(ops, ordered=False)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Presence flush error: {e}")
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        await self.persist_sketches()
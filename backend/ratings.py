@@ -0,0 +1,50 @@
+"""
+Battle skill ratings
+====================
+
+Team Elo: a team's strength is the mean rating of its members, and every
+member moves by K * (actual - expected) against the opposing team's mean.
+K starts high for provisional players (fewer than PROVISIONAL_GAMES rated
+battles) so new accounts converge quickly, then settles to K_ESTABLISHED.
+"""
+
+from typing import Dict, Literal, Optional
+
+DEFAULT_RATING = 1500.0
+K_PROVISIONAL = 40
+K_ESTABLISHED = 20
+PROVISIONAL_GAMES = 10
+
+
+def expected_score(rating: float, opponent_rating: float) -> float:
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def k_factor(games: int) -> int:
+    return K_PROVISIONAL if games < PROVISIONAL_GAMES else K_ESTABLISHED
+
+
+def battle_rating_updates(
+    teams: Dict[str, Dict[str, dict]],
+    winner: Literal["team_a", "team_b", "tie"]
+) -> Dict[str, float]:
+    """New rating per user_id.
+
+    teams maps "team_a"/"team_b" to {user_id: {"rating": ..., "rating_games": ...}}
+    (missing fields fall back to an unrated player).
+    """
+    means: Dict[str, Optional[float]] = {
+        team: (sum(p.get("rating", DEFAULT_RATING) for p in players.values()) / len(players)) if players else None
+        for team, players in teams.items()
+    }
+    if means.get("team_a") is None or means.get("team_b") is None:
+        return {}
+
+    updates = {}
+    for team, opponent in (("team_a", "team_b"), ("team_b", "team_a")):
+        expected = expected_score(means[team], means[opponent])
+        actual = 0.5 if winner == "tie" else float(winner == team)
+        for user_id, player in teams[team].items():
+            rating = player.get("rating", DEFAULT_RATING)
+            updates[user_id] = round(rating + k_factor(player.get("rating_games", 0)) * (actual - expected), 1)
+    return updates
@@ -40,7 +40,7 @@ class ChallengeGoal(BaseModel):
 @router.post("/send")
 async def send_reaction(reaction: SendReaction, req: Request):
     """Send a reaction to a live stream"""
-    from server import db
+    from server import db, event_hub, event_log
     
     try:
         # Record the reaction
@@ -53,6 +53,13 @@ async def send_reaction(reaction: SendReaction, req: Request):
         }
         
         await db.reactions.insert_one(reaction_doc)
+        # Log only: viewers get reactions through the coalesced reaction_meter below,
+        # so a reaction storm cannot crowd gifts and milestones out of the hub
+        event_log.append(reaction.stream_id, "reaction", {
+            "user_id": reaction.user_id,
+            "reaction_type": reaction.reaction_type,
+            "intensity": reaction.intensity
+        }, live=False)
         
         # Update stream reaction counters
         counter_field = f"{reaction.reaction_type}_count"
@@ -90,10 +97,18 @@ async def send_reaction(reaction: SendReaction, req: Request):
                 {"$set": {"roast_meter": roast_meter}}
             )
             
+            # Live meter for viewers; a burst of reactions collapses into one update per tick
+            event_hub.publish(reaction.stream_id, "reaction_meter", {
+                **{f"{name}_count": stats.get(f"{name}_count", 0)
+                   for name in ("applause", "boo", "fire", "laugh", "love", "shocked")},
+                "roast_meter": roast_meter,
+                "total_reactions": total
+            }, key="reaction_meter")
+            
             # Check for milestone triggers (100 reactions, 500 reactions, etc.)
             if total in [100, 500, 1000, 5000]:
                 logger.info(f"🎉 MILESTONE: Stream {reaction.stream_id} hit {total} reactions!")
-                # Could trigger special effects here
+                event_log.append(reaction.stream_id, "milestone", {"milestone_type": f"{total}_reactions"})
         
         return {
             "success": True,
@@ -218,7 +233,7 @@ async def get_stream_challenges(stream_id: str):
 @router.post("/milestone/trigger")
 async def trigger_milestone(stream_id: str, milestone_type: str, req: Request):
     """Trigger a milestone event (1000 viewers, 500 gifts, etc.)"""
-    from server import db
+    from server import db, event_log
     
     try:
         milestone_doc = {
@@ -228,6 +243,7 @@ async def trigger_milestone(stream_id: str, milestone_type: str, req: Request):
         }
         
         await db.milestones.insert_one(milestone_doc)
+        event_log.append(stream_id, "milestone", {"milestone_type": milestone_type})
         
         logger.info(f"🎉 MILESTONE TRIGGERED: {milestone_type} for stream {stream_id}")
         
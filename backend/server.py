@@ -1,7 +1,8 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
@@ -10,8 +11,22 @@ from typing import List, Optional
 import uuid
 from datetime import datetime, timedelta
 import openai
-from agora_token_builder import RtcTokenBuilder
-import time
+from agora_tokens import AgoraTokenCache
+from moderation_client import BatchedModerationClient
+from moderation_cache import ModerationCache, MODERATION_CACHE_MONGO
+from moderation_queue import ModerationWorkerPool
+from moderation_settings_cache import ModerationSettingsCache
+from moderation_ai import classify_content
+from gift_ledger import GiftLedger, CREATOR_SHARE
+import wallets
+from presence import PresenceAggregator
+from active_streams import ActiveStreamsCache, ACTIVE_STREAMS_PAGE_SIZE
+from trending import TrendingEngine
+from event_hub import StreamEventHub, sum_merge
+from stream_event_log import StreamEventLog
+from matchmaker import Matchmaker
+from matchmaking import create_battle_match
+import creator_rankings
 
 # Import AI moderation
 from emergentintegrations.llm.chat import LlmChat, UserMessage
@@ -31,12 +46,44 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Per-stream pub/sub for WebSocket/SSE clients (coalesced per tick)
+event_hub = StreamEventHub()
+
+# Sequenced, resumable per-stream event log (publishes to the hub once written)
+event_log = StreamEventLog(db, events=event_hub)
+
+# Write-behind ledger for gift side effects (flushed in bulk)
+gift_ledger = GiftLedger(db, event_log=event_log)
+
+# Live viewer presence (heartbeats aggregated in memory, flushed periodically)
+presence = PresenceAggregator(db)
+
+# Shared, pre-serialized snapshot behind /api/streams/active
+active_streams = ActiveStreamsCache(db)
+
+# Incrementally maintained trending-streams ranking
+trending = TrendingEngine(presence.stats)
+
 # OpenAI client for moderation
 openai.api_key = os.getenv('OPENAI_API_KEY', os.getenv('EMERGENT_LLM_KEY'))
+moderation_client = BatchedModerationClient(api_key=openai.api_key)
+
+# Content-addressed cache of moderation verdicts (optional MongoDB second tier)
+moderation_cache = ModerationCache(db if MODERATION_CACHE_MONGO else None)
+
+# Bounded thread pool + priority queue for blocking LLM chat moderation
+moderation_pool = ModerationWorkerPool(classify_content)
+
+# stream -> creator -> moderation settings lookups for the chat path
+moderation_settings_cache = ModerationSettingsCache(db)
+
+# In-memory battle matchmaking queues (matchmaking_queue stays the durable record)
+matchmaker = Matchmaker(db, create_battle_match)
 
 # Agora credentials
 AGORA_APP_ID = os.environ['AGORA_APP_ID']
 AGORA_APP_CERTIFICATE = os.environ['AGORA_APP_CERTIFICATE']
+agora_tokens = AgoraTokenCache(AGORA_APP_ID, AGORA_APP_CERTIFICATE)
 
 # Emergent LLM Key for AI moderation
 EMERGENT_LLM_KEY = os.getenv("EMERGENT_LLM_KEY")
@@ -75,12 +122,21 @@ class AgoraTokenResponse(BaseModel):
     channelName: str
     uid: int
     appId: str
+    expiresAt: Optional[int] = None
+
+class BattleTokensResponse(BaseModel):
+    channelName: str
+    appId: str
+    tokens: List[dict]  # [{userId, team, uid, token, expiresAt}]
 
 class CreateStreamRequest(BaseModel):
     hostId: str
     title: str
     channelName: str
 
+class ViewerHeartbeatRequest(BaseModel):
+    viewerId: str
+
 class StreamResponse(BaseModel):
     id: str
     hostId: str
@@ -132,18 +188,30 @@ async def moderate_text(request: ModerationRequest):
                 categoryScores={}
             )
         
-        response = openai.moderations.create(
-            model="omni-moderation-latest",
-            input=request.text
-        )
+        # Repeated content skips the model entirely
+        result = await moderation_cache.get(request.text, request.contentType, "openai")
+        if result is None:
+            # Non-blocking; concurrent requests are batched into one upstream call
+            result = await moderation_client.moderate(request.text)
+            if result is not None:
+                await moderation_cache.set(request.text, request.contentType, "openai", result)
         
-        result = response.results[0]
-        flagged = result.flagged
+        if result is None:
+            # Upstream slow or failing - don't stall the request
+            logging.warning("AI moderation unavailable: falling back to allow")
+            return ModerationResult(
+                action='allow',
+                flagged=False,
+                categories={},
+                categoryScores={}
+            )
+        
+        flagged = result["flagged"]
         thresholds = THRESHOLDS.get(request.contentType, THRESHOLDS['message'])
         
         action = 'allow'
         for category, threshold in thresholds.items():
-            score = result.category_scores.get(category, 0)
+            score = result["category_scores"].get(category) or 0
             if score > threshold:
                 if request.contentType in ['username', 'bio']:
                     action = 'block'
@@ -159,8 +227,8 @@ async def moderate_text(request: ModerationRequest):
             "original_content": request.text,
             "flagged": flagged,
             "action": action,
-            "categories": dict(result.categories),
-            "category_scores": dict(result.category_scores),
+            "categories": result["categories"],
+            "category_scores": result["category_scores"],
             "timestamp": datetime.utcnow()
         }
         await db.moderation_results.insert_one(moderation_record)
@@ -168,8 +236,8 @@ async def moderate_text(request: ModerationRequest):
         return ModerationResult(
             flagged=flagged,
             action=action,
-            categories=dict(result.categories),
-            categoryScores=dict(result.category_scores)
+            categories=result["categories"],
+            categoryScores=result["category_scores"]
         )
     except Exception as e:
         logging.error(f"Moderation error: {str(e)}")
@@ -178,41 +246,75 @@ async def moderate_text(request: ModerationRequest):
 # Agora Token Generation
 @api_router.post("/streams/token", response_model=AgoraTokenResponse)
 async def generate_agora_token(request: AgoraTokenRequest):
-    """Generate Agora RTC token for streaming"""
+    """Generate Agora RTC token for streaming (cached until close to its 24h expiry)"""
     try:
-        # Token expiration time (24 hours)
-        expiration_time_in_seconds = 3600 * 24
-        current_timestamp = int(time.time())
-        privilege_expired_ts = current_timestamp + expiration_time_in_seconds
-        
-        # Role: 1 for host (publisher), 2 for audience (subscriber)
-        role = 1 if request.role == 'host' else 2
-        
-        # Generate token
-        token = RtcTokenBuilder.buildTokenWithUid(
-            AGORA_APP_ID,
-            AGORA_APP_CERTIFICATE,
-            request.channelName,
-            request.uid,
-            role,
-            privilege_expired_ts
-        )
+        token, expires_at = agora_tokens.token_for_uid(request.channelName, request.uid, request.role)
         
         return AgoraTokenResponse(
             token=token,
             channelName=request.channelName,
             uid=request.uid,
-            appId=AGORA_APP_ID
+            appId=AGORA_APP_ID,
+            expiresAt=expires_at
         )
     except Exception as e:
         logging.error(f"Token generation error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/streams/token/battle/{match_id}", response_model=BattleTokensResponse)
+async def generate_battle_tokens(match_id: str, req: Request):
+    """Issue publisher tokens for every participant of a battle match in one call.
+    The match_id is the channel name; each token is bound to its participant's numeric agora_uid."""
+    from auth import get_current_user
+    
+    try:
+        current_user = await get_current_user(req)
+        if not current_user:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        
+        match = await db.battle_matches.find_one({"match_id": match_id}, {"_id": 0, "status": 1})
+        if not match:
+            raise HTTPException(status_code=404, detail="Match not found")
+        if match.get("status") == "completed":
+            raise HTTPException(status_code=409, detail="Battle already completed")
+        
+        participants = await db.battle_participants.find(
+            {"match_id": match_id},
+            {"_id": 0, "user_id": 1, "team": 1, "agora_uid": 1}
+        ).to_list(100)
+        
+        if not any(p["user_id"] == current_user.user_id for p in participants):
+            raise HTTPException(status_code=403, detail="Not a participant in this battle")
+        # A uid-0 publisher token could join as any uid
+        if any(not p.get("agora_uid") for p in participants):
+            raise HTTPException(status_code=409, detail="Battle participants have no Agora uids")
+        
+        tokens = []
+        for participant in participants:
+            token, expires_at = agora_tokens.token_for_uid(match_id, participant["agora_uid"], "host")
+            tokens.append({
+                "userId": participant["user_id"],
+                "team": participant["team"],
+                "uid": participant["agora_uid"],
+                "token": token,
+                "expiresAt": expires_at
+            })
+        
+        return BattleTokensResponse(channelName=match_id, appId=AGORA_APP_ID, tokens=tokens)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Battle token generation error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Stream Management
 @api_router.post("/streams/create", response_model=StreamResponse)
 async def create_stream(request: CreateStreamRequest):
     """Create a new live stream"""
     try:
+        # First-time creators get the trending new-creator boost
+        previous_stream = await db.streams.find_one({"host_id": request.hostId}, {"_id": 1})
+        
         stream_id = str(uuid.uuid4())
         stream_data = {
             "id": stream_id,
@@ -224,9 +326,12 @@ async def create_stream(request: CreateStreamRequest):
             "max_participants": 10,
             "started_at": datetime.utcnow().isoformat(),
             "created_at": datetime.utcnow().isoformat(),
+            "new_creator": previous_stream is None,  # Lets every worker's trending engine apply the boost
         }
         
         await db.streams.insert_one(stream_data)
+        active_streams.invalidate()
+        trending.register_stream(stream_data, new_creator=previous_stream is None)
         
         return StreamResponse(
             id=stream_id,
@@ -259,37 +364,107 @@ async def end_stream(stream_id: str):
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Stream not found")
         
+        active_streams.invalidate()
+        trending.unregister_stream(stream_id)
+        moderation_settings_cache.invalidate_stream(stream_id)
+        event_hub.publish(stream_id, "stream_ended", {"stream_id": stream_id})
+        await presence.end_stream(stream_id)
+        
         return {"message": "Stream ended successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"End stream error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/streams/active")
-async def get_active_streams():
-    """Get all active live streams"""
+async def get_active_streams(request: Request, cursor: Optional[str] = None, limit: int = ACTIVE_STREAMS_PAGE_SIZE):
+    """Get active live streams (newest first, paginated with next_cursor; supports ETag/304)"""
     try:
-        streams = await db.streams.find(
-            {"is_live": True},
-            {"_id": 0}
-        ).to_list(100)
-        return {"streams": streams}
+        try:
+            body, etag = await active_streams.get_page(cursor, limit)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Get active streams error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/streams/{stream_id}/viewer-count")
 async def update_viewer_count(stream_id: str, count: int):
-    """Update viewer count for a stream"""
+    """Update viewer count for a stream (client-reported; flushed by the presence aggregator)"""
     try:
-        await db.streams.update_one(
-            {"id": stream_id},
-            {"$set": {"viewer_count": count}}
-        )
+        await presence.report_count(stream_id, count)
         return {"message": "Viewer count updated"}
     except Exception as e:
         logging.error(f"Update viewer count error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/streams/{stream_id}/heartbeat")
+async def viewer_heartbeat(stream_id: str, request: ViewerHeartbeatRequest, req: Request):
+    """Viewer presence heartbeat (send every ~10s while watching)"""
+    from auth import get_current_user
+    
+    try:
+        # Anonymous viewers count as present; only signed-in users earn streams_watched
+        current_user = await get_current_user(req)
+        await presence.heartbeat(stream_id, request.viewerId, current_user.user_id if current_user else None)
+        viewer_count = presence.current_viewers(stream_id)
+        event_hub.publish(stream_id, "viewers", {"viewer_count": viewer_count}, key="viewers")
+        return {"viewerCount": viewer_count}
+    except Exception as e:
+        logging.error(f"Viewer heartbeat error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/streams/{stream_id}/leave")
+async def viewer_leave(stream_id: str, request: ViewerHeartbeatRequest):
+    """Viewer left the stream"""
+    try:
+        presence.leave(stream_id, request.viewerId)
+        viewer_count = presence.current_viewers(stream_id)
+        event_hub.publish(stream_id, "viewers", {"viewer_count": viewer_count}, key="viewers")
+        return {"viewerCount": viewer_count}
+    except Exception as e:
+        logging.error(f"Viewer leave error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/streams/{stream_id}/followed")
+async def record_stream_follow(stream_id: str, req: Request):
+    """Record that the signed-in viewer followed the host from this stream (trending follower conversion)"""
+    from auth import get_current_user
+    
+    try:
+        current_user = await get_current_user(req)
+        if not current_user:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        
+        # At most one follow per viewer and stream (unique index on stream_id, follower_id)
+        try:
+            result = await db.stream_follows.update_one(
+                {"stream_id": stream_id, "follower_id": current_user.user_id},
+                {"$setOnInsert": {"created_at": datetime.utcnow()}},
+                upsert=True
+            )
+            first_follow = result.upserted_id is not None
+        except DuplicateKeyError:
+            first_follow = False
+        
+        if first_follow:
+            trending.record_follow(stream_id)
+            await db.streams.update_one({"id": stream_id}, {"$inc": {"new_followers": 1}})
+        return {"message": "Follow recorded", "counted": first_follow}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Record follow error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Gift System Models
 class Gift(BaseModel):
     id: str
@@ -333,7 +508,18 @@ async def get_gift_catalog():
 async def send_gift(request: SendGiftRequest):
     """Send a gift in a live stream"""
     try:
-        # Record the gift transaction
+        if request.giftPrice <= 0:
+            raise HTTPException(status_code=400, detail="Invalid gift price")
+        
+        # Move the coins: conditional sender debit + creator credit (70%)
+        creator_amount = int(request.giftPrice * CREATOR_SHARE)
+        try:
+            sender_balance, _ = await wallets.transfer(
+                db, request.senderId, request.recipientId, request.giftPrice, creator_amount
+            )
+        except wallets.InsufficientBalanceError:
+            raise HTTPException(status_code=400, detail="Insufficient balance")
+        
         gift_record = {
             "id": str(uuid.uuid4()),
             "stream_id": request.streamId,
@@ -346,66 +532,25 @@ async def send_gift(request: SendGiftRequest):
             "created_at": datetime.utcnow().isoformat(),
         }
         
-        await db.gifts.insert_one(gift_record)
-        
-        # Update sender wallet (deduct)
-        await db.wallets.update_one(
-            {"user_id": request.senderId},
-            {"$inc": {"balance": -request.giftPrice}},
-            upsert=True
+        # Gift record, transactions and battle score are written behind in bulk
+        gift_ledger.record(dict(gift_record), creator_amount)
+        trending.record_gift(request.streamId, request.giftPrice)
+        # Gifts from one sender of one type within a hub tick reach viewers as one event
+        event_log.append(
+            request.streamId, "gift", {**gift_record, "count": 1, "total": request.giftPrice},
+            key=f"gift:{request.senderId}:{request.giftId}",
+            merge=sum_merge("count", "total")
         )
-        
-        # Update recipient wallet (add - creator gets 70%)
-        creator_amount = int(request.giftPrice * 0.7)
-        await db.wallets.update_one(
-            {"user_id": request.recipientId},
-            {"$inc": {"balance": creator_amount}},
-            upsert=True
+        event_hub.publish(
+            request.streamId, "leaderboard_delta",
+            {"user_id": request.senderId, "amount": request.giftPrice, "count": 1},
+            key=f"leaderboard:{request.senderId}",
+            merge=sum_merge("amount", "count")
         )
         
-        # Record transactions
-        await db.transactions.insert_many([
-            {
-                "id": str(uuid.uuid4()),
-                "user_id": request.senderId,
-                "amount": -request.giftPrice,
-                "type": "gift_sent",
-                "description": f"Sent {request.giftName} gift",
-                "created_at": datetime.utcnow().isoformat(),
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "user_id": request.recipientId,
-                "amount": creator_amount,
-                "type": "gift_received",
-                "description": f"Received {request.giftName} gift",
-                "created_at": datetime.utcnow().isoformat(),
-            },
-        ])
-        
-        # CHECK IF THIS IS A BATTLE - Update battle score
-        battle_participant = await db.battle_participants.find_one({
-            "user_id": request.recipientId,
-            "status": {"$in": ["ready", "active"]}
-        })
-        
-        if battle_participant:
-            # This is a battle - update the team's score
-            match_id = battle_participant["match_id"]
-            team = battle_participant["team"]
-            score_field = f"{team}_score"
-            
-            await db.battle_matches.update_one(
-                {"match_id": match_id},
-                {"$inc": {score_field: request.giftPrice}}
-            )
-            
-            logging.info(f"Battle score updated: {match_id} - {team} +{request.giftPrice}")
-            
-            gift_record["battle_match_id"] = match_id
-            gift_record["battle_team"] = team
-        
-        return {"success": True, "gift": gift_record}
+        return {"success": True, "gift": gift_record, "balance": sender_balance}
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Send gift error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -414,13 +559,9 @@ async def send_gift(request: SendGiftRequest):
 async def get_wallet(user_id: str):
     """Get user wallet balance"""
     try:
-        wallet = await db.wallets.find_one({"user_id": user_id})
-        if not wallet:
-            # Create wallet with default balance for new users
-            wallet = {"user_id": user_id, "balance": 100}  # Free 100 coins
-            await db.wallets.insert_one(wallet)
-        
-        return {"balance": wallet.get("balance", 0)}
+        # Creates the wallet with the default balance for new users
+        balance = await wallets.get_balance(db, user_id)
+        return {"balance": balance}
     except Exception as e:
         logging.error(f"Get wallet error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -429,11 +570,7 @@ async def get_wallet(user_id: str):
 async def add_coins(user_id: str, amount: int):
     """Add coins to wallet (for IAP)"""
     try:
-        result = await db.wallets.update_one(
-            {"user_id": user_id},
-            {"$inc": {"balance": amount}},
-            upsert=True
-        )
+        balance = await wallets.credit(db, user_id, amount)
         
         # Record transaction
         await db.transactions.insert_one({
@@ -442,25 +579,26 @@ async def add_coins(user_id: str, amount: int):
             "amount": amount,
             "type": "purchase",
             "description": f"Purchased {amount} coins",
-            "created_at": datetime.utcnow().isoformat(),
+            "created_at": datetime.utcnow(),
         })
         
-        wallet = await db.wallets.find_one({"user_id": user_id})
-        return {"success": True, "balance": wallet.get("balance", 0)}
+        return {"success": True, "balance": balance}
     except Exception as e:
         logging.error(f"Add coins error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/wallet/{user_id}/transactions")
-async def get_transactions(user_id: str):
-    """Get wallet transaction history"""
+async def get_transactions(user_id: str, cursor: Optional[str] = None, limit: int = wallets.TRANSACTIONS_PAGE_SIZE):
+    """Get wallet transaction history (newest first, paginated with next_cursor)"""
     try:
-        transactions = await db.transactions.find(
-            {"user_id": user_id},
-            {"_id": 0}
-        ).sort("created_at", -1).limit(50).to_list(50)
+        try:
+            transactions, next_cursor = await wallets.list_transactions(db, user_id, cursor, limit)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
         
-        return {"transactions": transactions}
+        return {"transactions": transactions, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Get transactions error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -514,9 +652,9 @@ async def get_posts_feed(user_id: str, limit: int = 50):
 async def get_trending_streams(limit: int = 20):
     """Get trending live streams based on ranking algorithm"""
     try:
-        # Calculate rank score: viewer_count * 0.4 + gift_volume * 0.3 + comment_rate * 0.2 + follower_conversion * 0.1
-        # New creator boost: 300% first 5 minutes
-        return {"streams": []}
+        # Rank score: viewer_count * 0.4 + gift_volume * 0.3 + comment_rate * 0.2 + follower_conversion * 0.1
+        # New creator boost: 300% first 5 minutes (rescored on a tick by the trending engine)
+        return {"streams": trending.top(limit)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -524,8 +662,13 @@ async def get_trending_streams(limit: int = 20):
 async def get_trending_creators(limit: int = 30):
     """Get trending creators based on ranking metrics"""
     try:
-        # Rank based on: followers, stream frequency, total views, avg viewers, growth rate
-        return {"creators": []}
+        # Rank based on: stream frequency, total views, avg viewers, growth rate
+        # (precomputed into creator_rankings by a background job)
+        creators = await db.creator_rankings.find(
+            {},
+            {"_id": 0}
+        ).sort("rank_score", -1).limit(limit).to_list(limit)
+        return {"creators": creators}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -690,6 +833,7 @@ from achievements import router as achievements_router
 from loyalty import router as loyalty_router
 from tournaments import router as tournaments_router
 from coins import router as coins_router
+from stream_events import router as stream_events_router
 
 app.include_router(auth_router)
 app.include_router(twofa_router)
@@ -702,6 +846,7 @@ app.include_router(achievements_router)
 app.include_router(loyalty_router)
 app.include_router(tournaments_router)
 app.include_router(coins_router)
+app.include_router(stream_events_router)
 app.include_router(api_router)
 
 app.add_middleware(
@@ -712,6 +857,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+import session_tokens
+from auth import close_auth_client
+from database_schema import run_startup_migrations
+
+@app.on_event("startup")
+async def start_background_services():
+    # Legacy string timestamps would break transaction paging until converted
+    await run_startup_migrations(db)
+    await session_tokens.start(db)
+    await gift_ledger.start()
+    await presence.start()
+    await trending.start(db)
+    await creator_rankings.start(db)
+    await moderation_pool.start()
+    await event_log.start()
+    await event_hub.start()
+    await matchmaker.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await gift_ledger.stop()
+    await presence.stop()
+    await trending.stop()
+    await creator_rankings.stop()
+    await moderation_client.close()
+    await moderation_pool.stop()
+    await event_log.stop()
+    await event_hub.stop()
+    await matchmaker.stop()
+    await session_tokens.stop()
+    await close_auth_client()
     client.close()
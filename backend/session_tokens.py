@@ -0,0 +1,203 @@
+"""
+Stateless session tokens for RoastLive
+======================================
+
+When SESSION_TOKEN_MODE=signed, auth issues HMAC-signed tokens carrying the
+user_id, expiry, a short token id and the issue time. They are verified on
+the CPU, so the request hot path never reads user_sessions.
+
+Revocation mirrors database mode, where a user has one session row that
+login replaces and logout deletes: both set a per-user `revoked_before`
+cutoff, and tokens issued before it are rejected. Cutoffs are persisted to
+`session_revocations` and reloaded every REVOCATION_REFRESH_SECONDS, so a
+revocation takes effect at once on the worker that made it and within that
+interval (10s by default) on every other worker. Single tokens can also be
+revoked by id (`revoked_sessions`).
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import time
+
+logger = logging.getLogger(__name__)
+
+SESSION_TOKEN_MODE = os.getenv("SESSION_TOKEN_MODE", "database")  # database, signed
+SESSION_SIGNING_SECRET = os.getenv("SESSION_SIGNING_SECRET", "")
+REVOCATION_REFRESH_SECONDS = int(os.getenv("REVOCATION_REFRESH_SECONDS", "10"))
+# Cutoffs are reloaded incrementally; the overlap absorbs clock skew between workers
+REVOCATION_REFRESH_OVERLAP = timedelta(seconds=60)
+
+TOKEN_PREFIX = "rl1"
+
+# token_id -> expiry (unix seconds); expired ids are pruned on refresh
+_revoked: dict = {}
+# user_id -> (revoked_before in unix ms, expiry of the newest revoked token in unix seconds)
+_revoked_before: Dict[str, Tuple[int, int]] = {}
+_cutoffs_loaded_at: Optional[datetime] = None
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def signed_mode_enabled() -> bool:
+    """Signed tokens are only used when the mode is on and a secret is configured."""
+    return SESSION_TOKEN_MODE == "signed" and bool(SESSION_SIGNING_SECRET)
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(SESSION_SIGNING_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+    return _b64encode(digest)
+
+
+def issue_token(user_id: str, expires_at: datetime) -> str:
+    """Create a signed token for user_id valid until expires_at."""
+    token_id = secrets.token_hex(8)
+    issued_at = int(time.time() * 1000)
+    payload = _b64encode(f"{user_id}|{int(expires_at.timestamp())}|{token_id}|{issued_at}".encode())
+    body = f"{TOKEN_PREFIX}.{payload}"
+    return f"{body}.{_sign(body)}"
+
+
+def is_signed_token(token: str) -> bool:
+    """Cheap shape check so database tokens skip signature work entirely."""
+    return token.startswith(f"{TOKEN_PREFIX}.") and token.count(".") == 2
+
+
+def verify_token(token: str) -> Optional[Tuple[str, datetime, str]]:
+    """Return (user_id, expires_at, token_id) for a valid, unexpired, unrevoked token."""
+    try:
+        body, signature = token.rsplit(".", 1)
+        if not hmac.compare_digest(signature, _sign(body)):
+            return None
+
+        fields = _b64decode(body.split(".", 1)[1]).decode().split("|")
+        user_id, expiry, token_id = fields[:3]
+        issued_at = int(fields[3]) if len(fields) > 3 else 0  # Tokens issued before issue times were added
+        expires_at = datetime.fromtimestamp(int(expiry), tz=timezone.utc)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+    if expires_at <= datetime.now(timezone.utc) or token_id in _revoked:
+        return None
+    cutoff = _revoked_before.get(user_id)
+    if cutoff and issued_at < cutoff[0]:
+        return None
+
+    return user_id, expires_at, token_id
+
+
+async def revoke_token(token_id: str, expires_at: datetime, db) -> None:
+    """Revoke a token locally and persist it so other workers pick it up."""
+    _revoked[token_id] = int(expires_at.timestamp())
+    await db.revoked_sessions.update_one(
+        {"token_id": token_id},
+        {"$set": {"token_id": token_id, "expires_at": expires_at}},
+        upsert=True
+    )
+
+
+async def revoke_user_tokens(user_id: str, expires_at: datetime, db) -> None:
+    """Reject every token issued to user_id until now.
+
+    expires_at bounds the expiry of those tokens; the cutoff is kept until then.
+    """
+    now = datetime.now(timezone.utc)
+    cutoff_ms = int(now.timestamp() * 1000)
+    previous = _revoked_before.get(user_id, (0, 0))
+    _revoked_before[user_id] = (max(previous[0], cutoff_ms), max(previous[1], int(expires_at.timestamp())))
+    await db.session_revocations.update_one(
+        {"user_id": user_id},
+        {
+            "$max": {
+                "revoked_before": datetime.fromtimestamp(cutoff_ms / 1000, tz=timezone.utc),
+                "expires_at": expires_at
+            }
+        },
+        upsert=True
+    )
+
+
+async def load_revocations(db) -> None:
+    """Reload unexpired revocations from MongoDB, dropping expired local entries."""
+    global _cutoffs_loaded_at
+    now = datetime.now(timezone.utc)
+    docs = await db.revoked_sessions.find(
+        {"expires_at": {"$gt": now}},
+        {"_id": 0, "token_id": 1, "expires_at": 1}
+    ).to_list(None)
+
+    now_ts = int(now.timestamp())
+    for token_id in [t for t, exp in _revoked.items() if exp <= now_ts]:
+        del _revoked[token_id]
+    for doc in docs:
+        expires_at = doc["expires_at"]
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        _revoked[doc["token_id"]] = int(expires_at.timestamp())
+
+    # Per-user cutoffs: everything unexpired on the first load, then only recent changes
+    if _cutoffs_loaded_at is None:
+        query = {"expires_at": {"$gt": now}}
+    else:
+        query = {"revoked_before": {"$gte": _cutoffs_loaded_at - REVOCATION_REFRESH_OVERLAP}}
+    cutoffs = await db.session_revocations.find(
+        query,
+        {"_id": 0, "user_id": 1, "revoked_before": 1, "expires_at": 1}
+    ).to_list(None)
+    _cutoffs_loaded_at = now
+
+    for user_id in [u for u, (_, exp) in _revoked_before.items() if exp <= now_ts]:
+        del _revoked_before[user_id]
+    for doc in cutoffs:
+        revoked_before, expires_at = doc["revoked_before"], doc["expires_at"]
+        if revoked_before.tzinfo is None:
+            revoked_before = revoked_before.replace(tzinfo=timezone.utc)
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        previous = _revoked_before.get(doc["user_id"], (0, 0))
+        _revoked_before[doc["user_id"]] = (
+            max(previous[0], int(revoked_before.timestamp() * 1000)),
+            max(previous[1], int(expires_at.timestamp()))
+        )
+
+
+async def _refresh_loop(db) -> None:
+    while True:
+        await asyncio.sleep(REVOCATION_REFRESH_SECONDS)
+        try:
+            await load_revocations(db)
+        except Exception as e:
+            logger.error(f"Revocation refresh error: {e}")
+
+
+async def start(db) -> None:
+    """Load revocations and keep them fresh (no-op unless signed mode is enabled)."""
+    global _refresh_task
+    if not signed_mode_enabled():
+        return
+    await load_revocations(db)
+    _refresh_task = asyncio.create_task(_refresh_loop(db))
+    logger.info(
+        f"Signed session tokens enabled ({len(_revoked)} revoked tokens, "
+        f"{len(_revoked_before)} user cutoffs loaded)"
+    )
+
+
+async def stop() -> None:
+    global _refresh_task
+    if _refresh_task:
+        _refresh_task.cancel()
+        _refresh_task = None
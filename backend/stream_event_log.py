@@ -0,0 +1,248 @@
+"""
+Sequenced per-stream event log
+==============================
+
+Gifts, reactions, milestones and battle score increments are appended to an
+append-only log per stream. Every event gets a per-stream sequence number:
+
+- append() only buffers; every EVENT_LOG_FLUSH_MS the buffered events of each
+  stream reserve a contiguous block of sequence numbers with one $inc on
+  `stream_event_counters`, so numbers are dense and increase monotonically
+  across workers.
+- Reservations for all streams in a flush run concurrently.
+- Events are $push-ed into time-bucketed `stream_events` documents (one per
+  stream per EVENT_LOG_BUCKET_SECONDS, split at EVENT_LOG_BUCKET_MAX_EVENTS),
+  each carrying first_seq/last_seq so reads skip whole buckets.
+- After the write lands, each event is published to the live event hub with
+  its seq, unless it was appended with live=False. High-volume events
+  (reactions) are log-only so they cannot crowd gifts and milestones out of
+  the hub's per-tick cap; viewers see them through a coalesced summary.
+  A reconnecting client sends the last seq it saw and gets exactly
+  the events after it; because numbers are dense, a gap in what it receives
+  means another worker's write is still in flight and it should re-read.
+  The hub may drop events under load; it then reports gap_from and holds
+  last_seq below it, so re-reading from last_seq recovers them.
+
+Writes that fail are retried with the sequence numbers they already hold, and
+readers drop duplicates by seq. Buckets expire after EVENT_LOG_RETENTION_DAYS.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+from pymongo import ReturnDocument, UpdateOne
+import asyncio
+import heapq
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOG_FLUSH_MS = int(os.getenv("EVENT_LOG_FLUSH_MS", "100"))
+EVENT_LOG_BUCKET_SECONDS = int(os.getenv("EVENT_LOG_BUCKET_SECONDS", "60"))
+EVENT_LOG_BUCKET_MAX_EVENTS = int(os.getenv("EVENT_LOG_BUCKET_MAX_EVENTS", "5000"))
+EVENT_LOG_RETENTION_DAYS = int(os.getenv("EVENT_LOG_RETENTION_DAYS", "7"))
+EVENT_LOG_MAX_RETRIES = 3
+EVENT_LOG_PAGE_SIZE = 500
+
+
+class StreamEventLog:
+    def __init__(self, db, events=None, flush_interval_ms: int = EVENT_LOG_FLUSH_MS):
+        self.db = db
+        self.events = events  # Optional StreamEventHub for live fan-out
+        self.flush_interval = flush_interval_ms / 1000
+        self._pending: Dict[str, List[dict]] = defaultdict(list)
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def append(self, stream_id: str, event_type: str, data: dict, key: Optional[str] = None,
+               merge: Optional[Callable[[dict, dict], dict]] = None, live: bool = True) -> None:
+        """Queue an event; key/merge control how the live hub coalesces it.
+        live=False keeps the event in the log only."""
+        self._pending[stream_id].append({
+            "entry": {"type": event_type, "data": data, "ts": datetime.now(timezone.utc)},
+            "key": key,
+            "merge": merge,
+            "live": live,
+            "attempts": 0
+        })
+
+    # ----- writing -----
+
+    async def _reserve(self, stream_id: str, count: int) -> int:
+        """Reserve count sequence numbers; returns the first one."""
+        counter = await self.db.stream_event_counters.find_one_and_update(
+            {"stream_id": stream_id},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"] - count + 1
+
+    async def flush(self) -> int:
+        """Sequence and persist buffered events. Returns the number written."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, defaultdict(list)
+
+            unsequenced: Dict[str, List[dict]] = {}
+            for stream_id, items in pending.items():
+                fresh = [item for item in items if "seq" not in item["entry"]]
+                if fresh:
+                    unsequenced[stream_id] = fresh
+            firsts = await asyncio.gather(
+                *(self._reserve(stream_id, len(items)) for stream_id, items in unsequenced.items()),
+                return_exceptions=True
+            )
+            reserved = dict(zip(unsequenced, firsts))
+
+            ops = []
+            written = []  # (stream_id, item) covered by ops
+            for stream_id, items in pending.items():
+                first = reserved.get(stream_id)
+                if isinstance(first, BaseException):
+                    logger.error(f"Event log sequence reservation failed for stream {stream_id}: {first}")
+                    self._requeue(stream_id, items)
+                    continue
+                for offset, item in enumerate(unsequenced.get(stream_id, ())):
+                    item["entry"]["seq"] = first + offset
+                ops.extend(self._bucket_ops(stream_id, items))
+                written.extend((stream_id, item) for item in items)
+
+            if not ops:
+                return 0
+            try:
+                await self.db.stream_events.bulk_write(ops, ordered=True)
+            except Exception as e:
+                logger.error(f"Event log write failed for {len(written)} events: {e}")
+                for stream_id, item in written:
+                    self._requeue(stream_id, [item])
+                return 0
+
+            if self.events is not None:
+                for stream_id, item in written:
+                    if not item["live"]:
+                        continue
+                    entry = item["entry"]
+                    self.events.publish(stream_id, entry["type"], entry["data"],
+                                        key=item["key"], merge=item["merge"], seq=entry["seq"])
+            return len(written)
+
+    def _bucket_ops(self, stream_id: str, items: List[dict]) -> List[UpdateOne]:
+        by_bucket: Dict[datetime, List[dict]] = defaultdict(list)
+        for item in sorted(items, key=lambda item: item["entry"]["seq"]):
+            ts = item["entry"]["ts"]
+            bucket = datetime.fromtimestamp(
+                int(ts.timestamp()) // EVENT_LOG_BUCKET_SECONDS * EVENT_LOG_BUCKET_SECONDS, timezone.utc
+            )
+            by_bucket[bucket].append(item["entry"])
+
+        ops = []
+        for bucket, entries in by_bucket.items():
+            ops.append(UpdateOne(
+                # A full bucket no longer matches, so the upsert starts a new one
+                {"stream_id": stream_id, "bucket": bucket, "count": {"$lt": EVENT_LOG_BUCKET_MAX_EVENTS}},
+                {
+                    "$push": {"events": {"$each": entries}},
+                    "$inc": {"count": len(entries)},
+                    "$min": {"first_seq": entries[0]["seq"]},
+                    "$max": {"last_seq": entries[-1]["seq"]},
+                    "$setOnInsert": {"expires_at": bucket + timedelta(days=EVENT_LOG_RETENTION_DAYS)}
+                },
+                upsert=True
+            ))
+        return ops
+
+    def _requeue(self, stream_id: str, items: List[dict]) -> None:
+        for item in items:
+            if item["attempts"] < EVENT_LOG_MAX_RETRIES:
+                item["attempts"] += 1
+                self._pending[stream_id].append(item)
+            else:
+                logger.error(f"Dropping event log entry for stream {stream_id} after {item['attempts']} retries")
+
+    # ----- reading -----
+
+    async def read(self, stream_id: str, after_seq: int = 0, limit: int = EVENT_LOG_PAGE_SIZE) -> List[dict]:
+        """Events with seq > after_seq in sequence order (at most limit)."""
+        events: Dict[int, dict] = {}
+        lowest: List[int] = []  # Max-heap (negated) of the `limit` lowest seqs collected
+        cursor = self.db.stream_events.find(
+            {"stream_id": stream_id, "last_seq": {"$gt": after_seq}},
+            {"_id": 0, "first_seq": 1, "events": 1}
+        ).sort("first_seq", 1)
+
+        async for doc in cursor:
+            # Buckets are ordered by first_seq, so once `limit` events below
+            # this bucket's first_seq are collected nothing later can precede them
+            if len(lowest) >= limit and doc["first_seq"] > -lowest[0]:
+                break
+            for event in doc["events"]:
+                seq = event["seq"]
+                if seq <= after_seq or seq in events:
+                    continue
+                events[seq] = event
+                heapq.heappush(lowest, -seq)
+                if len(lowest) > limit:
+                    del events[-heapq.heappop(lowest)]
+        return [events[seq] for seq in sorted(events)]
+
+    async def last_seq(self, stream_id: str) -> int:
+        counter = await self.db.stream_event_counters.find_one({"stream_id": stream_id}, {"_id": 0, "seq": 1})
+        return counter["seq"] if counter else 0
+
+    async def summarize(self, stream_id: str) -> dict:
+        """Rebuild gift, reaction and battle totals by replaying the log."""
+        summary = {
+            "gift_count": 0,
+            "gift_total": 0,
+            "reactions": defaultdict(int),
+            "total_reactions": 0,
+            "battle_scores": defaultdict(lambda: defaultdict(int)),
+            "milestones": [],
+            "last_seq": 0
+        }
+        after_seq = 0
+        while True:
+            events = await self.read(stream_id, after_seq)
+            if not events:
+                break
+            for event in events:
+                data = event["data"]
+                if event["type"] == "gift":
+                    summary["gift_count"] += 1
+                    summary["gift_total"] += data.get("gift_price", 0)
+                elif event["type"] == "reaction":
+                    summary["reactions"][data["reaction_type"]] += data.get("intensity", 1)
+                    summary["total_reactions"] += data.get("intensity", 1)
+                elif event["type"] == "battle_score":
+                    summary["battle_scores"][data["match_id"]][data["team"]] += data["delta"]
+                elif event["type"] == "milestone":
+                    summary["milestones"].append(data.get("milestone_type"))
+            after_seq = summary["last_seq"] = events[-1]["seq"]
+
+        summary["reactions"] = dict(summary["reactions"])
+        summary["battle_scores"] = {match: dict(teams) for match, teams in summary["battle_scores"].items()}
+        return summary
+
+    # ----- lifecycle -----
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Event log flush error: {e}")
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flush loop and write out everything still buffered."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
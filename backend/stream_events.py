@@ -0,0 +1,124 @@
+from fastapi import APIRouter, HTTPException, Request, WebSocket
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/events", tags=["events"])
+
+KEEPALIVE_SECONDS = int(os.getenv("EVENT_STREAM_KEEPALIVE_SECONDS", "15"))
+
+async def _close_on_disconnect(websocket: WebSocket, subscription):
+    """Read (and ignore) client messages until the socket closes"""
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    except Exception:
+        pass
+    finally:
+        subscription.close()
+
+async def _replay_frame(stream_id: str, after_seq: Optional[int]) -> Optional[str]:
+    """Frame with logged events after after_seq, sent before live frames on resume"""
+    from server import event_log
+
+    if after_seq is None:
+        return None
+    events = await event_log.read(stream_id, after_seq)
+    frame = {"stream_id": stream_id, "type": "replay", "events": events}
+    if events:
+        frame["last_seq"] = events[-1]["seq"]
+    return json.dumps(frame, default=str)
+
+# Routes
+@router.websocket("/stream/{stream_id}/ws")
+async def stream_events_websocket(websocket: WebSocket, stream_id: str, after_seq: Optional[int] = None):
+    """Live stream events (gifts, reaction meter, battle scores, leaderboard deltas) over WebSocket.
+    
+    Reconnecting clients pass the last seq they saw as after_seq to receive missed events first.
+    """
+    from server import event_hub
+
+    await websocket.accept()
+    # Subscribe before reading the log so nothing falls between replay and live frames
+    subscription = event_hub.subscribe(stream_id)
+    reader = asyncio.create_task(_close_on_disconnect(websocket, subscription))
+
+    try:
+        replay = await _replay_frame(stream_id, after_seq)
+        if replay:
+            await websocket.send_text(replay)
+        while not subscription.closed:
+            for frame in await subscription.next_frames(KEEPALIVE_SECONDS):
+                await websocket.send_text(frame)
+    except Exception as e:
+        logger.debug(f"Event websocket closed for stream {stream_id}: {e}")
+    finally:
+        reader.cancel()
+        event_hub.unsubscribe(subscription)
+
+@router.get("/stream/{stream_id}/sse")
+async def stream_events_sse(stream_id: str, request: Request, after_seq: Optional[int] = None):
+    """Live stream events as Server-Sent Events (same frames as the WebSocket)"""
+    from server import event_hub
+
+    subscription = event_hub.subscribe(stream_id)
+
+    async def frames():
+        try:
+            replay = await _replay_frame(stream_id, after_seq)
+            if replay:
+                yield f"data: {replay}\n\n"
+            while not subscription.closed and not await request.is_disconnected():
+                batch = await subscription.next_frames(KEEPALIVE_SECONDS)
+                if not batch:
+                    yield ": keepalive\n\n"
+                for frame in batch:
+                    yield f"data: {frame}\n\n"
+        finally:
+            event_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/stream/{stream_id}/log")
+async def get_stream_event_log(stream_id: str, after_seq: int = 0, limit: int = 500):
+    """Logged events with seq > after_seq, in sequence order"""
+    from server import event_log
+
+    try:
+        limit = max(1, min(limit, 500))
+        events = await event_log.read(stream_id, after_seq, limit)
+        return {
+            "events": events,
+            "last_seq": events[-1]["seq"] if events else after_seq,
+            "head_seq": await event_log.last_seq(stream_id)
+        }
+    except Exception as e:
+        logger.error(f"Get stream event log error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/stream/{stream_id}/summary")
+async def get_stream_event_summary(stream_id: str):
+    """Gift, reaction, battle and milestone totals rebuilt by replaying the log"""
+    from server import event_log
+
+    try:
+        return await event_log.summarize(stream_id)
+    except Exception as e:
+        logger.error(f"Stream event replay error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/stats")
+async def get_event_hub_stats():
+    """Connection, coalescing and slow-consumer metrics"""
+    from server import event_hub
+
+    return event_hub.stats()
@@ -0,0 +1,225 @@
+"""
+Incremental trending-streams ranking
+====================================
+
+rank_score = viewer_count * 0.4 + gift_volume * 0.3 + comment_rate * 0.2
+             + follower_conversion * 0.1
+
+Signals are maintained as events happen instead of aggregating gifts and
+stream_messages per request:
+- viewer_count: current presence count for the stream
+- gift_volume: coins gifted, exponentially decayed (SIGNAL_HALF_LIFE_SECONDS)
+- comment_rate: chat messages, decayed the same way
+- follower_conversion: follows attributed to the stream / unique viewers
+
+Every TRENDING_TICK_SECONDS each signal is normalized against the highest
+value across live streams, the weighted score is computed, streams from new
+creators get NEW_CREATOR_BOOST during their first NEW_CREATOR_BOOST_SECONDS,
+and the top TRENDING_TOP_K are kept. The endpoint only slices that list.
+
+The set of live streams is re-read from `streams` every TRENDING_SYNC_SECONDS,
+so streams started or ended through another worker join or leave the ranking
+within that interval. Gift, comment and follow signals are counted by the
+worker that handles the event, so with several workers each one ranks on its
+own sample of the traffic.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+import asyncio
+import heapq
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+TRENDING_TICK_SECONDS = float(os.getenv("TRENDING_TICK_SECONDS", "5"))
+TRENDING_TOP_K = int(os.getenv("TRENDING_TOP_K", "100"))
+TRENDING_SYNC_SECONDS = float(os.getenv("TRENDING_SYNC_SECONDS", "30"))
+SIGNAL_HALF_LIFE_SECONDS = float(os.getenv("TRENDING_HALF_LIFE_SECONDS", "300"))
+
+WEIGHTS = {
+    "viewer_count": 0.4,
+    "gift_volume": 0.3,
+    "comment_rate": 0.2,
+    "follower_conversion": 0.1,
+}
+
+NEW_CREATOR_BOOST = 3.0  # 300%
+NEW_CREATOR_BOOST_SECONDS = 300
+
+
+@dataclass
+class DecayingCounter:
+    """Event total that halves every SIGNAL_HALF_LIFE_SECONDS."""
+    value: float = 0.0
+    updated: float = field(default_factory=time.monotonic)
+
+    def _decay(self, now: float) -> None:
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.value *= math.pow(0.5, elapsed / SIGNAL_HALF_LIFE_SECONDS)
+            self.updated = now
+
+    def add(self, amount: float, now: Optional[float] = None) -> None:
+        now = now if now is not None else time.monotonic()
+        self._decay(now)
+        self.value += amount
+
+    def current(self, now: Optional[float] = None) -> float:
+        self._decay(now if now is not None else time.monotonic())
+        return self.value
+
+
+@dataclass
+class StreamSignals:
+    stream: dict  # Public stream fields returned to clients
+    new_creator: bool
+    registered_at: float = field(default_factory=time.monotonic)
+    gifts: DecayingCounter = field(default_factory=DecayingCounter)
+    comments: DecayingCounter = field(default_factory=DecayingCounter)
+    follows: int = 0
+
+
+class TrendingEngine:
+    def __init__(self, viewer_counts: Callable[[str], dict], tick_seconds: float = TRENDING_TICK_SECONDS,
+                 top_k: int = TRENDING_TOP_K, sync_seconds: float = TRENDING_SYNC_SECONDS):
+        """viewer_counts(stream_id) returns presence stats ({} when unknown)."""
+        self.viewer_counts = viewer_counts
+        self.tick_seconds = tick_seconds
+        self.sync_seconds = sync_seconds
+        self.top_k = top_k
+        self._streams: Dict[str, StreamSignals] = {}
+        self._ranked: List[dict] = []
+        self._task: Optional[asyncio.Task] = None
+
+    # ----- event feed -----
+
+    def register_stream(self, stream: dict, new_creator: bool = False, age_seconds: float = 0.0) -> None:
+        """Start ranking a live stream; age_seconds is how long it has been live already."""
+        public = {k: stream.get(k) for k in ("id", "host_id", "title", "channel_name", "started_at")}
+        self._streams[stream["id"]] = StreamSignals(
+            stream=public, new_creator=new_creator, registered_at=time.monotonic() - age_seconds
+        )
+
+    def unregister_stream(self, stream_id: str) -> None:
+        self._streams.pop(stream_id, None)
+        self._ranked = [s for s in self._ranked if s["id"] != stream_id]
+
+    def record_gift(self, stream_id: str, coins: int) -> None:
+        signals = self._streams.get(stream_id)
+        if signals:
+            signals.gifts.add(coins)
+
+    def record_comment(self, stream_id: str) -> None:
+        signals = self._streams.get(stream_id)
+        if signals:
+            signals.comments.add(1)
+
+    def record_follow(self, stream_id: str) -> None:
+        signals = self._streams.get(stream_id)
+        if signals:
+            signals.follows += 1
+
+    # ----- ranking -----
+
+    def rescore(self) -> List[dict]:
+        """Recompute scores for all live streams and keep the top K."""
+        now = time.monotonic()
+        raw = {}
+        for stream_id, signals in self._streams.items():
+            counts = self.viewer_counts(stream_id) or {}
+            viewers = counts.get("viewer_count", 0)
+            unique = counts.get("unique_viewers", 0) or viewers
+            raw[stream_id] = {
+                "viewer_count": viewers,
+                "gift_volume": signals.gifts.current(now),
+                "comment_rate": signals.comments.current(now),
+                "follower_conversion": signals.follows / unique if unique else 0.0,
+            }
+
+        peaks = {name: max((r[name] for r in raw.values()), default=0) or 1 for name in WEIGHTS}
+
+        scored = []
+        for stream_id, values in raw.items():
+            signals = self._streams[stream_id]
+            score = sum(WEIGHTS[name] * values[name] / peaks[name] for name in WEIGHTS) * 100
+            if signals.new_creator and now - signals.registered_at < NEW_CREATOR_BOOST_SECONDS:
+                score *= NEW_CREATOR_BOOST
+            scored.append((score, stream_id, values["viewer_count"]))
+
+        self._ranked = [
+            {**self._streams[stream_id].stream, "viewer_count": viewers, "rank_score": round(score, 2)}
+            for score, stream_id, viewers in heapq.nlargest(self.top_k, scored)
+        ]
+        return self._ranked
+
+    def top(self, limit: int) -> List[dict]:
+        return self._ranked[:limit]
+
+    # ----- lifecycle -----
+
+    async def load_live_streams(self, db) -> None:
+        """Sync the tracked streams with the live streams in the database.
+
+        Streams started elsewhere are registered and streams that are no longer
+        live are dropped; signals of streams already tracked are kept.
+        """
+        synced_at = time.monotonic()
+        streams = await db.streams.find(
+            {"is_live": True},
+            {"_id": 0, "id": 1, "host_id": 1, "title": 1, "channel_name": 1, "started_at": 1, "new_creator": 1}
+        ).to_list(None)
+        live = set()
+        for stream in streams:
+            if not stream.get("id"):
+                continue
+            live.add(stream["id"])
+            if stream["id"] not in self._streams:
+                self.register_stream(stream, new_creator=stream.get("new_creator", False),
+                                     age_seconds=_age_seconds(stream.get("started_at")))
+        for stream_id, signals in list(self._streams.items()):
+            # Streams registered during the query may not be in its results yet
+            if stream_id not in live and signals.registered_at < synced_at:
+                self.unregister_stream(stream_id)
+        self.rescore()
+
+    async def _run(self, db) -> None:
+        synced_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                if time.monotonic() - synced_at >= self.sync_seconds:
+                    synced_at = time.monotonic()
+                    await self.load_live_streams(db)
+                else:
+                    self.rescore()
+            except Exception as e:
+                logger.error(f"Trending rescore error: {e}")
+
+    async def start(self, db) -> None:
+        await self.load_live_streams(db)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+def _age_seconds(started_at) -> float:
+    """Seconds since a stream's started_at (naive UTC ISO string or datetime); 0 if unknown."""
+    if isinstance(started_at, str):
+        try:
+            started_at = datetime.fromisoformat(started_at)
+        except ValueError:
+            return 0.0
+    if not isinstance(started_at, datetime):
+        return 0.0
+    if started_at.tzinfo is None:
+        started_at = started_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (datetime.now(timezone.utc) - started_at).total_seconds())
@@ -0,0 +1,174 @@
+"""
+Wallet balance primitives for RoastLive
+=======================================
+
+Every operation here is a single find_one_and_update that returns the new
+balance, so callers never re-read the wallet. Missing wallets are created on
+first touch with DEFAULT_WALLET_BALANCE via an upserting pipeline update.
+Debits are conditional on the balance covering the amount and never upsert,
+so concurrent gifts cannot drive a balance negative whether or not the unique
+user_id index exists.
+
+Transaction history is paged with keyset cursors over (created_at, id) on
+the (user_id, created_at, id) index, so deep pages cost the same as the first.
+"""
+
+from datetime import datetime
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from typing import List, Optional, Tuple
+import base64
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WALLET_BALANCE = 100  # Free coins for new users
+
+TRANSACTIONS_PAGE_SIZE = 50
+TRANSACTIONS_MAX_PAGE_SIZE = 200
+
+# Standalone mongod rejects multi-document transactions with this code
+ILLEGAL_OPERATION = 20
+
+_transactions_supported = True
+
+
+class InsufficientBalanceError(Exception):
+    pass
+
+
+def _balance_update(delta: int) -> list:
+    """Pipeline update applying delta on top of the default balance for new wallets."""
+    return [{
+        "$set": {
+            "balance": {"$add": [{"$ifNull": ["$balance", DEFAULT_WALLET_BALANCE]}, delta]},
+            "updated_at": "$$NOW"
+        }
+    }]
+
+
+async def get_balance(db, user_id: str) -> int:
+    """Return the balance, creating the wallet with the default balance if needed."""
+    wallet = await db.wallets.find_one_and_update(
+        {"user_id": user_id},
+        {"$setOnInsert": {"balance": DEFAULT_WALLET_BALANCE}},
+        upsert=True,
+        projection={"_id": 0, "balance": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return wallet.get("balance", 0)
+
+
+async def credit(db, user_id: str, amount: int, session=None) -> int:
+    """Add amount to a wallet and return the new balance."""
+    wallet = await db.wallets.find_one_and_update(
+        {"user_id": user_id},
+        _balance_update(amount),
+        upsert=True,
+        projection={"_id": 0, "balance": 1},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    return wallet["balance"]
+
+
+async def _conditional_debit(db, user_id: str, amount: int, session=None) -> Optional[dict]:
+    return await db.wallets.find_one_and_update(
+        {"user_id": user_id, "balance": {"$gte": amount}},
+        {"$inc": {"balance": -amount}, "$currentDate": {"updated_at": True}},
+        projection={"_id": 0, "balance": 1},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+
+
+async def debit(db, user_id: str, amount: int, session=None) -> int:
+    """Subtract amount if the balance covers it and return the new balance.
+
+    The debit itself never upserts. When it matches nothing, the wallet is
+    created with the default balance if missing (as in get_balance) and the
+    debit is retried once.
+    """
+    wallet = await _conditional_debit(db, user_id, amount, session=session)
+    if not wallet:
+        try:
+            await db.wallets.update_one(
+                {"user_id": user_id},
+                {"$setOnInsert": {"balance": DEFAULT_WALLET_BALANCE}},
+                upsert=True,
+                session=session
+            )
+        except DuplicateKeyError:
+            pass  # Created concurrently
+        wallet = await _conditional_debit(db, user_id, amount, session=session)
+
+    if not wallet:
+        raise InsufficientBalanceError(f"Insufficient balance for {user_id}")
+    return wallet["balance"]
+
+
+async def transfer(db, sender_id: str, recipient_id: str, amount: int, credit_amount: int) -> Tuple[int, int]:
+    """Debit amount from sender and credit credit_amount to recipient.
+
+    Runs both updates in one transaction when the deployment supports it
+    (replica set). On a standalone server the conditional debit runs first and
+    the credit, which cannot fail on balance, follows it.
+    Returns (sender_balance, recipient_balance).
+    """
+    global _transactions_supported
+
+    async def _transfer(session):
+        sender_balance = await debit(db, sender_id, amount, session=session)
+        recipient_balance = await credit(db, recipient_id, credit_amount, session=session)
+        return sender_balance, recipient_balance
+
+    if _transactions_supported:
+        try:
+            # with_transaction retries transient write conflicts between concurrent gifts
+            async with await db.client.start_session() as session:
+                return await session.with_transaction(_transfer)
+        except OperationFailure as e:
+            if e.code != ILLEGAL_OPERATION:
+                raise
+            _transactions_supported = False
+            logger.warning("MongoDB transactions unavailable - wallet transfers fall back to ordered updates")
+
+    return await _transfer(None)
+
+
+
+def encode_transactions_cursor(created_at: datetime, transaction_id: str) -> str:
+    raw = f"{created_at.isoformat()}|{transaction_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_transactions_cursor(cursor: str) -> Tuple[datetime, str]:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    created_at, transaction_id = raw.split("|", 1)
+    return datetime.fromisoformat(created_at), transaction_id
+
+
+async def list_transactions(db, user_id: str, cursor: Optional[str] = None,
+                            limit: int = TRANSACTIONS_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+    """Return (transactions, next_cursor), newest first, starting after cursor."""
+    limit = max(1, min(limit, TRANSACTIONS_MAX_PAGE_SIZE))
+    query = {"user_id": user_id}
+    if cursor:
+        created_at, transaction_id = decode_transactions_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": transaction_id}}
+        ]
+
+    # Fetch one extra row to know whether another page exists
+    transactions = await db.transactions.find(
+        query,
+        {"_id": 0}
+    ).sort([("created_at", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        last = transactions[-1]
+        next_cursor = encode_transactions_cursor(last["created_at"], last["id"])
+    return transactions, next_cursor
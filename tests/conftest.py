@@ -0,0 +1,22 @@
+import os
+import sys
+import types
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture
+def server_db(monkeypatch):
+    """Install a fake `server` module whose `db` attribute tests fill in.
+
+    Route helpers import `db` lazily from server, which would otherwise connect
+    to MongoDB and start every background service.
+    """
+    server = types.ModuleType("server")
+    server.db = types.SimpleNamespace()
+    monkeypatch.setitem(sys.modules, "server", server)
+    return server.db
@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import auth
+
+
+class FakeCollection:
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+        self.finds = 0
+
+    async def find_one(self, query, projection=None):
+        self.finds += 1
+        for doc in self.docs:
+            if all(doc.get(key) == value for key, value in query.items()):
+                return dict(doc)
+        return None
+
+
+def make_request(token):
+    return SimpleNamespace(cookies={"session_token": token}, headers={})
+
+
+def make_user(user_id):
+    return auth.User(user_id=user_id, email=f"{user_id}@example.com", name=user_id,
+                     created_at=datetime.now(timezone.utc))
+
+
+@pytest.fixture(autouse=True)
+def clear_session_cache():
+    auth._session_cache.clear()
+    auth._user_session_tokens.clear()
+    yield
+    auth._session_cache.clear()
+    auth._user_session_tokens.clear()
+
+
+def test_invalidate_user_sessions_drops_only_that_users_tokens():
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    auth.cache_session("a1", make_user("alice"), expires_at)
+    auth.cache_session("a2", make_user("alice"), expires_at)
+    auth.cache_session("b1", make_user("bob"), expires_at)
+
+    auth.invalidate_user_sessions("alice")
+
+    assert "a1" not in auth._session_cache
+    assert "a2" not in auth._session_cache
+    assert "b1" in auth._session_cache
+    assert "alice" not in auth._user_session_tokens
+
+
+def test_user_index_forgets_evicted_tokens():
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    auth.cache_session("a1", make_user("alice"), expires_at)
+    auth._session_cache.pop("a1")
+    auth.cache_session("a2", make_user("alice"), expires_at)
+
+    assert auth._user_session_tokens["alice"] == {"a2"}
+
+
+def test_get_current_user_serves_cached_session(server_db):
+    server_db.user_sessions = FakeCollection([{
+        "user_id": "alice",
+        "session_token": "tok",
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=1)
+    }])
+    server_db.users = FakeCollection([{
+        "user_id": "alice", "email": "alice@example.com", "name": "Alice",
+        "created_at": datetime.now(timezone.utc)
+    }])
+
+    first = asyncio.run(auth.get_current_user(make_request("tok")))
+    second = asyncio.run(auth.get_current_user(make_request("tok")))
+
+    assert first.user_id == second.user_id == "alice"
+    assert server_db.user_sessions.finds == 1
+
+    auth.invalidate_user_sessions("alice")
+    asyncio.run(auth.get_current_user(make_request("tok")))
+    assert server_db.user_sessions.finds == 2
+
+
+@pytest.mark.parametrize("status,cached", [(401, True), (404, True), (408, False), (429, False), (503, False)])
+def test_only_definitive_rejections_are_negative_cached(monkeypatch, status, cached):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(status)))
+    monkeypatch.setattr(auth, "_auth_client", client)
+    auth._invalid_session_ids.clear()
+
+    with pytest.raises(auth.HTTPException):
+        asyncio.run(auth.exchange_session_id(f"sid-{status}"))
+
+    assert (f"sid-{status}" in auth._invalid_session_ids) is cached
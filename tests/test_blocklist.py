@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import blocklist
+from blocklist import BlocklistMatcher
+
+
+@pytest.fixture(autouse=True)
+def clear_matchers():
+    blocklist._matchers.clear()
+    yield
+    blocklist._matchers.clear()
+
+
+@pytest.mark.parametrize("text,found", [
+    ("you are an ass", "ass"),
+    ("ASS!", "ass"),
+    ("first class seats", None),
+    ("assassin", None),
+    ("brass, glass and a bass", None),
+    ("class ass class", "ass"),
+    ("no words here", None),
+    ("", None),
+])
+def test_only_whole_words_match(text, found):
+    assert BlocklistMatcher(["ass"]).find(text) == found
+
+
+def test_phrases_and_overlapping_words():
+    matcher = BlocklistMatcher(["bad word", "word", "she"])
+
+    assert matcher.find("that is a bad word") in {"bad word", "word"}
+    assert matcher.find("swords and ushers") is None
+    assert matcher.find("ushers, she said") == "she"
+    assert matcher.find("bad words") is None
+
+
+def test_matching_uses_normalized_text():
+    matcher = BlocklistMatcher(["Straße"])
+
+    assert matcher.find("what a STRASSE") == "strasse"
+    assert BlocklistMatcher(["ｆｏｏ"]).find("foo bar") == "foo"
+
+
+def test_empty_lists_never_match():
+    assert not BlocklistMatcher(["", "  "])
+    assert BlocklistMatcher([]).find("anything") is None
+
+
+def test_matchers_are_rebuilt_when_settings_change():
+    first = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    settings = {"blocked_words": ["spoiler"], "updated_at": first}
+
+    matcher = blocklist.matcher_for("creator", settings)
+    assert blocklist.matcher_for("creator", settings) is matcher
+
+    updated = {"blocked_words": ["ending"], "updated_at": datetime(2026, 1, 2, tzinfo=timezone.utc)}
+    assert blocklist.matcher_for("creator", updated).find("the ending") == "ending"
+    assert blocklist.matcher_for("creator", None).find("the ending") is None
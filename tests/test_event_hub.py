@@ -0,0 +1,130 @@
+import asyncio
+import json
+
+from event_hub import StreamEventHub, Subscription, sum_merge
+
+
+def frames(subscription):
+    return [json.loads(frame) for frame in asyncio.run(subscription.next_frames(timeout=0.01))]
+
+
+def test_keyed_events_replace_and_merge_within_a_tick():
+    hub = StreamEventHub()
+    subscription = hub.subscribe("s1")
+
+    hub.publish("s1", "viewers", {"viewer_count": 10}, key="viewers")
+    hub.publish("s1", "viewers", {"viewer_count": 12}, key="viewers")
+    for amount in (5, 7):
+        hub.publish("s1", "leaderboard_delta", {"user_id": "alice", "amount": amount, "count": 1},
+                    key="leaderboard:alice", merge=sum_merge("amount", "count"))
+    hub.publish("s1", "chat_retraction", {"message_id": "m1"})
+    hub._fan_out()
+
+    [frame] = frames(subscription)
+    assert [event["data"] for event in frame["events"]] == [
+        {"viewer_count": 12},
+        {"user_id": "alice", "amount": 12, "count": 2},
+        {"message_id": "m1"}
+    ]
+    assert hub.stats()["events_coalesced"] == 2
+
+
+def test_each_tick_sends_one_frame_shared_by_all_subscribers():
+    hub = StreamEventHub()
+    first, second = hub.subscribe("s1"), hub.subscribe("s1")
+
+    hub.publish("s1", "milestone", {"milestone_type": "100_reactions"}, seq=3)
+    hub._fan_out()
+    hub._fan_out()  # Nothing pending: no empty frame
+
+    assert frames(first) == frames(second)
+    assert len(frames(hub.subscribe("s1"))) == 0
+    assert hub.stats()["frames_sent"] == 2
+
+
+def test_events_without_subscribers_are_not_buffered():
+    hub = StreamEventHub()
+    hub.publish("s1", "gift", {"gift_price": 10})
+
+    assert hub._pending == {}
+    assert hub.stats()["events_published"] == 0
+
+
+def test_gift_storm_coalesces_per_sender_and_gift():
+    hub = StreamEventHub(max_events_per_tick=10)
+    subscription = hub.subscribe("s1")
+
+    for i in range(1000):
+        sender = f"user_{i % 4}"
+        hub.publish("s1", "gift", {"sender_id": sender, "count": 1, "total": 10},
+                    key=f"gift:{sender}:rose", merge=sum_merge("count", "total"))
+    hub._fan_out()
+
+    [frame] = frames(subscription)
+    assert sorted(event["data"]["count"] for event in frame["events"]) == [250, 250, 250, 250]
+    assert hub.stats()["events_dropped"] == 0
+
+
+def test_dropped_events_are_followed_by_a_resync_frame():
+    hub = StreamEventHub(max_events_per_tick=2)
+    subscription = hub.subscribe("s1")
+    quiet = hub.subscribe("s2")
+
+    for i in range(3):
+        hub.publish("s1", "chat_retraction", {"message_id": f"m{i}"})
+    hub.publish("s2", "chat_retraction", {"message_id": "other"})
+    hub._fan_out()
+
+    events, resync = frames(subscription)
+    assert len(events["events"]) == 2
+    assert resync == {"stream_id": "s1", "type": "resync", "reason": "events_dropped"}
+    assert [frame["type"] for frame in frames(quiet)] == ["events"]
+    assert hub.stats()["events_dropped"] == 1
+
+    # The next tick starts clean
+    hub.publish("s1", "chat_retraction", {"message_id": "m3"})
+    hub._fan_out()
+    assert [frame["type"] for frame in frames(subscription)] == ["events"]
+
+
+def test_slow_subscribers_get_a_resync_instead_of_a_backlog():
+    subscription = Subscription("s1", max_frames=3)
+
+    for i in range(5):
+        subscription.push(json.dumps({"n": i}))
+
+    received = frames(subscription)
+    assert received[0]["type"] == "resync"
+    assert [frame.get("n") for frame in received[1:]] == [3, 4]
+    assert subscription.overflows == 1
+
+
+def test_dropped_sequenced_events_hold_back_last_seq():
+    hub = StreamEventHub(max_events_per_tick=2)
+    subscription = hub.subscribe("s1")
+
+    for seq in range(1, 5):
+        hub.publish("s1", "gift", {"gift_price": seq}, seq=seq)
+    hub.publish("s1", "viewers", {"viewer_count": 3}, key="viewers")  # Dropped, unsequenced
+    hub._fan_out()
+
+    events, resync = frames(subscription)
+    assert [event["seq"] for event in events["events"]] == [1, 2]
+    assert events["last_seq"] == 2
+    assert events["gap_from"] == resync["gap_from"] == 3
+
+
+def test_last_seq_stops_below_the_lowest_dropped_seq():
+    hub = StreamEventHub(max_events_per_tick=2)
+    subscription = hub.subscribe("s1")
+
+    hub.publish("s1", "battle_score", {"team": "red", "score": 1}, key="score:red", seq=1)
+    hub.publish("s1", "gift", {"gift_price": 2}, seq=2)
+    hub.publish("s1", "gift", {"gift_price": 3}, seq=3)  # Dropped
+    hub.publish("s1", "battle_score", {"team": "red", "score": 4}, key="score:red", seq=4)  # Kept under its key
+    hub._fan_out()
+
+    events, _ = frames(subscription)
+    assert sorted(event["seq"] for event in events["events"]) == [2, 4]
+    assert events["last_seq"] == 2
+    assert events["gap_from"] == 3
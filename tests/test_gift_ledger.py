@@ -0,0 +1,185 @@
+import asyncio
+from types import SimpleNamespace
+
+import gift_ledger
+from gift_ledger import GiftLedger
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return list(self.docs)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self.failures = 0  # bulk_write calls left to fail
+        self.delay = 0
+
+    async def bulk_write(self, ops, ordered=True):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("write failed")
+        self.docs.extend(op._doc for op in ops if hasattr(op, "_doc"))
+
+    async def insert_many(self, docs):
+        self.docs.extend(docs)
+
+    def find(self, query, projection=None):
+        return FakeCursor([dict(doc) for doc in self.docs])
+
+    async def delete_many(self, query):
+        ids = set(query["id"]["$in"])
+        self.docs = [doc for doc in self.docs if doc["id"] not in ids]
+
+
+class FakeMatches:
+    """Applies the ledger's idempotent score updates to match documents."""
+
+    def __init__(self, *docs):
+        self.docs = [dict(doc) for doc in docs]
+        self.failures = 0
+        self.partial = False  # Apply the updates, then report a failure anyway
+
+    async def bulk_write(self, ops, ordered=True):
+        if self.failures and not self.partial:
+            self.failures -= 1
+            raise RuntimeError("write failed")
+        for op in ops:
+            query, update = op._filter, op._doc
+            for doc in self.docs:
+                applied = doc.setdefault("applied_score_batches", [])
+                if doc["match_id"] == query["match_id"] and query["applied_score_batches"]["$ne"] not in applied:
+                    for field, delta in update["$inc"].items():
+                        doc[field] = doc.get(field, 0) + delta
+                    applied.append(update["$addToSet"]["applied_score_batches"])
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("write failed after applying")
+
+
+def make_db():
+    return SimpleNamespace(
+        gifts=FakeCollection(),
+        transactions=FakeCollection(),
+        battle_participants=FakeCollection(),
+        battle_matches=FakeMatches({"match_id": "m1", "team_a_score": 0, "team_b_score": 0}),
+        gift_ledger_dead_letters=FakeCollection()
+    )
+
+
+def make_gift(gift_id):
+    return {
+        "id": gift_id,
+        "stream_id": "stream_1",
+        "sender_id": "alice",
+        "recipient_id": "bob",
+        "gift_name": "Rose",
+        "gift_price": 10
+    }
+
+
+def test_stop_writes_a_batch_interrupted_mid_flush():
+    async def scenario():
+        db = make_db()
+        db.gifts.delay = 0.2
+        ledger = GiftLedger(db, flush_interval_ms=5)
+        await ledger.start()
+        ledger.record(make_gift("g1"), 7)
+        await asyncio.sleep(0.05)  # The flush loop has taken the batch and is writing it
+        assert ledger.pending_count() == 0
+
+        await ledger.stop()
+        return db, ledger
+
+    db, ledger = asyncio.run(scenario())
+    assert [gift["id"] for gift in db.gifts.docs] == ["g1"]
+    assert len(db.transactions.docs) == 2
+    assert ledger.pending_count() == 0
+
+
+def test_exhausted_retries_are_dead_lettered_and_replayed():
+    async def scenario():
+        db = make_db()
+        db.gifts.failures = gift_ledger.GIFT_LEDGER_MAX_RETRIES + 1
+        ledger = GiftLedger(db)
+        ledger.record(make_gift("g1"), 7)
+        for _ in range(gift_ledger.GIFT_LEDGER_MAX_RETRIES + 1):
+            await ledger.flush()
+
+        assert ledger.pending_count() == 0
+        assert [letter["gift"]["id"] for letter in db.gift_ledger_dead_letters.docs] == ["g1"]
+        assert db.gifts.docs == []
+
+        # The next process start replays the dead letter
+        restarted = GiftLedger(db)
+        await restarted.start()
+        await restarted.stop()
+        return db
+
+    db = asyncio.run(scenario())
+    assert [gift["id"] for gift in db.gifts.docs] == ["g1"]
+    assert db.gift_ledger_dead_letters.docs == []
+
+
+def test_gifts_stay_buffered_when_dead_lettering_fails():
+    async def scenario():
+        db = make_db()
+        db.gifts.failures = gift_ledger.GIFT_LEDGER_MAX_RETRIES + 1
+
+        async def unavailable(docs):
+            raise RuntimeError("dead letters unavailable")
+
+        db.gift_ledger_dead_letters.insert_many = unavailable
+        ledger = GiftLedger(db)
+        ledger.record(make_gift("g1"), 7)
+        for _ in range(gift_ledger.GIFT_LEDGER_MAX_RETRIES + 1):
+            await ledger.flush()
+        return ledger
+
+    ledger = asyncio.run(scenario())
+    assert ledger.pending_count() == 1
+
+
+def test_failed_battle_scores_are_dead_lettered_and_applied_once():
+    async def scenario():
+        db = make_db()
+        db.battle_participants.docs = [{"user_id": "bob", "match_id": "m1", "team": "team_a"}]
+        db.battle_matches.failures = gift_ledger.GIFT_LEDGER_MAX_RETRIES + 1
+        ledger = GiftLedger(db)
+        ledger.record(make_gift("g1"), 7)
+        for _ in range(gift_ledger.GIFT_LEDGER_MAX_RETRIES + 1):
+            await ledger.flush()
+
+        assert [letter.get("type") for letter in db.gift_ledger_dead_letters.docs] == ["battle_score"]
+        assert db.battle_matches.docs[0]["team_a_score"] == 0
+
+        restarted = GiftLedger(db)
+        await restarted.start()
+        await restarted.stop()
+        return db
+
+    db = asyncio.run(scenario())
+    assert db.battle_matches.docs[0]["team_a_score"] == 10
+    assert db.gift_ledger_dead_letters.docs == []
+
+
+def test_retried_battle_score_is_not_applied_twice():
+    async def scenario():
+        db = make_db()
+        db.battle_participants.docs = [{"user_id": "bob", "match_id": "m1", "team": "team_b"}]
+        db.battle_matches.failures = 1
+        db.battle_matches.partial = True
+        ledger = GiftLedger(db)
+        ledger.record(make_gift("g1"), 7)
+        await ledger.flush()  # Score lands but the write reports an error
+        await ledger.flush()  # Retry
+        return db
+
+    db = asyncio.run(scenario())
+    assert db.battle_matches.docs[0]["team_b_score"] == 10
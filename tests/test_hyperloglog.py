@@ -0,0 +1,51 @@
+import pytest
+
+from hyperloglog import HyperLogLog
+
+
+def sketch(values, precision=12):
+    hll = HyperLogLog(precision)
+    for value in values:
+        hll.add(value)
+    return hll
+
+
+def test_small_counts_are_close_to_exact_and_ignore_repeats():
+    hll = sketch([f"viewer_{i}" for i in range(100)] * 3)
+
+    assert 98 <= hll.count() <= 102
+
+
+def test_large_counts_stay_within_a_few_percent():
+    assert abs(sketch(f"viewer_{i}" for i in range(50000)).count() - 50000) < 50000 * 0.05
+
+
+def test_merge_counts_the_union():
+    first = sketch(f"viewer_{i}" for i in range(0, 3000))
+    second = sketch(f"viewer_{i}" for i in range(2000, 5000))
+
+    first.merge(second)
+
+    assert first.registers == sketch(f"viewer_{i}" for i in range(5000)).registers
+    assert abs(first.count() - 5000) < 5000 * 0.05
+
+
+def test_merge_rejects_other_precisions():
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(10))
+
+
+def test_serialisation_round_trips():
+    hll = sketch((f"viewer_{i}" for i in range(1000)), precision=10)
+
+    restored = HyperLogLog.from_bytes(hll.to_bytes())
+
+    assert restored.precision == 10
+    assert restored.registers == hll.registers
+    assert restored.count() == hll.count()
+    assert restored.add("viewer_1") is False
+
+
+def test_corrupt_registers_are_rejected():
+    with pytest.raises(ValueError):
+        HyperLogLog.from_bytes(HyperLogLog(12).to_bytes()[:-1])
@@ -0,0 +1,191 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from matchmaker import AlreadyQueuedError, Matchmaker
+from matchmaking import create_battle_match
+
+
+def matches(doc, query):
+    if "$or" in query:
+        return any(matches(doc, branch) for branch in query["$or"])
+    return all(doc.get(field) in condition["$in"] if isinstance(condition, dict) else doc.get(field) == condition
+               for field, condition in query.items())
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        self.docs.append(dict(doc))
+
+    async def insert_many(self, docs):
+        await asyncio.sleep(0.01)
+        self.docs.extend(dict(doc) for doc in docs)
+
+    async def update_many(self, query, update):
+        hits = [doc for doc in self.docs if matches(doc, query)]
+        for doc in hits:
+            doc.update(update.get("$set", {}))
+            for field in update.get("$unset", {}):
+                doc.pop(field, None)
+        return SimpleNamespace(modified_count=len(hits))
+
+    async def update_one(self, query, update):
+        return SimpleNamespace(modified_count=0)
+
+    async def delete_many(self, query):
+        kept = [doc for doc in self.docs if not matches(doc, query)]
+        deleted, self.docs = len(self.docs) - len(kept), kept
+        return SimpleNamespace(deleted_count=deleted)
+
+
+def make_matchmaker(create_match=create_battle_match):
+    db = SimpleNamespace(matchmaking_queue=FakeCollection(), battle_matches=FakeCollection(),
+                         battle_participants=FakeCollection())
+    return Matchmaker(db, create_match)
+
+
+def make_entries(leader_id, *guest_ids, team_size="1v1", rating=1000, waited=0):
+    now = datetime.now(timezone.utc) - timedelta(seconds=waited)
+    return [{
+        "user_id": user_id,
+        "team_size": team_size,
+        "region": "global",
+        "rating": rating,
+        "status": "waiting",
+        "joined_at": now,
+        "expires_at": now + timedelta(seconds=120)
+    } for user_id in (leader_id,) + guest_ids]
+
+
+def teams(matchmaker):
+    """{user_id: team} of the single match created so far."""
+    return {p["user_id"]: p["team"] for p in matchmaker.db.battle_participants.docs}
+
+
+def queue(matchmaker, *parties):
+    for entries in parties:
+        asyncio.run(matchmaker.enqueue(entries))
+
+
+def test_concurrent_joins_queue_a_user_once():
+    matchmaker = make_matchmaker()
+
+    async def scenario():
+        return await asyncio.gather(
+            matchmaker.enqueue(make_entries("alice")),
+            matchmaker.enqueue(make_entries("alice")),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+
+    assert sum(isinstance(result, AlreadyQueuedError) for result in results) == 1
+    assert [doc["user_id"] for doc in matchmaker.db.matchmaking_queue.docs] == ["alice"]
+    assert matchmaker.bucket_size("1v1", "global") == 1
+
+
+def test_queued_guest_cannot_join_another_party():
+    matchmaker = make_matchmaker()
+    asyncio.run(matchmaker.enqueue(make_entries("alice", "bob", team_size="2v2")))
+
+    with pytest.raises(AlreadyQueuedError):
+        asyncio.run(matchmaker.enqueue(make_entries("carol", "bob", team_size="2v2")))
+
+    assert not matchmaker.is_queued("carol")
+
+
+def test_parties_are_packed_onto_one_team():
+    matchmaker = make_matchmaker()
+    queue(matchmaker,
+          make_entries("alice", "ann", team_size="3v3", waited=3),
+          make_entries("bob", "ben", "bea", team_size="3v3", waited=2),
+          make_entries("carol", team_size="3v3", waited=1))
+
+    assert asyncio.run(matchmaker.try_match("3v3", "global"))
+    assert teams(matchmaker) == {
+        "alice": "team_a", "ann": "team_a", "carol": "team_a",
+        "bob": "team_b", "ben": "team_b", "bea": "team_b"
+    }
+    assert matchmaker.bucket_size("3v3", "global") == 0
+
+
+def test_single_anchor_is_completed_by_a_single_not_a_split_party():
+    matchmaker = make_matchmaker()
+    queue(matchmaker,
+          make_entries("alice", team_size="2v2", waited=3),
+          make_entries("bob", "ben", team_size="2v2", waited=2),
+          make_entries("carol", team_size="2v2", waited=1))
+
+    assert asyncio.run(matchmaker.try_match("2v2", "global"))
+    assert teams(matchmaker) == {"alice": "team_a", "carol": "team_a", "bob": "team_b", "ben": "team_b"}
+
+
+def test_closest_rated_opponent_is_chosen():
+    matchmaker = make_matchmaker()
+    queue(matchmaker,
+          make_entries("alice", rating=1000, waited=2),
+          make_entries("bob", rating=1090),
+          make_entries("carol", rating=1040))
+
+    assert asyncio.run(matchmaker.try_match("1v1", "global"))
+    assert teams(matchmaker) == {"alice": "team_a", "carol": "team_b"}
+    assert matchmaker.is_queued("bob")
+
+
+def test_rating_outliers_match_once_the_window_is_relaxed(monkeypatch):
+    monkeypatch.setattr("matchmaker.MATCHMAKER_RATING_RELAX_SECONDS", 60)
+    matchmaker = make_matchmaker()
+    queue(matchmaker, make_entries("alice", rating=1000, waited=30), make_entries("bob", rating=2500))
+    assert asyncio.run(matchmaker.try_match("1v1", "global")) is None
+
+    matchmaker = make_matchmaker()
+    queue(matchmaker, make_entries("alice", rating=1000, waited=61), make_entries("bob", rating=2500))
+    assert asyncio.run(matchmaker.try_match("1v1", "global"))
+
+
+def test_leave_during_match_creation_aborts_the_match():
+    created = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_create_match(players, team_size, db):
+        created.set()
+        await release.wait()
+        return await create_battle_match(players, team_size, db)
+
+    matchmaker = make_matchmaker(slow_create_match)
+    queue(matchmaker, make_entries("alice", waited=2), make_entries("bob", waited=1))
+
+    async def scenario():
+        matching = asyncio.create_task(matchmaker.try_match("1v1", "global"))
+        await created.wait()
+        await matchmaker.remove("bob")
+        release.set()
+        return await matching
+
+    assert asyncio.run(scenario()) is None
+    assert matchmaker.db.battle_matches.docs == []
+    assert not matchmaker.is_queued("bob")
+    assert matchmaker.bucket_size("1v1", "global") == 1
+    assert [doc["status"] for doc in matchmaker.db.matchmaking_queue.docs] == ["waiting"]
+
+    # Alice kept her place and matches the next player
+    queue(matchmaker, make_entries("carol"))
+    assert asyncio.run(matchmaker.try_match("1v1", "global"))
+    assert teams(matchmaker) == {"alice": "team_a", "carol": "team_b"}
+
+
+def test_participants_get_distinct_nonzero_agora_uids():
+    matchmaker = make_matchmaker()
+    queue(matchmaker,
+          make_entries("alice", "ann", team_size="2v2", waited=2),
+          make_entries("bob", "ben", team_size="2v2", waited=1))
+
+    assert asyncio.run(matchmaker.try_match("2v2", "global"))
+    uids = [p["agora_uid"] for p in matchmaker.db.battle_participants.docs]
+    assert len(set(uids)) == 4
+    assert all(0 < uid < 2**31 for uid in uids)
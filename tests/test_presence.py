@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+
+from presence import PresenceAggregator
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return list(self.docs)
+
+
+class FakeStreams:
+    def __init__(self, *live_ids):
+        self.live = set(live_ids)
+        self.writes = []
+
+    async def find_one(self, query, projection=None):
+        return {"_id": 1} if query["id"] in self.live else None
+
+    def find(self, query, projection=None):
+        return FakeCursor([])
+
+    async def bulk_write(self, ops, ordered=True):
+        self.writes.extend(op._filter["id"] for op in ops)
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=None):
+        return {"peak_viewers": 1, "avg_viewers": 1, "unique_viewers": 1}
+
+
+class FakeViews:
+    def __init__(self):
+        self.pairs = set()
+
+    async def bulk_write(self, ops, ordered=True):
+        upserted = {}
+        for index, op in enumerate(ops):
+            pair = (op._filter["user_id"], op._filter["stream_id"])
+            if pair not in self.pairs:
+                self.pairs.add(pair)
+                upserted[index] = pair
+        return SimpleNamespace(upserted_ids=upserted)
+
+
+class FakeUsers:
+    def __init__(self):
+        self.watched = {}
+
+    async def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            user_id = op._filter["user_id"]
+            self.watched[user_id] = self.watched.get(user_id, 0) + op._doc["$inc"]["streams_watched"]
+
+
+def make_presence(*live_ids, **kwargs):
+    db = SimpleNamespace(streams=FakeStreams(*live_ids), stream_views=FakeViews(), users=FakeUsers())
+    return PresenceAggregator(db, **kwargs)
+
+
+def test_heartbeats_for_streams_that_are_not_live_are_ignored():
+    presence = make_presence("live")
+
+    assert asyncio.run(presence.heartbeat("ended", "v1")) is False
+    assert presence.stats("ended") is None
+    assert asyncio.run(presence.heartbeat("live", "v1")) is True
+    assert asyncio.run(presence.heartbeat("live", "v1")) is False
+    assert presence.current_viewers("live") == 1
+
+
+def test_streams_watched_counts_each_user_and_stream_once():
+    presence = make_presence("s1", "s2")
+
+    async def scenario():
+        await presence.heartbeat("s1", "v1", user_id="alice")
+        await presence.heartbeat("s1", "v2", user_id="alice")  # Second device
+        await presence.heartbeat("s2", "v1", user_id="alice")
+        await presence.heartbeat("s1", "v3")  # Anonymous viewers get no credit
+        await presence.flush()
+        presence.leave("s1", "v1")
+        await presence.heartbeat("s1", "v1", user_id="alice")  # Rejoin
+        await presence.flush()
+
+    asyncio.run(scenario())
+    assert presence.db.users.watched == {"alice": 2}
+
+
+def test_idle_streams_are_evicted_and_ended_streams_stay_gone():
+    presence = make_presence("s1", "s2", idle_seconds=0)
+
+    async def scenario():
+        await presence.heartbeat("s1", "v1")
+        presence.leave("s1", "v1")
+        await presence.heartbeat("s2", "v1")
+        await asyncio.sleep(0.01)
+        await presence.flush()
+        assert presence.stats("s1") is None
+        assert presence.stats("s2") is not None
+
+        await presence.end_stream("s2")
+        return await presence.heartbeat("s2", "v2")
+
+    assert asyncio.run(scenario()) is False
+    assert presence.stats("s2") is None
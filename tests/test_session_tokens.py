@@ -0,0 +1,98 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import session_tokens
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return list(self.docs)
+
+
+class FakeRevocations:
+    """Just enough of a collection for session_tokens' upserts and reloads."""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query["user_id"], {"user_id": query["user_id"]})
+        for field, value in update["$max"].items():
+            doc[field] = max(doc[field], value) if field in doc else value
+
+    def find(self, query, projection=None):
+        field, condition = next(iter(query.items()))
+        bound = next(iter(condition.values()))
+        return FakeCursor([dict(doc) for doc in self.docs.values() if doc[field] >= bound])
+
+
+class FakeTokenIds:
+    def find(self, query, projection=None):
+        return FakeCursor([])
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(session_tokens, "SESSION_TOKEN_MODE", "signed")
+    monkeypatch.setattr(session_tokens, "SESSION_SIGNING_SECRET", "test-secret")
+    monkeypatch.setattr(session_tokens, "_revoked", {})
+    monkeypatch.setattr(session_tokens, "_revoked_before", {})
+    monkeypatch.setattr(session_tokens, "_cutoffs_loaded_at", None)
+    return SimpleNamespace(session_revocations=FakeRevocations(), revoked_sessions=FakeTokenIds())
+
+
+def expiry():
+    return datetime.now(timezone.utc) + timedelta(days=7)
+
+
+def issue_later(user_id):
+    # Issue times have millisecond resolution
+    time.sleep(0.002)
+    return session_tokens.issue_token(user_id, expiry())
+
+
+def test_user_revocation_rejects_every_earlier_token(db):
+    first = session_tokens.issue_token("alice", expiry())
+    second = issue_later("alice")
+    other = session_tokens.issue_token("bob", expiry())
+
+    time.sleep(0.002)
+    asyncio.run(session_tokens.revoke_user_tokens("alice", expiry(), db))
+
+    assert session_tokens.verify_token(first) is None
+    assert session_tokens.verify_token(second) is None
+    assert session_tokens.verify_token(other)[0] == "bob"
+    assert session_tokens.verify_token(issue_later("alice"))[0] == "alice"
+
+
+def test_other_workers_pick_up_cutoffs_on_reload(db, monkeypatch):
+    token = session_tokens.issue_token("alice", expiry())
+    time.sleep(0.002)
+    asyncio.run(session_tokens.revoke_user_tokens("alice", expiry(), db))
+
+    # A fresh worker: empty local state, same database
+    monkeypatch.setattr(session_tokens, "_revoked_before", {})
+    assert session_tokens.verify_token(token) is not None
+    asyncio.run(session_tokens.load_revocations(db))
+    assert session_tokens.verify_token(token) is None
+
+    # Incremental reloads still see later revocations
+    token = issue_later("bob")
+    time.sleep(0.002)
+    asyncio.run(session_tokens.revoke_user_tokens("bob", expiry(), db))
+    monkeypatch.setattr(session_tokens, "_revoked_before", {})
+    asyncio.run(session_tokens.load_revocations(db))
+    assert session_tokens.verify_token(token) is None
+
+
+def test_tampered_token_is_rejected(db):
+    token = session_tokens.issue_token("alice", expiry())
+    body, signature = token.rsplit(".", 1)
+    assert session_tokens.verify_token(f"{body}.{signature[:-2]}xx") is None
@@ -0,0 +1,109 @@
+import asyncio
+from types import SimpleNamespace
+
+from stream_event_log import StreamEventLog
+
+
+class FakeCounters:
+    def __init__(self):
+        self.seqs = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        stream_id = query["stream_id"]
+        self.seqs[stream_id] = self.seqs.get(stream_id, 0) + update["$inc"]["seq"]
+        return {"seq": self.seqs[stream_id]}
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs.sort(key=lambda doc: doc[field] * direction)
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeEvents:
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+
+    async def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            update = op._doc
+            entries = update["$push"]["events"]["$each"]
+            self.docs.append({
+                "stream_id": op._filter["stream_id"],
+                "events": list(entries),
+                "first_seq": update["$min"]["first_seq"],
+                "last_seq": update["$max"]["last_seq"]
+            })
+
+    def find(self, query, projection=None):
+        after_seq = query["last_seq"]["$gt"]
+        return FakeCursor([
+            dict(doc) for doc in self.docs
+            if doc["stream_id"] == query["stream_id"] and doc["last_seq"] > after_seq
+        ])
+
+
+class FakeHub:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, stream_id, event_type, data, key=None, merge=None, seq=None):
+        self.published.append((stream_id, event_type, seq))
+
+
+def make_log(docs=None):
+    db = SimpleNamespace(stream_event_counters=FakeCounters(), stream_events=FakeEvents(docs))
+    return StreamEventLog(db, events=FakeHub()), db
+
+
+def bucket(first_seq, seqs):
+    return {
+        "stream_id": "s1",
+        "first_seq": first_seq,
+        "last_seq": max(seqs),
+        "events": [{"seq": seq, "type": "gift", "data": {}} for seq in seqs]
+    }
+
+
+def test_log_only_events_are_written_but_not_published():
+    log, db = make_log()
+    log.append("s1", "reaction", {"reaction_type": "fire"}, live=False)
+    log.append("s1", "gift", {"gift_price": 10})
+
+    assert asyncio.run(log.flush()) == 2
+    assert log.events.published == [("s1", "gift", 2)]
+    assert [event["type"] for event in db.stream_events.docs[0]["events"]] == ["reaction", "gift"]
+
+
+def test_streams_reserve_sequence_numbers_concurrently():
+    log, db = make_log()
+    for stream_id in ("s1", "s2", "s3"):
+        log.append(stream_id, "gift", {})
+
+    assert asyncio.run(log.flush()) == 3
+    assert db.stream_event_counters.max_in_flight == 3
+
+
+def test_read_returns_lowest_seqs_across_interleaved_buckets():
+    # A retried write can land in a later bucket holding lower seqs
+    log, _ = make_log([bucket(1, [1, 2, 7, 8]), bucket(3, [3, 9]), bucket(4, [4, 5, 6]), bucket(10, [10])])
+
+    events = asyncio.run(log.read("s1", after_seq=1, limit=5))
+
+    assert [event["seq"] for event in events] == [2, 3, 4, 5, 6]
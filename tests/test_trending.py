@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import trending
+from trending import DecayingCounter, TrendingEngine
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return list(self.docs)
+
+
+class FakeStreams:
+    def __init__(self, *docs):
+        self.docs = list(docs)
+
+    def find(self, query, projection=None):
+        return FakeCursor([dict(doc) for doc in self.docs if doc.get("is_live")])
+
+
+def stream(stream_id, **fields):
+    return {"id": stream_id, "host_id": f"host_{stream_id}", "title": stream_id, "is_live": True, **fields}
+
+
+def test_counters_halve_every_half_life():
+    counter = DecayingCounter(updated=0.0)
+    counter.add(100, now=0.0)
+
+    assert counter.current(now=trending.SIGNAL_HALF_LIFE_SECONDS) == pytest.approx(50)
+    counter.add(50, now=trending.SIGNAL_HALF_LIFE_SECONDS)
+    assert counter.current(now=trending.SIGNAL_HALF_LIFE_SECONDS * 2) == pytest.approx(50)
+
+
+def test_older_gifts_weigh_less(monkeypatch):
+    engine = TrendingEngine(lambda stream_id: {})
+    engine.register_stream(stream("old"))
+    engine.register_stream(stream("fresh"))
+    for stream_id in ("old", "fresh"):
+        engine._streams[stream_id].gifts = DecayingCounter(updated=0.0)
+    engine._streams["old"].gifts.add(100, now=0.0)
+    engine._streams["fresh"].gifts.add(60, now=trending.SIGNAL_HALF_LIFE_SECONDS)
+
+    monkeypatch.setattr(trending.time, "monotonic", lambda: trending.SIGNAL_HALF_LIFE_SECONDS)
+    ranked = engine.rescore()
+
+    assert [s["id"] for s in ranked] == ["fresh", "old"]
+
+
+def test_new_creator_boost_expires():
+    engine = TrendingEngine(lambda stream_id: {"viewer_count": 10})
+    engine.register_stream(stream("new"), new_creator=True)
+    engine.register_stream(stream("late"), new_creator=True, age_seconds=trending.NEW_CREATOR_BOOST_SECONDS + 1)
+
+    scores = {s["id"]: s["rank_score"] for s in engine.rescore()}
+
+    assert scores["new"] == pytest.approx(scores["late"] * trending.NEW_CREATOR_BOOST)
+
+
+def test_sync_picks_up_streams_from_other_workers_and_drops_ended_ones():
+    started = (datetime.utcnow() - timedelta(seconds=30)).isoformat()
+    db = SimpleNamespace(streams=FakeStreams(stream("a"), stream("b", started_at=started, new_creator=True)))
+    engine = TrendingEngine(lambda stream_id: {})
+    engine.register_stream(stream("ended_elsewhere"))
+
+    asyncio.run(engine.load_live_streams(db))
+
+    assert {s["id"] for s in engine.top(10)} == {"a", "b"}
+    assert engine._streams["b"].new_creator
+
+    engine.record_gift("a", 50)
+    db.streams.docs[1]["is_live"] = False
+    asyncio.run(engine.load_live_streams(db))
+
+    assert [s["id"] for s in engine.top(10)] == ["a"]
+    assert engine._streams["a"].gifts.current() > 0  # Signals survive a sync
@@ -0,0 +1,151 @@
+import asyncio
+import importlib
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import wallets
+
+
+class FakeWallets:
+    """Wallet collection without a unique user_id index."""
+
+    def __init__(self, *docs):
+        self.docs = [dict(doc) for doc in docs]
+
+    def _matches(self, doc, query):
+        for field, condition in query.items():
+            if isinstance(condition, dict):
+                if doc.get(field) is None or doc[field] < condition["$gte"]:
+                    return False
+            elif doc.get(field) != condition:
+                return False
+        return True
+
+    async def find_one_and_update(self, query, update, upsert=False, projection=None,
+                                  return_document=None, session=None):
+        assert not upsert, "debits must never upsert"
+        for doc in self.docs:
+            if self._matches(doc, query):
+                for field, delta in update["$inc"].items():
+                    doc[field] += delta
+                return {"balance": doc["balance"]}
+        return None
+
+    async def update_one(self, query, update, upsert=False, session=None):
+        if any(self._matches(doc, query) for doc in self.docs):
+            return SimpleNamespace(upserted_id=None)
+        self.docs.append({**query, **update["$setOnInsert"]})
+        return SimpleNamespace(upserted_id=len(self.docs))
+
+
+def test_underfunded_debit_does_not_create_a_second_wallet():
+    db = SimpleNamespace(wallets=FakeWallets({"user_id": "alice", "balance": 5}))
+
+    with pytest.raises(wallets.InsufficientBalanceError):
+        asyncio.run(wallets.debit(db, "alice", 50))
+
+    assert db.wallets.docs == [{"user_id": "alice", "balance": 5}]
+
+
+def test_debit_creates_missing_wallet_with_default_balance():
+    db = SimpleNamespace(wallets=FakeWallets())
+
+    balance = asyncio.run(wallets.debit(db, "alice", 30))
+
+    assert balance == wallets.DEFAULT_WALLET_BALANCE - 30
+    assert len(db.wallets.docs) == 1
+
+
+def test_debit_above_default_for_missing_wallet_fails():
+    db = SimpleNamespace(wallets=FakeWallets())
+
+    with pytest.raises(wallets.InsufficientBalanceError):
+        asyncio.run(wallets.debit(db, "alice", wallets.DEFAULT_WALLET_BALANCE + 1))
+
+    assert db.wallets.docs == [{"user_id": "alice", "balance": wallets.DEFAULT_WALLET_BALANCE}]
+
+
+def test_funded_debit_is_a_single_update():
+    db = SimpleNamespace(wallets=FakeWallets({"user_id": "alice", "balance": 80}))
+
+    assert asyncio.run(wallets.debit(db, "alice", 80)) == 0
+    assert len(db.wallets.docs) == 1
+
+
+class FakeTransactions:
+    def __init__(self, docs):
+        self.docs = docs
+        self.query = None
+
+    def _matches(self, doc, query):
+        if doc["user_id"] != query["user_id"]:
+            return False
+        if "$or" not in query:
+            return True
+        older, same_time = query["$or"]
+        return (doc["created_at"] < older["created_at"]["$lt"]
+                or (doc["created_at"] == same_time["created_at"] and doc["id"] < same_time["id"]["$lt"]))
+
+    def find(self, query, projection=None):
+        self.query = query
+        self.results = [dict(doc) for doc in self.docs if self._matches(doc, query)]
+        return self
+
+    def sort(self, keys):
+        self.results.sort(key=lambda doc: (doc["created_at"], doc["id"]), reverse=True)
+        return self
+
+    def limit(self, n):
+        self.results = self.results[:n]
+        return self
+
+    async def to_list(self, length):
+        return self.results
+
+
+def test_keyset_pages_cover_every_transaction_once():
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    # Pairs of transactions share a timestamp, as a gift's sent/received rows do
+    docs = [{"id": f"t{i:02d}", "user_id": "alice", "created_at": start + timedelta(seconds=i // 2)}
+            for i in range(25)]
+    db = SimpleNamespace(transactions=FakeTransactions(docs + [{**docs[0], "user_id": "bob", "id": "b1"}]))
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = asyncio.run(wallets.list_transactions(db, "alice", cursor, limit=4))
+        seen.extend(doc["id"] for doc in page)
+        if cursor is None:
+            break
+
+    expected = [doc["id"] for doc in sorted(docs, key=lambda d: (d["created_at"], d["id"]), reverse=True)]
+    assert seen == expected
+
+
+def test_cursor_round_trips():
+    created_at = datetime(2026, 3, 4, 5, 6, 7, 890000, tzinfo=timezone.utc)
+
+    cursor = wallets.encode_transactions_cursor(created_at, "txn|with|pipes")
+
+    assert wallets.decode_transactions_cursor(cursor) == (created_at, "txn|with|pipes")
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "bm8tc2VwYXJhdG9y", "bm90LWEtZGF0ZXx0MQ", "%%%"])
+def test_malformed_cursors_raise_value_error(cursor):
+    db = SimpleNamespace(transactions=FakeTransactions([]))
+
+    with pytest.raises(ValueError):
+        asyncio.run(wallets.list_transactions(db, "alice", cursor))
+    assert db.transactions.query is None
+
+
+def test_transactions_route_rejects_malformed_cursor_with_400(monkeypatch):
+    pytest.importorskip("emergentintegrations")
+    monkeypatch.setenv("MONGO_URL", "mongodb://localhost:27017")
+    monkeypatch.setenv("DB_NAME", "roastlive_test")
+    server = importlib.import_module("server")
+
+    with pytest.raises(server.HTTPException) as raised:
+        asyncio.run(server.get_transactions("alice", cursor="not-a-cursor"))
+    assert raised.value.status_code == 400